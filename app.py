@@ -1,11 +1,41 @@
-from flask import Flask, request, render_template, redirect, url_for, flash, jsonify
+from flask import Flask, Response, request, render_template, redirect, url_for, flash, jsonify, g, abort, has_request_context, make_response
+from flask.json.provider import DefaultJSONProvider
 from datetime import datetime, timedelta
+import atexit
 import json
 import os
-from collections import Counter, defaultdict
+from collections import Counter, defaultdict, deque
 import csv
+import functools
+import gzip
+import hashlib
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from concurrent.futures import ThreadPoolExecutor
+import cProfile
+from werkzeug.http import http_date, parse_date, parse_etags
+import blockfile
+import instrumentation
+import providers
+import serialization
+import shared_store
+from instrumentation import timed
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Renders jsonify responses with serialization.dumps_json (orjson when installed) outside debug mode."""
+
+    def response(self, *args, **kwargs):
+        if self._app.debug:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(serialization.dumps_json(self._prepare_response_obj(args, kwargs)),
+                                        mimetype=self.mimetype)
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 app.secret_key = 'bnpl_secret_key'
 
 DATA_DIR = 'data'
@@ -14,208 +44,2297 @@ TRANSACTIONS_FILE = os.path.join(DATA_DIR, 'transactions.json')
 REPAYMENTS_FILE = os.path.join(DATA_DIR, 'repayments.json')
 INCOME_VERIFICATIONS_FILE = os.path.join(DATA_DIR, 'income_verifications.json')
 AUDIT_LOG_FILE = os.path.join(DATA_DIR, 'audit_log.json')
+EVENTS_FILE = os.path.join(DATA_DIR, 'events.jsonl')
+CHECKPOINT_FILE = os.path.join(DATA_DIR, 'checkpoint.json')
+ARCHIVE_DIR = os.path.join(DATA_DIR, 'archive')
+ARCHIVE_MANIFEST_FILE = os.path.join(ARCHIVE_DIR, 'manifest.json')
+# Shared columnar copies of the ledgers for multi-worker deployments (BNPL_SHARED_STORE=1)
+SHARED_DIR = os.environ.get('BNPL_SHARED_DIR', os.path.join(DATA_DIR, '.shared'))
+
+# --- Timestamp Helpers ---
+# Records keep their timestamps as integer microseconds since the Unix epoch.
+# ISO strings are parsed once when a data file is ingested and are only
+# produced again at the edges: when saving to disk or rendering a response.
+EPOCH = datetime(1970, 1, 1)
+US_PER_DAY = 86_400_000_000
+
+def to_epoch_us(dt):
+    """Convert a naive datetime to integer microseconds since the Unix epoch."""
+    return (dt - EPOCH) // timedelta(microseconds=1)
+
+def from_epoch_us(us):
+    """Convert integer epoch microseconds back to a naive datetime."""
+    return EPOCH + timedelta(microseconds=us)
+
+def parse_timestamp(value):
+    """Parse an ISO string or datetime into integer epoch microseconds; integers pass through."""
+    if isinstance(value, str):
+        return to_epoch_us(datetime.fromisoformat(value))
+    if isinstance(value, datetime):
+        return to_epoch_us(value)
+    return value
+
+def format_timestamp(us):
+    """Format integer epoch microseconds as an ISO string, the on-disk representation."""
+    return from_epoch_us(us).isoformat()
 
 # --- Data Loaders ---
+# Data files are plain JSON by default. With BNPL_DATA_FORMAT=block, lists of
+# records are saved in the compressed block format of blockfile.py instead;
+# load_json reads either format, so files convert as they are next written.
+DATA_FORMAT = os.environ.get('BNPL_DATA_FORMAT', 'json')
+
+# mkstemp creates files readable by their owner only; save_json gives the new
+# file the mode of the one it replaces, or the umask default for a new file.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
 def load_json(filename):
-    """Load JSON data from a file. Returns an empty list if the file does not exist."""
+    """Load JSON data (or a block-format file) from a file. Returns an empty list if the file does not exist."""
     if not os.path.exists(filename):
         return []
-    with open(filename, 'r') as f:
-        return json.load(f)
+    with open(filename, 'rb') as f:
+        data = f.read()
+    instrumentation.record_io('load_json', len(data), filename)
+    if blockfile.is_block_data(data):
+        return blockfile.decode(data)
+    return json.loads(data)
 
 def save_json(filename, data):
-    """Save data as JSON to a file, using default=str for datetime serialization."""
-    with open(filename, 'w') as f:
-        json.dump(data, f, default=str)
+    """Save data as JSON to a file, using default=str for datetime serialization.
+
+    Lists are written in the block format when BNPL_DATA_FORMAT=block. The file
+    is replaced atomically, so concurrent readers never see a partial write.
+    """
+    if DATA_FORMAT == 'block' and isinstance(data, list):
+        payload = blockfile.encode(data, default=str)
+    else:
+        payload = json.dumps(data, default=str).encode('utf-8')
+    try:
+        mode = os.stat(filename).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = 0o666 & ~_UMASK
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(filename) or '.', prefix='.tmp-', suffix='.json')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+            os.fchmod(f.fileno(), mode)
+        os.replace(tmp_path, filename)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    instrumentation.record_io('save_json', len(payload), filename)
+
+def append_json_rows(filename, rows):
+    """Append rows to a JSON list file in place, without reading the rows already in it.
+
+    The new rows and the closing bracket are written with one write over the
+    old bracket, giving the same bytes save_json would write for the whole
+    list. Returns False, leaving the file as it was, for a missing file or a
+    block-format one, and when the write fails or comes up short (e.g. a full
+    disk); those need a full save_json.
+    """
+    if DATA_FORMAT == 'block':
+        return False
+    try:
+        fd = os.open(filename, os.O_RDWR)
+    except FileNotFoundError:
+        return False
+    try:
+        size = os.fstat(fd).st_size
+        if size < 2 or os.pread(fd, 1, size - 1) != b']' or blockfile.is_block_data(os.pread(fd, len(blockfile.MAGIC), 0)):
+            return False
+        payload = json.dumps(rows, default=str)[1:]
+        if os.pread(fd, 2, size - 2) != b'[]':
+            payload = ', ' + payload
+        payload = payload.encode('utf-8')
+        try:
+            written = os.pwrite(fd, payload, size - 1)
+        except OSError:
+            written = None
+        if written != len(payload):
+            os.ftruncate(fd, size - 1)
+            os.pwrite(fd, b']', size - 1)
+            return False
+    finally:
+        os.close(fd)
+    instrumentation.record_io('append_json', len(payload), filename)
+    return True
+
+# --- User Ids ---
+# Every user name is interned to a small integer id. Registered users keep the
+# 'id' stored on their user record (assigned at registration, or in file order
+# for legacy records without one); names that only appear in ledger rows get a
+# provisional id for the lifetime of the process. Ledger rows are stored with
+# 'user_id', per-user indexes are lists indexed by id, and names are resolved
+# only when building responses.
+class UserRegistry:
+    """Bidirectional mapping between user names and small integer ids."""
+    __slots__ = ('ids', 'names', 'users', 'source', 'generation')
+
+    def __init__(self, users, generation):
+        self.ids = {}
+        self.names = []
+        self.users = []
+        self.source = users
+        self.generation = generation
+        # Stored ids are claimed first so legacy users without one cannot take them
+        for u in users:
+            if isinstance(u.get('id'), int):
+                self._claim(u['id'], u)
+        for u in users:
+            if not isinstance(u.get('id'), int):
+                u['id'] = len(self.names)
+                self._claim(u['id'], u)
+
+    def _claim(self, uid, user):
+        if uid >= len(self.names):
+            self.names.extend([None] * (uid + 1 - len(self.names)))
+            self.users.extend([None] * (uid + 1 - len(self.users)))
+        self.names[uid] = sys.intern(user['name'])
+        self.users[uid] = user
+        # The first user record with a name wins, matching the original first-match lookups
+        self.ids.setdefault(self.names[uid], uid)
+
+    def id_for(self, name, create=True):
+        """Return the id for a user name, allocating a provisional id for unknown names unless create is False."""
+        uid = self.ids.get(name)
+        if uid is None and create:
+            uid = len(self.names)
+            self.names.append(sys.intern(name))
+            self.users.append(None)
+            self.ids[self.names[uid]] = uid
+        return uid
+
+    def name_of(self, uid):
+        """Return the user name for an id."""
+        return self.names[uid]
+
+    def user_of(self, uid):
+        """Return the registered user record for an id, or None for unregistered names."""
+        return self.users[uid] if uid is not None and uid < len(self.users) else None
+
+    def register(self, user):
+        """Assign an id to a newly registered user record, reusing a provisional id for the same name.
+
+        A record that already carries an id (one replayed from the write-ahead log) keeps it.
+        """
+        uid = user.get('id')
+        if not isinstance(uid, int):
+            uid = self.ids.get(user['name'])
+            if uid is None or self.users[uid] is not None:
+                uid = len(self.names)
+                self.names.append(None)
+                self.users.append(None)
+        user['id'] = uid
+        self._claim(uid, user)
+        return uid
+
+_registry = None
+_registry_generation = 0
+_registry_lock = threading.Lock()
+
+def get_user_registry():
+    """Return the user registry, rebuilding it whenever the users file is re-ingested."""
+    global _registry, _registry_generation
+    users = get_all_users()
+    with _registry_lock:
+        if _registry is None or _registry.source is not users:
+            _registry_generation += 1
+            _registry = UserRegistry(users, _registry_generation)
+        return _registry
+
+# --- Compact Record Types ---
+# Purchases and repayments make up almost all of the in-memory working set, so
+# they are held as __slots__ objects keyed by integer user id instead of dicts.
+# They still support dict-style access, so existing callers, templates and
+# csv.DictWriter see the same 'user', 'amount' and 'timestamp' fields.
+class LedgerRecord:
+    """A single purchase or repayment: user id, amount and epoch-microsecond timestamp."""
+    __slots__ = ('user_id', 'amount', 'timestamp')
+    FIELDS = ('user', 'amount', 'timestamp')
+
+    def __init__(self, user_id, amount, timestamp):
+        self.user_id = user_id
+        self.amount = amount
+        self.timestamp = timestamp
+
+    @property
+    def user(self):
+        """The user name, resolved through the registry; loops should pass a registry to to_dict() instead."""
+        return get_user_registry().name_of(self.user_id)
+
+    @classmethod
+    def from_dict(cls, d, registry):
+        """Build a record from a stored row (by 'user_id' or legacy 'user' name), parsing its timestamp."""
+        user_id = d['user_id'] if 'user_id' in d else registry.id_for(d['user'])
+        return cls(user_id, d['amount'], parse_timestamp(d['timestamp']))
+
+    def to_stored(self, registry):
+        """Return the on-disk row; unregistered names are stored by name since their ids are not persisted."""
+        if registry.user_of(self.user_id) is not None:
+            return {'user_id': self.user_id, 'amount': self.amount, 'timestamp': self.timestamp}
+        return {'user': registry.name_of(self.user_id), 'amount': self.amount, 'timestamp': self.timestamp}
+
+    def user_key(self, registry):
+        """Return how the user is persisted: the id of a registered user, otherwise the name."""
+        return self.user_id if registry.user_of(self.user_id) is not None else registry.name_of(self.user_id)
+
+    def to_dict(self, registry=None):
+        """Return the record as a plain dict with the user name resolved through registry (default: the current one)."""
+        name = (registry or get_user_registry()).name_of(self.user_id)
+        return {'user': name, 'amount': self.amount, 'timestamp': self.timestamp}
+
+    def keys(self):
+        return self.FIELDS
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.FIELDS else default
+
+    def __eq__(self, other):
+        return (type(self) is type(other) and self.user_id == other.user_id
+                and self.amount == other.amount and self.timestamp == other.timestamp)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.user_id!r}, {self.amount!r}, {self.timestamp!r})"
+
+class Transaction(LedgerRecord):
+    """A BNPL purchase."""
+    __slots__ = ()
+
+class Repayment(LedgerRecord):
+    """A repayment against a user's outstanding balance."""
+    __slots__ = ()
+
+# --- In-memory Data Stores ---
+# Parsed records are cached per file and re-ingested only when the file changes
+# on disk, so requests no longer pay the ISO parse cost. Callers must treat the
+# returned records as read-only and go through the save_all_* functions to write.
+_stores = {}
+_indexes = {}
+_store_locks = {}
+# Bumped whenever a store is re-ingested or saved; derived caches key on these
+_generations = Counter()
+
+def _file_version(filename):
+    """Return a cheap change marker for a data file: its mtime and size, or None if missing."""
+    try:
+        st = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def _load_store(filename, ts_field, record_type=None):
+    """Return the cached records for a data file, parsing its 'ts_field' timestamps once per file version.
+
+    A ts_field of None keeps rows exactly as stored. With a record_type, rows are
+    converted to that compact ledger type. Those rows reference user ids, so they
+    are also re-ingested when the user registry is rebuilt.
+    """
+    if record_type is not None and shared_store.ENABLED:
+        return _load_shared_ledger(filename, record_type)
+    version = _file_version(filename)
+    registry = None
+    if record_type is not None:
+        registry = get_user_registry()
+        version = (version, registry.generation)
+    cached = _stores.get(filename)
+    if cached is not None and cached[0] == version:
+        instrumentation.record_cache('store', True)
+        return cached[1]
+    instrumentation.record_cache('store', False)
+    with _store_locks.setdefault(filename, threading.Lock()):
+        # Another thread may have ingested this version while we waited
+        cached = _stores.get(filename)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        records = load_json(filename)
+        # Rows appended since the last checkpoint are only in the write-ahead log
+        records.extend(dict(r) for r in _wal_pending.get(filename, ()))
+        if record_type is not None:
+            records = [record_type.from_dict(r, registry) for r in records]
+        elif ts_field is not None:
+            for r in records:
+                r[ts_field] = parse_timestamp(r[ts_field])
+        _stores[filename] = (version, records)
+        _indexes.pop(filename, None)
+        _generations[filename] += 1
+    return records
+
+def _stored_rows(records, ts_field, record_type=None):
+    """Return records as the rows written to disk, with ISO timestamps."""
+    if record_type is not None:
+        registry = get_user_registry()
+        rows = [r.to_stored(registry) for r in records]
+    else:
+        rows = [dict(r) for r in records]
+    if ts_field is not None:
+        for row in rows:
+            row[ts_field] = format_timestamp(row[ts_field])
+    return rows
+
+def _save_store(filename, ts_field, records, record_type=None, appended=None):
+    """Write records to disk with ISO timestamps and keep them as the cached parsed copy.
+
+    'appended' lists the records just appended to 'records', so the per-user
+    index is extended instead of rebuilt. In shared-store mode a ledger is
+    instead republished to the shared snapshot; appends go through
+    _append_ledger, which writes only the new rows.
+    """
+    registry = get_user_registry() if record_type is not None else None
+    rows = _stored_rows(records, ts_field, record_type)
+    if record_type is not None and shared_store.ENABLED:
+        with _write_lock:
+            save_json(filename, rows)
+            _shared_ledger(filename).rebuild([(r.user_key(registry), r.amount, r.timestamp) for r in records], filename)
+            _forget_shared_store(filename)
+        return
+    save_json(filename, rows)
+    version = _file_version(filename)
+    if record_type is not None:
+        version = (version, registry.generation)
+    _stores[filename] = (version, records)
+    if appended is not None:
+        _extend_user_index(filename, records, appended)
+    else:
+        _indexes.pop(filename, None)
+    _generations[filename] += 1
+
+# --- Shared Read Model ---
+# With BNPL_SHARED_STORE=1 (for gunicorn and other multi-worker servers) the
+# ledgers are served from the memory-mapped columnar copies in shared_store.py
+# instead of a per-process list of records. A worker re-creates its view only
+# when the shared generation moves, decoding just the rows appended since.
+_shared_ledgers = {}
+
+def _shared_ledger(filename):
+    ledger = _shared_ledgers.get(filename)
+    if ledger is None:
+        ledger = _shared_ledgers.setdefault(filename, shared_store.SharedLedger(SHARED_DIR, os.path.basename(filename)))
+    return ledger
+
+def _stored_ledger_rows(filename):
+    """Read a ledger file as (user key, amount, epoch-us timestamp) rows for the shared snapshot."""
+    return [(r['user_id'] if 'user_id' in r else r['user'], r['amount'], parse_timestamp(r['timestamp']))
+            for r in load_json(filename)]
+
+def _forget_shared_store(filename):
+    """Drop this worker's view of a shared ledger after writing it, so the next read maps the new state."""
+    _stores.pop(filename, None)
+    _indexes.pop(filename, None)
+    _generations[filename] += 1
+
+def _load_shared_ledger(filename, record_type):
+    """Return a ledger as a view over its shared snapshot, rebuilt only when the shared generation or the registry changes."""
+    registry = get_user_registry()
+    generation, snapshot, tail = _shared_ledger(filename).read(filename, lambda: _stored_ledger_rows(filename))
+    version = (generation, registry.generation)
+    cached = _stores.get(filename)
+    if cached is not None and cached[0] == version:
+        instrumentation.record_cache('store', True)
+        return cached[1]
+    instrumentation.record_cache('store', False)
+    view = shared_store.LedgerView(snapshot, tail, record_type,
+                                   lambda key: key if isinstance(key, int) else registry.id_for(key))
+    _stores[filename] = (version, view)
+    _indexes.pop(filename, None)
+    _generations[filename] += 1
+    return view
+
+def store_is_current(filename):
+    """Return True if the cached records of a data file match the file on disk, so reading them costs only a stat."""
+    if filename == ARCHIVE_MANIFEST_FILE:
+        return _manifest[1] is not None and _manifest[0] == _file_version(filename)
+    cached = _stores.get(filename)
+    if cached is None:
+        return False
+    version = cached[0]
+    if filename in (TRANSACTIONS_FILE, REPAYMENTS_FILE):
+        version, generation = version
+        registry = _registry
+        if not store_is_current(USERS_FILE) or registry is None or registry.generation != generation \
+                or registry.source is not _stores[USERS_FILE][1]:
+            return False
+        if shared_store.ENABLED:
+            return version == _shared_ledger(filename).peek(filename)
+    return version == _file_version(filename)
+
+def _user_index(filename, records):
+    """Return the records of a store grouped into lists indexed by user id, built once per store version."""
+    if isinstance(records, shared_store.LedgerView):
+        return records.by_user
+    cached = _indexes.get(filename)
+    if cached is not None and cached[0] is records:
+        instrumentation.record_cache('user_index', True)
+        return cached[1]
+    instrumentation.record_cache('user_index', False)
+    registry = get_user_registry()
+    index = [[] for _ in registry.names]
+    for r in records:
+        uid = r.user_id if isinstance(r, LedgerRecord) else registry.id_for(r['user'])
+        if uid >= len(index):
+            index.extend([] for _ in range(uid + 1 - len(index)))
+        index[uid].append(r)
+    _indexes[filename] = (records, index)
+    return index
+
+def _extend_user_index(filename, records, new_records):
+    """Add records just appended to a store to its cached per-user index, dropping the index if it belongs to another version."""
+    cached = _indexes.get(filename)
+    if cached is None or cached[0] is not records:
+        _indexes.pop(filename, None)
+        return
+    registry = get_user_registry()
+    index = cached[1]
+    for r in new_records:
+        uid = r.user_id if isinstance(r, LedgerRecord) else registry.id_for(r['user'])
+        if uid >= len(index):
+            index.extend([] for _ in range(uid + 1 - len(index)))
+        index[uid].append(r)
+
+def record_for_output(record, registry=None):
+    """Return a copy of a record with its epoch timestamps converted to datetimes for templates and API responses.
+
+    Listings should resolve the registry once and pass it in; looking it up per row stats the users file each time.
+    """
+    out = record.to_dict(registry) if isinstance(record, LedgerRecord) else dict(record)
+    for field in ('timestamp', 'registered'):
+        if isinstance(out.get(field), int):
+            out[field] = from_epoch_us(out[field])
+    return out
 
 # --- User Data Functions ---
 def get_all_users():
-    """Load all users from the users file, converting registration timestamps to datetime objects."""
-    users = load_json(USERS_FILE)
-    for u in users:
-        if isinstance(u['registered'], str):
-            u['registered'] = datetime.fromisoformat(u['registered'])
-    return users
+    """Load all users, with registration timestamps as epoch microseconds."""
+    return _load_store(USERS_FILE, 'registered')
 
 def save_all_users(users):
-    """Save all users to the users file, converting registration datetimes to ISO format."""
-    for u in users:
-        if isinstance(u['registered'], datetime):
-            u['registered'] = u['registered'].isoformat()
-    save_json(USERS_FILE, users)
+    """Save all users to the users file, converting registration timestamps to ISO format."""
+    _save_store(USERS_FILE, 'registered', users)
 
 # --- Transaction Data Functions ---
 def get_all_transactions():
-    """Load all transactions, converting timestamps to datetime objects."""
-    txs = load_json(TRANSACTIONS_FILE)
-    for t in txs:
-        if isinstance(t['timestamp'], str):
-            t['timestamp'] = datetime.fromisoformat(t['timestamp'])
-    return txs
+    """Load all transactions as Transaction records, with timestamps as epoch microseconds."""
+    return _load_store(TRANSACTIONS_FILE, 'timestamp', Transaction)
 
 def save_all_transactions(transactions):
     """Save all transactions, converting timestamps to ISO format."""
-    for t in transactions:
-        if isinstance(t['timestamp'], datetime):
-            t['timestamp'] = t['timestamp'].isoformat()
-    save_json(TRANSACTIONS_FILE, transactions)
+    _save_store(TRANSACTIONS_FILE, 'timestamp', transactions, Transaction)
 
 # --- Repayment Data Functions ---
 def get_all_repayments():
-    """Load all repayments, converting timestamps to datetime objects."""
-    rps = load_json(REPAYMENTS_FILE)
-    for r in rps:
-        if isinstance(r['timestamp'], str):
-            r['timestamp'] = datetime.fromisoformat(r['timestamp'])
-    return rps
+    """Load all repayments as Repayment records, with timestamps as epoch microseconds."""
+    return _load_store(REPAYMENTS_FILE, 'timestamp', Repayment)
 
 def save_all_repayments(repayments):
     """Save all repayments, converting timestamps to ISO format."""
-    for r in repayments:
-        if isinstance(r['timestamp'], datetime):
-            r['timestamp'] = r['timestamp'].isoformat()
-    save_json(REPAYMENTS_FILE, repayments)
+    _save_store(REPAYMENTS_FILE, 'timestamp', repayments, Repayment)
 
 # --- Income Verification Data Functions ---
 def get_all_income_verifications():
-    """Load all income verifications, converting timestamps to datetime objects."""
-    ivs = load_json(INCOME_VERIFICATIONS_FILE)
-    for v in ivs:
-        if isinstance(v['timestamp'], str):
-            v['timestamp'] = datetime.fromisoformat(v['timestamp'])
-    return ivs
+    """Load all income verifications, with timestamps as epoch microseconds."""
+    return _load_store(INCOME_VERIFICATIONS_FILE, 'timestamp')
 
 def save_all_income_verifications(ivs):
     """Save all income verifications, converting timestamps to ISO format."""
-    for v in ivs:
-        if isinstance(v['timestamp'], datetime):
-            v['timestamp'] = v['timestamp'].isoformat()
-    save_json(INCOME_VERIFICATIONS_FILE, ivs)
+    _save_store(INCOME_VERIFICATIONS_FILE, 'timestamp', ivs)
 
 def load_audit_log():
-    """Load the audit log from file."""
-    return load_json(AUDIT_LOG_FILE)
+    """Load the audit log; entries keep their ISO timestamps as stored."""
+    return _load_store(AUDIT_LOG_FILE, None)
 
 def save_audit_log(log):
     """Save the audit log to file."""
-    save_json(AUDIT_LOG_FILE, log)
+    _save_store(AUDIT_LOG_FILE, None, log)
+
+# --- Change Data Capture Feed ---
+# Every append is also published as an event with a monotonically increasing
+# sequence number, so downstream consumers fetch only what changed after the
+# last sequence they saw instead of re-downloading whole collections. Events
+# are appended one line at a time to data/events.jsonl. Each process keeps the
+# byte offset of every event and the most recent events parsed, and picks up
+# lines appended by other workers from its last read position, so reading
+# after a sequence costs O(delta) regardless of how long the feed is.
+EVENT_CACHE_SIZE = 10_000
+EVENTS_MAX_BATCH = 1000
+# How often a waiting reader checks the file for events written by other processes
+EVENTS_POLL_INTERVAL = 0.5
+
+class EventLog:
+    """Sequence-numbered ledger events backed by an append-only JSON-lines file."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.offsets = array('q')  # offsets[i] is the byte offset of event seq i + 1
+        self.size = 0
+        self.recent = []
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+
+    @property
+    def head(self):
+        """The sequence number of the newest event, 0 if there are none."""
+        return len(self.offsets)
+
+    def _sync(self):
+        """Index complete lines appended to the file since the last sync; the caller holds the lock."""
+        try:
+            size = os.path.getsize(self.filename)
+        except FileNotFoundError:
+            size = 0
+        if size < self.size:
+            # The file was replaced; start over
+            self.offsets = array('q')
+            self.size = 0
+            self.recent = []
+        if size == self.size:
+            return
+        with open(self.filename, 'rb') as f:
+            f.seek(self.size)
+            data = f.read(size - self.size)
+        lines = data[:data.rfind(b'\n') + 1].splitlines(keepends=True)
+        position = self.size
+        for line in lines:
+            self.offsets.append(position)
+            position += len(line)
+        self.size = position
+        # recent must stay a contiguous run ending at head, so a sync with more
+        # new lines than the cache holds replaces it instead of extending it
+        if len(lines) >= EVENT_CACHE_SIZE:
+            self.recent = [json.loads(line) for line in lines[-EVENT_CACHE_SIZE:]]
+        else:
+            self.recent.extend(json.loads(line) for line in lines)
+        if len(self.recent) > 2 * EVENT_CACHE_SIZE:
+            del self.recent[:-EVENT_CACHE_SIZE]
+        if lines:
+            self.changed.notify_all()
+
+    def refresh(self):
+        """Index any events not seen yet and return the head sequence."""
+        with self.lock:
+            self._sync()
+            return self.head
+
+    def position(self):
+        """Return the head sequence and the byte length of the indexed events."""
+        with self.lock:
+            self._sync()
+            return self.head, self.size
+
+    def append(self, kind, data, durable=False):
+        """Persist an event under the next sequence number and wake waiting readers.
+
+        Callers hold _write_lock, which spans all workers in shared-store mode,
+        so sequence numbers are never handed out twice. A durable append is
+        flushed to disk before it returns.
+        """
+        return self.append_many([(kind, data)], durable)[0]
+
+    def append_many(self, items, durable=False):
+        """Persist (kind, data) events under consecutive sequence numbers with a single write."""
+        with self.lock:
+            self._sync()
+            now = datetime.now().isoformat()
+            events = [{'seq': self.head + 1 + i, 'type': kind, 'time': now, 'data': data} for i, (kind, data) in enumerate(items)]
+            fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, ''.join(json.dumps(event, default=str) + '\n' for event in events).encode('utf-8'))
+                if durable:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._sync()
+        return events
+
+    def read(self, after, limit=EVENTS_MAX_BATCH):
+        """Return up to 'limit' events with a sequence number greater than 'after'."""
+        with self.lock:
+            self._sync()
+            head = self.head
+            end = min(head, after + limit)
+            if end <= after:
+                return []
+            first_recent = head - len(self.recent) + 1
+            if after + 1 >= first_recent:
+                return self.recent[after + 1 - first_recent:end + 1 - first_recent]
+            start = self.offsets[after]
+            stop = self.offsets[end] if end < head else self.size
+        # Older events are read back from the file; it is append-only, so no lock is needed
+        with open(self.filename, 'rb') as f:
+            f.seek(start)
+            return [json.loads(line) for line in f.read(stop - start).splitlines()]
+
+    def wait(self, after, timeout):
+        """Block until there is an event newer than 'after' or the timeout passes; return the head sequence."""
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            self._sync()
+            while self.head <= after:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.changed.wait(min(remaining, EVENTS_POLL_INTERVAL))
+                self._sync()
+            return self.head
+
+event_log = EventLog(EVENTS_FILE)
+
+def _ledger_event(user, amount, timestamp):
+    return {'user': user, 'amount': amount, 'timestamp': format_timestamp(timestamp)}
+
+# --- Appends ---
+# By default a mutation is a read-modify-write of a whole data file, so appends
+# are serialized within the process; without the lock, concurrent requests would
+# each save their own copy and all but one of the appended records would be lost.
+# With BNPL_WAL=1 an append only logs its event and extends the in-memory store;
+# the data files are rewritten at checkpoints, which take the same lock. In
+# shared-store mode the lock also holds a file lock, serializing all workers,
+# and ledger appends write only the new rows (see _append_ledger).
+_write_lock = shared_store.write_lock(SHARED_DIR) if shared_store.ENABLED else threading.RLock()
+
+def _append_ledger(filename, new_records):
+    """Append Transactions or Repayments to their ledger file with one write."""
+    record_type = type(new_records[0])
+    if shared_store.ENABLED:
+        # Only the new rows are written, to the end of the JSON file and to the
+        # shared tail, so an append never builds the whole ledger; the tail is
+        # folded into a new snapshot when it outgrows COMPACT_TAIL_BYTES.
+        registry = get_user_registry()
+        ledger = _shared_ledger(filename)
+        # Pick up changes made to the file outside the app before appending to it
+        ledger.read(filename, lambda: _stored_ledger_rows(filename))
+        if append_json_rows(filename, _stored_rows(new_records, 'timestamp', record_type)):
+            ledger.append([(r.user_key(registry), r.amount, r.timestamp) for r in new_records], filename)
+            _forget_shared_store(filename)
+        else:
+            records = _load_store(filename, 'timestamp', record_type)
+            _save_store(filename, 'timestamp', list(records) + new_records, record_type)
+        return
+    records = _load_store(filename, 'timestamp', record_type)
+    records.extend(new_records)
+    _save_store(filename, 'timestamp', records, record_type, appended=new_records)
+
+# filename -> (timestamp field, record type) of every store the mutation routes append to
+_APPEND_STORES = {
+    USERS_FILE: ('registered', None),
+    TRANSACTIONS_FILE: ('timestamp', Transaction),
+    REPAYMENTS_FILE: ('timestamp', Repayment),
+    INCOME_VERIFICATIONS_FILE: ('timestamp', None),
+    AUDIT_LOG_FILE: (None, None),
+}
+
+def _append_records(items):
+    """Append (filename, record, event type, event data) items and publish their events; the caller holds _write_lock.
+
+    With the write-ahead log the events are made durable first and the data
+    files are left to the next checkpoint; otherwise each data file touched is
+    saved right away, once.
+    """
+    events = [(kind, data) for _, _, kind, data in items]
+    if WAL_ENABLED:
+        event_log.append_many(events, durable=WAL_FSYNC)
+        for filename, record, _, _ in items:
+            _apply_append(filename, record)
+        if sum(map(len, _wal_pending.values())) >= CHECKPOINT_MAX_EVENTS:
+            checkpoint()
+        return
+    by_file = defaultdict(list)
+    for filename, record, _, _ in items:
+        by_file[filename].append(record)
+    for filename, new_records in by_file.items():
+        ts_field, record_type = _APPEND_STORES[filename]
+        if record_type is not None:
+            _append_ledger(filename, new_records)
+        else:
+            records = _load_store(filename, ts_field)
+            records.extend(new_records)
+            _save_store(filename, ts_field, records, appended=new_records)
+    event_log.append_many(events)
+
+def _append_record(filename, record, kind, data):
+    _append_records([(filename, record, kind, data)])
+
+def append_user(user):
+    """Register a new user record, assigning its id, and save the users file."""
+    with _write_lock:
+        get_user_registry().register(user)
+        _append_record(USERS_FILE, user, 'registration', dict(user, registered=format_timestamp(user['registered'])))
+
+def append_transaction(user, amount, timestamp):
+    """Append a purchase for a user name and save the transactions file."""
+    with _write_lock:
+        _append_record(TRANSACTIONS_FILE, Transaction(get_user_registry().id_for(user), amount, timestamp),
+                       'purchase', _ledger_event(user, amount, timestamp))
+
+def append_repayment(user, amount, timestamp):
+    """Append a repayment for a user name and save the repayments file."""
+    with _write_lock:
+        _append_record(REPAYMENTS_FILE, Repayment(get_user_registry().id_for(user), amount, timestamp),
+                       'repayment', _ledger_event(user, amount, timestamp))
+
+def append_income_verification(user, status, timestamp):
+    """Append an income verification result for a user name and save the file."""
+    with _write_lock:
+        _append_record(INCOME_VERIFICATIONS_FILE, {'user': user, 'status': status, 'timestamp': timestamp},
+                       'income_verification', {'user': user, 'status': status, 'timestamp': format_timestamp(timestamp)})
+
+def append_audit_entry(entry):
+    """Append an entry to the audit log and save it."""
+    with _write_lock:
+        _append_record(AUDIT_LOG_FILE, entry, 'audit', entry)
+
+# --- Write-Ahead Log and Checkpoints ---
+# With BNPL_WAL=1 a mutation is acknowledged once its event is fsynced to the
+# change feed, data/events.jsonl, which doubles as the write-ahead log: the
+# record is applied to the in-memory store and the data file is only rewritten
+# at the next checkpoint. A checkpoint runs every BNPL_CHECKPOINT_INTERVAL
+# seconds, or as soon as BNPL_CHECKPOINT_EVENTS mutations are pending, and at
+# exit. data/checkpoint.json records the feed position the data files include
+# and the version of each data file at that point. At startup the events after
+# that position are replayed, so recovery reads at most one checkpoint interval
+# of log instead of the whole history. A data file whose version has moved since
+# was rewritten by a run without the WAL (which appends to the feed as well) or
+# by an interrupted checkpoint; it already holds its events and is not replayed
+# into. The WAL is
+# for single-process servers; in shared-store mode the ledgers already append
+# to the shared tail and each append is written through as before.
+WAL_ENABLED = os.environ.get('BNPL_WAL') == '1' and not shared_store.ENABLED
+WAL_FSYNC = os.environ.get('BNPL_WAL_FSYNC', '1') != '0'
+CHECKPOINT_INTERVAL = float(os.environ.get('BNPL_CHECKPOINT_INTERVAL', 30))
+CHECKPOINT_MAX_EVENTS = int(os.environ.get('BNPL_CHECKPOINT_EVENTS', 1000))
+# Event type -> the data file its record is appended to
+EVENT_FILES = {'registration': USERS_FILE, 'purchase': TRANSACTIONS_FILE, 'repayment': REPAYMENTS_FILE,
+               'income_verification': INCOME_VERIFICATIONS_FILE, 'audit': AUDIT_LOG_FILE}
+# filename -> stored rows appended since the last checkpoint
+_wal_pending = {}
+
+def _apply_append(filename, record):
+    """Append a record to its in-memory store only, keeping it pending until the next checkpoint."""
+    ts_field, record_type = _APPEND_STORES[filename]
+    records = _load_store(filename, ts_field, record_type)
+    records.append(record)
+    _wal_pending.setdefault(filename, []).extend(_stored_rows([record], ts_field, record_type))
+    _extend_user_index(filename, records, [record])
+    _generations[filename] += 1
+
+def _read_checkpoint():
+    if not os.path.exists(CHECKPOINT_FILE):
+        return {}
+    with open(CHECKPOINT_FILE) as f:
+        return json.load(f)
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _checkpoint_versions():
+    """Return the version of every data file the log replays into, as stored in the checkpoint."""
+    return {f: list(v) if v else None for f in sorted(set(EVENT_FILES.values())) for v in [_file_version(f)]}
+
+def checkpoint():
+    """Save every store changed since the last checkpoint and advance the checkpoint to the head of the log."""
+    with _write_lock:
+        marker = _read_checkpoint()
+        dirty = [f for f, rows in _wal_pending.items() if rows]
+        if dirty:
+            # Each file's version before it is saved; recovery does not replay into a file whose version moved
+            pending = dict(marker.get('pending', {}), **{f: _file_version(f) for f in dirty})
+            save_json(CHECKPOINT_FILE, dict(marker, pending=pending))
+            for filename in dirty:
+                ts_field, record_type = _APPEND_STORES[filename]
+                _save_store(filename, ts_field, _load_store(filename, ts_field, record_type), record_type)
+                if WAL_FSYNC:
+                    _fsync(filename)
+        seq, offset = event_log.position()
+        versions = _checkpoint_versions()
+        if dirty or marker.get('seq') != seq or marker.get('versions') != versions:
+            save_json(CHECKPOINT_FILE, {'seq': seq, 'offset': offset, 'versions': versions,
+                                        'time': datetime.now().isoformat()})
+            if WAL_FSYNC:
+                _fsync(DATA_DIR)
+        _wal_pending.clear()
+
+def _read_wal(offset):
+    """Return the events logged from a byte offset on, dropping a torn last line left by a crash."""
+    if not os.path.exists(EVENTS_FILE):
+        return []
+    with open(EVENTS_FILE, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            f.truncate(end)
+    if offset > end:
+        app.logger.warning('Event log is shorter than the last checkpoint; nothing to replay')
+        return []
+    return [json.loads(line) for line in data[offset:end].splitlines()]
+
+def _record_from_event(event):
+    """Rebuild the in-memory record an event was logged for."""
+    kind, data = event['type'], event['data']
+    registry = get_user_registry()
+    if kind == 'registration':
+        user = dict(data, registered=parse_timestamp(data['registered']))
+        registry.register(user)
+        return user
+    if kind in ('purchase', 'repayment'):
+        record_type = Transaction if kind == 'purchase' else Repayment
+        return record_type(registry.id_for(data['user']), data['amount'], parse_timestamp(data['timestamp']))
+    if kind == 'income_verification':
+        return dict(data, timestamp=parse_timestamp(data['timestamp']))
+    return dict(data)
+
+def recover():
+    """Replay the events logged after the last checkpoint into the stores, then checkpoint; return how many were replayed."""
+    with _write_lock:
+        marker = _read_checkpoint()
+        events = _read_wal(marker['offset']) if 'offset' in marker else []
+        saved = {f for f, version in marker.get('pending', {}).items()
+                 if _file_version(f) != (tuple(version) if version else None)}
+        # Files rewritten since the checkpoint, e.g. by a run without the WAL, already hold their events
+        current = _checkpoint_versions()
+        saved.update(f for f, version in marker.get('versions', {}).items() if current.get(f) != version)
+        # Registrations go first so replayed users reclaim their logged ids before ledger names are interned
+        events.sort(key=lambda e: e['type'] != 'registration')
+        replayed = 0
+        for event in events:
+            filename = EVENT_FILES.get(event['type'])
+            if filename is not None and filename not in saved:
+                _apply_append(filename, _record_from_event(event))
+                replayed += 1
+        checkpoint()
+    app.logger.info('Recovered %d events from the write-ahead log', replayed)
+    return replayed
+
+def _checkpoint_loop():
+    while True:
+        time.sleep(CHECKPOINT_INTERVAL)
+        try:
+            checkpoint()
+        except Exception:
+            app.logger.exception('Checkpoint failed')
+
+def start_wal():
+    """Recover from the write-ahead log and start the periodic checkpoints."""
+    recover()
+    threading.Thread(target=_checkpoint_loop, name='bnpl-checkpoint', daemon=True).start()
+    atexit.register(checkpoint)
+
+# --- Write Guard ---
+# Purchases, repayments and checkouts are checked as they are written rather
+# than in the validator's batch run, long after the fact. Rejected:
+#   non_positive_amount        an amount of zero or less
+#   future_dated               a timestamp more than FUTURE_TOLERANCE_S ahead
+#   duplicate                  the same (user, amount, timestamp) as a ledger row
+# Accepted but flagged (logged and counted in bnpl_write_anomalies_total):
+#   repayment_before_purchase  a repayment dated before the user's first purchase
+#   rapid_repeat               the same user and amount again within REPEAT_WINDOW_S
+#
+# Every ledger key goes into a Bloom filter, so a new key (nearly every
+# write) is cleared with a few bit tests. A key the filter may have seen is
+# confirmed against an exact set holding the keys of the last
+# DUPLICATE_WINDOW_S; only an older key falls back to the user's rows. Each
+# user's first-purchase time is kept alongside. The guard follows the stores:
+# rows appended since its last check are added, and a store that was
+# replaced (re-ingested, archived) or a Bloom filter past its capacity is
+# rebuilt from the ledgers.
+DUPLICATE_WINDOW_S = float(os.environ.get('BNPL_DUPLICATE_WINDOW_S', 7 * 86_400))
+REPEAT_WINDOW_S = float(os.environ.get('BNPL_REPEAT_WINDOW_S', 10))
+FUTURE_TOLERANCE_S = float(os.environ.get('BNPL_FUTURE_TOLERANCE_S', 300))
+BLOOM_BITS_PER_KEY = 10
+BLOOM_HASHES = 7
+BLOOM_MIN_KEYS = 1 << 16
+GUARD_KINDS = {'purchase': TRANSACTIONS_FILE, 'repayment': REPAYMENTS_FILE}
+
+class BloomFilter:
+    """A Bloom filter over byte-string keys, sized for a number of keys at about a 1% false-positive rate."""
+    __slots__ = ('bits', 'size', 'capacity', 'count')
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.size = capacity * BLOOM_BITS_PER_KEY
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(BLOOM_HASHES)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+class WriteGuard:
+    """Duplicate and anomaly checks for ledger writes, kept current with the stores."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.synced = {}
+        self._reset(BLOOM_MIN_KEYS)
+
+    def _reset(self, capacity):
+        self.bloom = BloomFilter(capacity)
+        # key -> timestamp for keys inside the duplicate window, expired oldest first
+        self.recent = {}
+        self.recent_expiry = deque()
+        # (kind, uid, amount) -> newest timestamp, for keys inside the repeat window
+        self.last_write = {}
+        self.last_expiry = deque()
+        self.first_purchase = {}
+        self.synced = {}
+
+    @staticmethod
+    def _key(kind, uid, amount, timestamp):
+        # float() so an amount stored as 50 and one sent as 50.0 are the same record
+        return f"{kind}|{uid}|{float(amount)!r}|{timestamp}".encode()
+
+    def _expire(self, now_us):
+        horizon = now_us - int(DUPLICATE_WINDOW_S * 1_000_000)
+        while self.recent_expiry and self.recent_expiry[0][0] < horizon:
+            ts, key = self.recent_expiry.popleft()
+            if self.recent.get(key) == ts:
+                del self.recent[key]
+        horizon = now_us - int(REPEAT_WINDOW_S * 1_000_000)
+        while self.last_expiry and self.last_expiry[0][0] < horizon:
+            ts, key = self.last_expiry.popleft()
+            if self.last_write.get(key) == ts:
+                del self.last_write[key]
+        return horizon
+
+    def _remember(self, kind, uid, amount, timestamp, now_us):
+        key = self._key(kind, uid, amount, timestamp)
+        if kind in GUARD_KINDS:
+            self.bloom.add(key)
+            if timestamp >= now_us - DUPLICATE_WINDOW_S * 1_000_000:
+                self.recent[key] = timestamp
+                self.recent_expiry.append((timestamp, key))
+        if kind == 'purchase' and timestamp < self.first_purchase.get(uid, timestamp + 1):
+            self.first_purchase[uid] = timestamp
+        repeat_key = (kind, uid, amount)
+        if timestamp >= now_us - REPEAT_WINDOW_S * 1_000_000 and timestamp >= self.last_write.get(repeat_key, timestamp):
+            self.last_write[repeat_key] = timestamp
+            self.last_expiry.append((timestamp, repeat_key))
+
+    def _sync(self, now_us):
+        """Take in the ledger rows appended since the last check, or rebuild if a store was replaced."""
+        stores = {kind: _load_store(filename, 'timestamp', _APPEND_STORES[filename][1]) for kind, filename in GUARD_KINDS.items()}
+        start = {}
+        for kind, store in stores.items():
+            prev = self.synced.get(kind)
+            if prev is not None and (prev[0] is store or (shared_store.ENABLED and 0 < prev[1] <= len(store)
+                                                          and store[prev[1] - 1] == prev[2])):
+                start[kind] = prev[1]
+            else:
+                break
+        else:
+            if self.bloom.count + sum(len(store) - start[kind] for kind, store in stores.items()) <= self.bloom.capacity:
+                for kind, store in stores.items():
+                    for r in store[start[kind]:]:
+                        self._remember(kind, r.user_id, r.amount, r.timestamp, now_us)
+                    self.synced[kind] = (store, len(store), store[len(store) - 1] if len(store) else None)
+                return
+        self._reset(max(BLOOM_MIN_KEYS, 2 * sum(len(store) for store in stores.values())))
+        for kind, store in stores.items():
+            for r in store:
+                self._remember(kind, r.user_id, r.amount, r.timestamp, now_us)
+            self.synced[kind] = (store, len(store), store[len(store) - 1] if len(store) else None)
+
+    def _is_duplicate(self, kind, uid, amount, timestamp, now_us):
+        key = self._key(kind, uid, amount, timestamp)
+        if key not in self.bloom:
+            return False
+        if timestamp >= now_us - DUPLICATE_WINDOW_S * 1_000_000:
+            return key in self.recent
+        filename = GUARD_KINDS[kind]
+        index = _user_index(filename, _load_store(filename, 'timestamp', _APPEND_STORES[filename][1]))
+        return any(r.amount == amount and r.timestamp == timestamp for r in (index[uid] if uid < len(index) else ()))
+
+    def check(self, kind, user, amount, timestamp, now_us=None, record=False, first_purchase=None):
+        """Check one write; return (rejection reasons, flags). With record=True an accepted write is remembered
+        (for writes that do not land in a ledger, such as checkouts); first_purchase is the earliest purchase
+        of the user that is being written alongside and is not in the ledger yet."""
+        now_us = now_us if now_us is not None else to_epoch_us(datetime.now())
+        uid = get_user_registry().id_for(user, create=False)
+        rejected, flags = [], []
+        if not amount > 0:
+            rejected.append('non_positive_amount')
+        if timestamp > now_us + FUTURE_TOLERANCE_S * 1_000_000:
+            rejected.append('future_dated')
+        with self.lock:
+            if kind in GUARD_KINDS:
+                self._sync(now_us)
+            self._expire(now_us)
+            if uid is not None:
+                if kind in GUARD_KINDS and self._is_duplicate(kind, uid, amount, timestamp, now_us):
+                    rejected.append('duplicate')
+            if uid is not None and not rejected:
+                first = min(self.first_purchase.get(uid, float('inf')), float('inf') if first_purchase is None else first_purchase)
+                if kind == 'repayment' and timestamp < first and not archived_rollups().get(uid, {}).get('purchases'):
+                    flags.append('repayment_before_purchase')
+                last = self.last_write.get((kind, uid, amount))
+                if last is not None and abs(timestamp - last) <= REPEAT_WINDOW_S * 1_000_000:
+                    flags.append('rapid_repeat')
+                if record:
+                    self._remember(kind, uid, amount, timestamp, now_us)
+        for reason in rejected:
+            instrumentation.inc('bnpl_write_rejections_total', kind=kind, reason=reason)
+        for flag in flags:
+            instrumentation.inc('bnpl_write_anomalies_total', kind=kind, anomaly=flag)
+            app.logger.warning('Flagged %s for %s (amount %s at %s): %s', kind, user, amount, format_timestamp(timestamp), flag)
+        return rejected, flags
+
+write_guard = WriteGuard()
+
+WRITE_REJECTION_MESSAGES = {
+    'non_positive_amount': 'Amount must be greater than zero.',
+    'future_dated': 'Timestamp is in the future.',
+    'duplicate': 'An identical record already exists.',
+}
+
+# --- Bulk Ingestion ---
+# Partner settlement files are imported as one batch instead of one form post
+# per record. A batch of JSON Lines or CSV rows (type, user, amount, timestamp)
+# is validated a column at a time. It is rejected as a whole if any row is
+# invalid, so a corrected file can simply be sent again. Rows are identified by
+# (user, amount, timestamp), the identity check_duplicate_transactions uses:
+# rows already in the ledger (including archived months the batch reaches
+# back to), or repeated within the batch, are skipped. Re-sending a batch is
+# therefore idempotent. The accepted rows are appended with one write per
+# ledger file.
+INGEST_TYPES = {'purchase': (TRANSACTIONS_FILE, Transaction), 'repayment': (REPAYMENTS_FILE, Repayment)}
+INGEST_FIELDS = ('type', 'user', 'amount', 'timestamp')
+INGEST_MAX_ERRORS = 100
+
+def parse_ingest_batch(text, fmt='jsonl'):
+    """Parse a JSON Lines or CSV batch into a list of row dicts; raise ValueError on malformed input."""
+    if fmt == 'csv':
+        reader = csv.DictReader(io.StringIO(text))
+        missing = [f for f in INGEST_FIELDS if f not in (reader.fieldnames or ())]
+        if missing:
+            raise ValueError(f"CSV header is missing {', '.join(missing)}")
+        return list(reader)
+    rows = []
+    for number, line in enumerate(text.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            raise ValueError(f"Line {number} is not valid JSON")
+        if not isinstance(row, dict):
+            raise ValueError(f"Line {number} is not a JSON object")
+        rows.append(row)
+    return rows
+
+def _ingest_amount(value):
+    try:
+        amount = float(value) if not isinstance(value, bool) else None
+    except (TypeError, ValueError):
+        return None
+    return amount if 0 < amount < float('inf') else None
+
+def _ingest_timestamp(value):
+    try:
+        return parse_timestamp(value) if isinstance(value, str) else None
+    except (TypeError, ValueError):
+        # Malformed, or timezone-aware where the ledger holds naive timestamps
+        return None
+
+def validate_ingest_batch(rows):
+    """Validate a batch column by column; return its (type, user, amount, timestamp) entries and a list of row errors."""
+    registry = get_user_registry()
+    types = [r.get('type') for r in rows]
+    users = [r.get('user') for r in rows]
+    amounts = [_ingest_amount(r.get('amount')) for r in rows]
+    timestamps = [_ingest_timestamp(r.get('timestamp')) for r in rows]
+    latest = to_epoch_us(datetime.now()) + int(FUTURE_TOLERANCE_S * 1_000_000)
+    checks = (
+        ('type', types, [t not in INGEST_TYPES for t in types], 'must be purchase or repayment'),
+        ('user', users, [registry.user_of(registry.ids.get(u)) is None if isinstance(u, str) else True for u in users],
+         'is not a registered user'),
+        ('amount', [r.get('amount') for r in rows], [a is None for a in amounts], 'must be a positive number'),
+        ('timestamp', [r.get('timestamp') for r in rows], [ts is None for ts in timestamps], 'must be an ISO timestamp without a timezone'),
+        ('timestamp', [r.get('timestamp') for r in rows], [ts is not None and ts > latest for ts in timestamps], 'is in the future'),
+    )
+    errors = [{'row': i + 1, 'field': field, 'value': values[i], 'error': message}
+              for field, values, bad, message in checks for i in range(len(rows)) if bad[i]]
+    errors.sort(key=lambda e: e['row'])
+    return list(zip(types, users, amounts, timestamps)), errors
+
+def ingest_batch(rows, dry_run=False):
+    """Validate, deduplicate and append a batch of purchases and repayments; return a summary of what was accepted."""
+    entries, errors = validate_ingest_batch(rows)
+    summary = {'received': len(rows), 'accepted': 0, 'duplicates': 0, 'purchases': 0, 'repayments': 0}
+    if errors:
+        return dict(summary, error_count=len(errors), errors=errors[:INGEST_MAX_ERRORS])
+    flagged = []
+    now_us = to_epoch_us(datetime.now())
+    with _write_lock:
+        registry = get_user_registry()
+        items = []
+        # A repayment is only flagged as preceding the first purchase if no earlier purchase is in the batch either
+        batch_first_purchase = {}
+        for t, user, amount, ts in entries:
+            if t == 'purchase' and ts < batch_first_purchase.get(user, ts + 1):
+                batch_first_purchase[user] = ts
+        for kind, (filename, record_type) in INGEST_TYPES.items():
+            batch = [(row, user, amount, ts) for row, (t, user, amount, ts) in enumerate(entries, 1) if t == kind]
+            if not batch:
+                continue
+            # Archived partitions are only read from the earliest month the batch reaches back to
+            archived = defaultdict(set)
+            for row in read_archive(filename, since=min(ts for _, _, _, ts in batch)):
+                uid = row['user_id'] if 'user_id' in row else registry.id_for(row['user'])
+                archived[uid].add((row['amount'], parse_timestamp(row['timestamp'])))
+            seen = set()
+            for row, user, amount, ts in batch:
+                uid = registry.ids[user]
+                if (uid, amount, ts) in seen or (amount, ts) in archived.get(uid, ()):
+                    summary['duplicates'] += 1
+                    continue
+                rejected, flags = write_guard.check(kind, user, amount, ts, now_us, first_purchase=batch_first_purchase.get(user))
+                if 'duplicate' in rejected:
+                    summary['duplicates'] += 1
+                    continue
+                seen.add((uid, amount, ts))
+                flagged.extend({'row': row, 'anomaly': flag} for flag in flags)
+                items.append((filename, record_type(uid, amount, ts), kind, _ledger_event(user, amount, ts)))
+                summary[kind + 's'] += 1
+        summary['accepted'] = len(items)
+        if items and not dry_run:
+            _append_records(items)
+    if flagged:
+        summary['flagged'] = sorted(flagged, key=lambda f: f['row'])[:INGEST_MAX_ERRORS]
+    return summary
+
+# --- Cold Archive ---
+# Old history is moved out of the hot data files into monthly partitions,
+# data/archive/<file>/<YYYY-MM>.json.gz, so loaders only pay for recent rows.
+# A purchase or repayment is archived only once its user's history before the
+# partition boundary is fully settled: those rows no longer affect default
+# status, and the manifest keeps per-user totals (and whether there was a large
+# purchase) so utilization and compliance stay exact without reading archives.
+# Audit entries are archived by age alone and archived audit months can be
+# dropped after a retention period. Queries with a 'since' bound read only the
+# partitions from that month on.
+ARCHIVE_STEMS = {TRANSACTIONS_FILE: 'transactions', REPAYMENTS_FILE: 'repayments', AUDIT_LOG_FILE: 'audit_log'}
+# Ledger history inside the longest evaluation window always stays hot
+ARCHIVE_MIN_HORIZON_DAYS = 90
+
+def month_of(us):
+    """Return the 'YYYY-MM' partition key of an epoch-microsecond timestamp."""
+    return from_epoch_us(us).strftime('%Y-%m')
+
+def _partition_path(stem, month):
+    return os.path.join(ARCHIVE_DIR, stem, month + '.json.gz')
+
+def read_partition(stem, month):
+    """Load the rows of one archived monthly partition."""
+    path = _partition_path(stem, month)
+    if not os.path.exists(path):
+        return []
+    with gzip.open(path, 'rt') as f:
+        text = f.read()
+    instrumentation.record_io('load_json', len(text), path)
+    return json.loads(text)
+
+def write_partition(stem, month, rows):
+    """Atomically write the rows of one archived monthly partition."""
+    path = _partition_path(stem, month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    text = json.dumps(rows, default=str)
+    tmp_path = path + '.tmp'
+    with gzip.open(tmp_path, 'wt') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+    instrumentation.record_io('save_json', len(text), path)
+
+_manifest = (None, None)
+_rollups = (None, {})
+
+def get_archive_manifest():
+    """Return the archive manifest (partition stats and per-user rollups), re-read when the file changes."""
+    global _manifest
+    version = _file_version(ARCHIVE_MANIFEST_FILE)
+    if _manifest[0] != version or _manifest[1] is None:
+        manifest = load_json(ARCHIVE_MANIFEST_FILE) or {'partitions': {}, 'users': []}
+        _manifest = (version, manifest)
+        _generations[ARCHIVE_MANIFEST_FILE] += 1
+    return _manifest[1]
+
+def archived_rollups():
+    """Return the archived per-user rollups keyed by user id."""
+    global _rollups
+    manifest = get_archive_manifest()
+    registry = get_user_registry()
+    key = (_generations[ARCHIVE_MANIFEST_FILE], registry.generation)
+    if _rollups[0] != key:
+        _rollups = (key, {(u['user_id'] if 'user_id' in u else registry.id_for(u['user'])): u for u in manifest['users']})
+    return _rollups[1]
+
+def archived_large_purchases(rollup):
+    """Return the number of archived large purchases in a rollup (at least one for manifests that only kept a flag)."""
+    return rollup.get('large_purchases', int(rollup['large_purchase']))
+
+def read_archive(filename, since=None):
+    """Return the archived rows of a data file, oldest partition first, reading only partitions from the 'since' month on."""
+    stem = ARCHIVE_STEMS[filename]
+    months = sorted(get_archive_manifest()['partitions'].get(stem, {}))
+    if since is not None:
+        months = [m for m in months if m >= month_of(since)]
+    rows = []
+    for month in months:
+        for row in read_partition(stem, month):
+            if since is None or parse_timestamp(row['timestamp']) >= since:
+                rows.append(row)
+    return rows
+
+def _archive_rows(manifest, stem, rows):
+    """Merge rows into their monthly partitions and update the partition stats in the manifest."""
+    by_month = defaultdict(list)
+    for row in rows:
+        by_month[month_of(parse_timestamp(row['timestamp']))].append(row)
+    stats = manifest['partitions'].setdefault(stem, {})
+    for month, month_rows in sorted(by_month.items()):
+        write_partition(stem, month, read_partition(stem, month) + month_rows)
+        stat = stats.setdefault(month, {'rows': 0, 'amount': 0.0})
+        stat['rows'] += len(month_rows)
+        stat['amount'] += sum(r.get('amount', 0) for r in month_rows)
+
+def _settled_before(user_tx, user_rp, boundary):
+    """Return (purchases, repayments) before the boundary if they settle each other exactly, else None."""
+    old_tx = [t for t in user_tx if t.timestamp < boundary]
+    old_rp = [r for r in user_rp if r.timestamp < boundary]
+    if not old_tx and not old_rp:
+        return None
+    oldest_unpaid, unapplied = UserFeatures.settle(old_tx, old_rp)
+    if oldest_unpaid is not None or unapplied:
+        return None
+    return old_tx, old_rp
+
+def archive_history(horizon_days=365, audit_hot_days=None, audit_retain_days=None, now=None, dry_run=False):
+    """Move settled ledger history and old audit entries into cold monthly partitions; return what was moved.
+
+    Ledger rows are archived by whole months older than horizon_days; audit
+    entries older than audit_hot_days are archived, and archived audit months
+    older than audit_retain_days are deleted.
+    """
+    if horizon_days < ARCHIVE_MIN_HORIZON_DAYS:
+        raise ValueError(f"horizon_days must be at least {ARCHIVE_MIN_HORIZON_DAYS}")
+    now_us = to_epoch_us(now or datetime.now())
+    horizon = from_epoch_us(now_us - horizon_days * US_PER_DAY)
+    boundary = to_epoch_us(datetime(horizon.year, horizon.month, 1))
+    summary = {'boundary': format_timestamp(boundary), 'users': 0, 'transactions': 0, 'repayments': 0,
+               'audit_entries': 0, 'audit_partitions_deleted': []}
+    with _write_lock:
+        if WAL_ENABLED:
+            # Archiving rewrites the data files, so they must first include every logged mutation
+            checkpoint()
+        registry = get_user_registry()
+        manifest = json.loads(json.dumps(get_archive_manifest()))
+        rollups = {('user_id', u['user_id']) if 'user_id' in u else ('user', u['user']): u for u in manifest['users']}
+        transactions, repayments = get_all_transactions(), get_all_repayments()
+        tx_index, rp_index = _user_index(TRANSACTIONS_FILE, transactions), _user_index(REPAYMENTS_FILE, repayments)
+        settled_ids = set()
+        for uid in range(max(len(tx_index), len(rp_index))):
+            settled = _settled_before(tx_index[uid] if uid < len(tx_index) else [],
+                                      rp_index[uid] if uid < len(rp_index) else [], boundary)
+            if settled is None:
+                continue
+            old_tx, old_rp = settled
+            settled_ids.add(uid)
+            key = old_tx[0].user_key(registry) if old_tx else old_rp[0].user_key(registry)
+            rollup = rollups.get(('user_id', key) if isinstance(key, int) else ('user', key))
+            if rollup is None:
+                rollup = {'user_id': key} if isinstance(key, int) else {'user': key}
+                rollup.update(purchases=0.0, repaid=0.0, large_purchase=False)
+                manifest['users'].append(rollup)
+            rollup['purchases'] += sum(t.amount for t in old_tx)
+            rollup['repaid'] += sum(r.amount for r in old_rp)
+            rollup['large_purchase'] = rollup['large_purchase'] or any(t.amount > LARGE_PURCHASE for t in old_tx)
+            rollup['large_purchases'] = archived_large_purchases(rollup) + sum(t.amount > LARGE_PURCHASE for t in old_tx)
+            rollup['max_purchase'] = max([rollup.get('max_purchase', 0.0)] + [t.amount for t in old_tx])
+            summary['users'] += 1
+            summary['transactions'] += len(old_tx)
+            summary['repayments'] += len(old_rp)
+
+        audit_log = load_audit_log()
+        audit_cutoff = now_us - audit_hot_days * US_PER_DAY if audit_hot_days is not None else None
+
+        def is_archived(record):
+            return record.user_id in settled_ids and record.timestamp < boundary
+
+        def is_old_audit(entry):
+            return audit_cutoff is not None and 'timestamp' in entry and parse_timestamp(entry['timestamp']) < audit_cutoff
+
+        old_audit = [e for e in audit_log if is_old_audit(e)]
+        summary['audit_entries'] = len(old_audit)
+        expired = []
+        if audit_retain_days is not None:
+            retain_from = month_of(now_us - audit_retain_days * US_PER_DAY)
+            # A month is dropped only once all of it is past the retention period
+            expired = [m for m in manifest['partitions'].get('audit_log', {}) if m < retain_from]
+            summary['audit_partitions_deleted'] = sorted(expired)
+        if dry_run:
+            return summary
+
+        def stored(records):
+            rows = [r.to_stored(registry) for r in records if is_archived(r)]
+            for row in rows:
+                row['timestamp'] = format_timestamp(row['timestamp'])
+            return rows
+
+        _archive_rows(manifest, 'transactions', stored(transactions))
+        _archive_rows(manifest, 'repayments', stored(repayments))
+        _archive_rows(manifest, 'audit_log', old_audit)
+        for month in expired:
+            os.unlink(_partition_path('audit_log', month))
+            del manifest['partitions']['audit_log'][month]
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        save_json(ARCHIVE_MANIFEST_FILE, manifest)
+        if summary['transactions']:
+            save_all_transactions([t for t in transactions if not is_archived(t)])
+        if summary['repayments']:
+            save_all_repayments([r for r in repayments if not is_archived(r)])
+        if old_audit:
+            save_audit_log([e for e in audit_log if not is_old_audit(e)])
+        if WAL_ENABLED:
+            # Record the rewritten files' versions, or recovery would take them for files written without the WAL
+            checkpoint()
+    return summary
 
 MIN_AGE = 18
 DEFAULT_OVERDUE_DAYS = 60
 DEFAULT_CREDIT_LIMIT = 1000.0
+# Purchases above this need verified income
+LARGE_PURCHASE = 500.0
+
+# --- Evaluation Context ---
+# All time-dependent helpers evaluate against one as-of instant. The day-window
+# cutoffs are precomputed as epoch microseconds so that every recency check is a
+# plain integer comparison, and a report is reproducible for a given as_of.
+EVAL_WINDOWS = (7, 30, 60, 90)
+
+class EvalContext:
+    """One as-of timestamp plus its epoch cutoffs for the 7/30/60/90 day windows."""
+    __slots__ = ('as_of', 'as_of_us', 'cutoffs')
+
+    def __init__(self, as_of=None):
+        self.as_of = as_of if as_of is not None else datetime.now()
+        self.as_of_us = to_epoch_us(self.as_of)
+        self.cutoffs = {days: self.as_of_us - days * US_PER_DAY for days in EVAL_WINDOWS}
+
+    def cutoff(self, days):
+        """Return the epoch cutoff for a window of 'days'; records newer than it fall inside the window."""
+        cutoff = self.cutoffs.get(days)
+        if cutoff is None:
+            cutoff = self.as_of_us - days * US_PER_DAY
+        return cutoff
+
+def get_eval_context():
+    """Return the evaluation context shared by the current request (honoring ?as_of=), or a fresh one outside a request."""
+    if not has_request_context():
+        return EvalContext()
+    if 'eval_ctx' not in g:
+        as_of = request.args.get('as_of')
+        try:
+            g.eval_ctx = EvalContext(datetime.fromisoformat(as_of) if as_of else None)
+        except ValueError:
+            abort(400, 'Invalid as_of timestamp')
+    return g.eval_ctx
 
 # --- Helper Functions for Business Logic ---
 def get_user(name):
     """Return the user dict for a given name, or None if not found."""
-    users = get_all_users()
-    for u in users:
-        if u['name'] == name:
-            return u
-    return None
+    registry = get_user_registry()
+    return registry.user_of(registry.id_for(name, create=False))
+
+def _records_for_user(filename, records, name):
+    """Return the records of a store that belong to a user name, via the per-user id index."""
+    uid = get_user_registry().id_for(name, create=False)
+    index = _user_index(filename, records)
+    if uid is None or uid >= len(index):
+        return []
+    return index[uid]
 
 def get_user_transactions(name):
     """Return all transactions for a given user name."""
-    transactions = get_all_transactions()
-    return [t for t in transactions if t['user'] == name]
+    return _records_for_user(TRANSACTIONS_FILE, get_all_transactions(), name)
 
 def get_user_repayments(name):
     """Return all repayments for a given user name."""
-    repayments = get_all_repayments()
-    return [r for r in repayments if r['user'] == name]
+    return _records_for_user(REPAYMENTS_FILE, get_all_repayments(), name)
 
 def get_income_verification_status(name):
     """Return the latest income verification status for a user, or 'Not Verified' if none found."""
-    ivs = get_all_income_verifications()
-    for v in ivs[::-1]:
-        if v['user'] == name:
-            return v['status']
-    return 'Not Verified'
+    ivs = _records_for_user(INCOME_VERIFICATIONS_FILE, get_all_income_verifications(), name)
+    return ivs[-1]['status'] if ivs else 'Not Verified'
+
+# --- Per-user Feature Cache ---
+# The time-independent inputs to the risk helpers are computed once per user
+# and reused until that user's ledger changes. Time windows are then applied
+# against the evaluation context with a bisect or a single compare. Appends
+# extend the stores in place, so an entry stays valid while its user's record
+# counts are unchanged; a store that is replaced (re-ingested, archived)
+# invalidates every entry.
+class UserFeatures:
+    """Aggregates of a user's ledger that do not depend on the evaluation time."""
+    __slots__ = ('total_purchases', 'total_repaid', 'tx_timestamps', 'oldest_unpaid')
+
+    def __init__(self, user_tx, user_rp, archived=None):
+        self.total_purchases = sum(t.amount for t in user_tx)
+        self.total_repaid = sum(r.amount for r in user_rp)
+        self.tx_timestamps = sorted(t.timestamp for t in user_tx)
+        self.oldest_unpaid = self.settle(user_tx, user_rp)[0]
+        # Archived history is settled, so only its totals still count
+        if archived is not None:
+            self.total_purchases += archived['purchases']
+            self.total_repaid += archived['repaid']
+
+    @staticmethod
+    def settle(user_tx, user_rp):
+        """Apply repayments to purchases in order; return (oldest purchase left with a balance or None, unapplied repayments).
 
+        Purchases are visited oldest first, so the first one with a balance is
+        the oldest; the user is in default once it is 60+ days old.
+        """
+        # Remaining repayment amounts in time order; cached records must not be mutated
+        repayments_by_time = deque(r.amount for r in sorted(user_rp, key=lambda r: r.timestamp))
+        outstanding = 0.0
+        for tx in sorted(user_tx, key=lambda t: t.timestamp):
+            outstanding += tx.amount
+            # Apply repayments in order
+            while repayments_by_time and outstanding > 0:
+                rp_amount = repayments_by_time[0]
+                if rp_amount <= outstanding:
+                    outstanding -= rp_amount
+                    repayments_by_time.popleft()
+                else:
+                    repayments_by_time[0] -= outstanding
+                    outstanding = 0
+            if outstanding > 0:
+                return tx.timestamp, repayments_by_time
+        return None, repayments_by_time
+
+    def velocity(self, cutoff):
+        """Return the number of purchases newer than an epoch cutoff."""
+        return len(self.tx_timestamps) - bisect_right(self.tx_timestamps, cutoff)
+
+# uid -> (UserFeatures, transaction count, repayment count)
+_features = {}
+# (transactions store, repayments store, archive manifest generation) the entries were computed from
+_features_key = (None, None, None)
+_features_lock = threading.Lock()
+
+def _features_current(key):
+    return _features_key[0] is key[0] and _features_key[1] is key[1] and _features_key[2] == key[2]
+
+@timed('get_user_features')
+def get_user_features(name):
+    """Return the cached UserFeatures for a user name, recomputing after a change to that user's ledger."""
+    global _features_key
+    user_tx = get_user_transactions(name)
+    user_rp = get_user_repayments(name)
+    uid = get_user_registry().id_for(name, create=False)
+    rollups = archived_rollups()
+    key = (get_all_transactions(), get_all_repayments(), _generations[ARCHIVE_MANIFEST_FILE])
+    with _features_lock:
+        if not _features_current(key):
+            _features.clear()
+            _features_key = key
+        cached = _features.get(uid)
+    features = cached[0] if cached is not None and cached[1:] == (len(user_tx), len(user_rp)) else None
+    instrumentation.record_cache('features', features is not None)
+    if features is None:
+        features = UserFeatures(user_tx, user_rp, rollups.get(uid))
+        with _features_lock:
+            if uid is not None and _features_current(key):
+                _features[uid] = (features, len(user_tx), len(user_rp))
+    return features
+
+@timed('calculate_utilization')
 def calculate_utilization(name):
     """Calculate the credit utilization for a user as outstanding/credit_limit, clamped to [0, 1]."""
     user = get_user(name)
     if not user:
         return 0.0
     credit_limit = user.get('credit_limit', DEFAULT_CREDIT_LIMIT)
-    total_purchases = sum(t['amount'] for t in get_user_transactions(name))
-    total_repaid = sum(r['amount'] for r in get_user_repayments(name))
-    outstanding = total_purchases - total_repaid
+    features = get_user_features(name)
+    outstanding = features.total_purchases - features.total_repaid
     utilization = outstanding / credit_limit if credit_limit else 0.0
     return max(0.0, min(utilization, 1.0))
 
-def calculate_transaction_velocity(name, days=30):
-    """Return the number of transactions for a user in the last 'days' days."""
-    now = datetime.now()
-    recent = [t for t in get_user_transactions(name) if (now - t['timestamp']).days < days]
-    return len(recent)
+@timed('calculate_transaction_velocity')
+def calculate_transaction_velocity(name, days=30, ctx=None):
+    """Return the number of transactions for a user in the last 'days' days as of the evaluation context."""
+    return get_user_features(name).velocity((ctx or get_eval_context()).cutoff(days))
 
-def is_user_in_default(name):
-    """Return True if any purchase is unpaid for 60+ days, else False."""
-    user_tx = get_user_transactions(name)
-    user_rp = get_user_repayments(name)
-    repayments_by_time = sorted(user_rp, key=lambda r: r['timestamp'])
-    outstanding = 0.0
-    for tx in sorted(user_tx, key=lambda t: t['timestamp']):
-        outstanding += tx['amount']
-        # Apply repayments in order
-        while repayments_by_time and outstanding > 0:
-            rp = repayments_by_time[0]
-            if rp['amount'] <= outstanding:
-                outstanding -= rp['amount']
-                repayments_by_time.pop(0)
-            else:
-                rp['amount'] -= outstanding
-                outstanding = 0
-        # If outstanding for this tx > 0 and 60+ days old, default
-        if outstanding > 0 and (datetime.now() - tx['timestamp']).days >= DEFAULT_OVERDUE_DAYS:
-            return True
-    return False
+@timed('is_user_in_default')
+def is_user_in_default(name, ctx=None):
+    """Return True if any purchase is unpaid for 60+ days as of the evaluation context, else False."""
+    oldest_unpaid = get_user_features(name).oldest_unpaid
+    return oldest_unpaid is not None and oldest_unpaid <= (ctx or get_eval_context()).cutoff(DEFAULT_OVERDUE_DAYS)
 
-def calculate_risk_scores(name):
+@timed('calculate_risk_scores')
+def calculate_risk_scores(name, ctx=None):
     """Calculate champion and challenger risk scores for a user based on utilization, overdue, income verification, and velocity."""
+    ctx = ctx or get_eval_context()
     utilization = calculate_utilization(name)
-    overdue = is_user_in_default(name)
+    overdue = is_user_in_default(name, ctx)
     income_status = get_income_verification_status(name)
-    velocity = calculate_transaction_velocity(name, 30)
+    velocity = calculate_transaction_velocity(name, 30, ctx)
     champion = 100 - 50*utilization - (30 if overdue else 0) - (10 if income_status != 'Verified' else 0)
     challenger = 100 - 40*utilization - (40 if overdue else 0) - (10 if income_status != 'Verified' else 0) - (10 if velocity > 5 else 0)
     return {'champion': round(champion, 2), 'challenger': round(challenger, 2)}
 
-def check_compliance(name):
-    """Check compliance for a user: age, income verification for large purchases, etc."""
+# --- Compliance State ---
+# The inputs of check_compliance are kept per user: the instant the user comes
+# of age (parsed from dob once), the number and largest of their purchases
+# over LARGE_PURCHASE, the latest income verification status, and the
+# purchases made since their last successful verification. Each user's
+# records are only ever appended to, so a state remembers how many of them it
+# has seen and advance() applies just the new ones: a write costs O(1) on the
+# next read instead of a rescan. A store that is replaced (re-ingested,
+# archived) drops every state.
+MAJORITY_US = MIN_AGE * 365 * US_PER_DAY
+
+class ComplianceState:
+    """Per-user compliance inputs, advanced as the user's purchases and verifications are appended."""
+    __slots__ = ('majority_us', 'large_purchases', 'max_purchase', 'income_status', 'verified_at',
+                 'purchases_since_verification', 'tx_seen', 'iv_seen')
+
+    def __init__(self, user, archived=None):
+        self.majority_us = to_epoch_us(datetime.strptime(user['dob'], '%Y-%m-%d')) + MAJORITY_US
+        self.large_purchases = archived_large_purchases(archived) if archived else 0
+        self.max_purchase = archived.get('max_purchase', 0.0) if archived else 0.0
+        self.income_status = 'Not Verified'
+        self.verified_at = None
+        self.purchases_since_verification = 0
+        self.tx_seen = 0
+        self.iv_seen = 0
+
+    def advance(self, user_tx, user_ivs):
+        """Apply the purchases and verifications appended since the last call."""
+        new_tx = user_tx[self.tx_seen:]
+        for t in new_tx:
+            if t.amount > LARGE_PURCHASE:
+                self.large_purchases += 1
+            if t.amount > self.max_purchase:
+                self.max_purchase = t.amount
+        verified_at = self.verified_at
+        for iv in user_ivs[self.iv_seen:]:
+            self.income_status = iv['status']
+            if iv['status'] == 'Verified':
+                self.verified_at = iv['timestamp']
+        if self.verified_at != verified_at:
+            # A new verification moves the boundary, so the count restarts from the user's purchases
+            self.purchases_since_verification = sum(1 for t in user_tx if t.timestamp > self.verified_at)
+        else:
+            self.purchases_since_verification += sum(1 for t in new_tx if verified_at is None or t.timestamp > verified_at)
+        self.tx_seen, self.iv_seen = len(user_tx), len(user_ivs)
+
+    def status(self, ctx):
+        """Return the compliance status as of an evaluation context."""
+        if ctx.as_of_us < self.majority_us:
+            return 'Underage'
+        if self.income_status != 'Verified' and self.large_purchases:
+            return 'Income Not Verified for Large Purchase'
+        return 'Compliant'
+
+# uid -> ComplianceState
+_compliance = {}
+# (transactions store, income verifications store, archive manifest generation) the states were built from
+_compliance_key = (None, None, None)
+_compliance_lock = threading.Lock()
+
+def get_compliance_state(name):
+    """Return the up-to-date ComplianceState of a registered user, or None for unknown names."""
+    global _compliance_key
     user = get_user(name)
     if not user:
+        return None
+    user_tx = get_user_transactions(name)
+    user_ivs = _records_for_user(INCOME_VERIFICATIONS_FILE, get_all_income_verifications(), name)
+    uid = get_user_registry().id_for(name, create=False)
+    rollups = archived_rollups()
+    key = (get_all_transactions(), get_all_income_verifications(), _generations[ARCHIVE_MANIFEST_FILE])
+    with _compliance_lock:
+        if not (_compliance_key[0] is key[0] and _compliance_key[1] is key[1] and _compliance_key[2] == key[2]):
+            _compliance.clear()
+            _compliance_key = key
+        state = _compliance.get(uid)
+        instrumentation.record_cache('compliance', state is not None)
+        if state is None:
+            state = _compliance[uid] = ComplianceState(user, rollups.get(uid))
+        state.advance(user_tx, user_ivs)
+    return state
+
+@timed('check_compliance')
+def check_compliance(name, ctx=None):
+    """Check compliance for a user as of the evaluation context: age, income verification for large purchases, etc."""
+    state = get_compliance_state(name)
+    if state is None:
         return 'Not Registered'
-    age = (datetime.now() - datetime.strptime(user['dob'], '%Y-%m-%d')).days // 365
-    if age < MIN_AGE:
-        return 'Underage'
-    if get_income_verification_status(name) != 'Verified':
-        for t in get_user_transactions(name):
-            if t['amount'] > 500:
-                return 'Income Not Verified for Large Purchase'
-    return 'Compliant'
+    return state.status(ctx or get_eval_context())
+
+# --- Aggregate Cache ---
+_sales_totals = (None, (0.0, 0))
+
+def get_sales_totals():
+    """Return (total_sales, order_count) over all transactions including archived ones, cached per store generation."""
+    global _sales_totals
+    transactions = get_all_transactions()
+    archived = get_archive_manifest()['partitions'].get('transactions', {}).values()
+    generation = (_generations[TRANSACTIONS_FILE], _generations[ARCHIVE_MANIFEST_FILE])
+    instrumentation.record_cache('sales_totals', _sales_totals[0] == generation)
+    if _sales_totals[0] != generation:
+        _sales_totals = (generation, (sum(t.amount for t in transactions) + sum(p['amount'] for p in archived),
+                                      len(transactions) + sum(p['rows'] for p in archived)))
+    return _sales_totals[1]
+
+# --- Velocity Counters ---
+# The checkout path reads a user's recent purchase count and spend from
+# sliding-window counters instead of the ledger. Each window is a ring of
+# fixed-width buckets holding a count and an amount, plus running totals:
+# a purchase adds to one bucket per window, and moving the clock forward
+# clears the buckets that fell out of the window. A query is O(1) amortized
+# and a user's counters take the same ~2.5 KB however long their history.
+# Each ring has one bucket more than its window spans, so a window may also
+# count up to one bucket of purchases from just before it, but never misses
+# one. Counters are built on a user's first checkout from their last 30 days
+# of purchases, then advanced with only the purchases appended since. They
+# answer for the present; a decision for an earlier ?as_of= falls back to the
+# exact per-user features.
+# (name, window seconds, buckets): 5-minute, hourly, 2-hourly and daily buckets
+VELOCITY_WINDOWS = (('1h', 3600, 12), ('24h', 86_400, 24), ('7d', 7 * 86_400, 84), ('30d', 30 * 86_400, 30))
+VELOCITY_WIDTHS = tuple(seconds * 1_000_000 // buckets for _, seconds, buckets in VELOCITY_WINDOWS)
+VELOCITY_SIZES = tuple(buckets + 1 for _, _, buckets in VELOCITY_WINDOWS)
+VELOCITY_OFFSETS = tuple(sum(VELOCITY_SIZES[:w]) for w in range(len(VELOCITY_WINDOWS)))
+# Checkouts are declined once this many purchases were made in the last 7 days
+VELOCITY_LIMIT_7D = int(os.environ.get('BNPL_VELOCITY_LIMIT_7D', 10))
+
+class VelocityCounters:
+    """Bucketed ring-buffer counts and amounts of one user's purchases over the 1h, 24h, 7d and 30d windows."""
+    __slots__ = ('counts', 'amounts', 'heads', 'totals', 'spent', 'latest_us', 'tx_seen')
+
+    def __init__(self):
+        slots = sum(VELOCITY_SIZES)
+        self.counts = array('l', [0]) * slots
+        self.amounts = array('d', [0.0]) * slots
+        # Newest bucket number of each window
+        self.heads = array('q', [-1 << 62]) * len(VELOCITY_WINDOWS)
+        self.totals = array('l', [0]) * len(VELOCITY_WINDOWS)
+        self.spent = array('d', [0.0]) * len(VELOCITY_WINDOWS)
+        self.latest_us = -1 << 62
+        self.tx_seen = 0
+
+    def _advance(self, w, bucket):
+        """Move window w forward to a bucket number, clearing the buckets that leave it."""
+        head = self.heads[w]
+        if bucket <= head:
+            return
+        size, base = VELOCITY_SIZES[w], VELOCITY_OFFSETS[w]
+        for b in range(max(head + 1, bucket - size + 1), bucket + 1):
+            slot = base + b % size
+            self.totals[w] -= self.counts[slot]
+            self.spent[w] -= self.amounts[slot]
+            self.counts[slot] = 0
+            self.amounts[slot] = 0.0
+        if not self.totals[w]:
+            self.spent[w] = 0.0  # drop float residue
+        self.heads[w] = bucket
+
+    def advance(self, now_us):
+        """Move every window forward to now."""
+        self.latest_us = max(self.latest_us, now_us)
+        for w, width in enumerate(VELOCITY_WIDTHS):
+            self._advance(w, now_us // width)
+
+    def add(self, timestamp, amount, now_us):
+        """Count a purchase; future-dated ones count as made now, older than a window are ignored by it."""
+        self.advance(now_us)
+        timestamp = min(timestamp, self.latest_us)
+        for w, width in enumerate(VELOCITY_WIDTHS):
+            bucket = timestamp // width
+            if bucket > self.heads[w] - VELOCITY_SIZES[w]:
+                slot = VELOCITY_OFFSETS[w] + bucket % VELOCITY_SIZES[w]
+                self.counts[slot] += 1
+                self.amounts[slot] += amount
+                self.totals[w] += 1
+                self.spent[w] += amount
+
+    def snapshot(self, now_us):
+        """Return {window: (count, amount)} as of now."""
+        self.advance(now_us)
+        return {name: (self.totals[w], round(self.spent[w], 2)) for w, (name, _, _) in enumerate(VELOCITY_WINDOWS)}
+
+# uid -> VelocityCounters
+_velocity = {}
+# Transactions store the counters were built from
+_velocity_store = None
+_velocity_lock = threading.Lock()
+
+def get_velocity(name, now_us):
+    """Return a user's {window: (purchase count, amount)} as of now_us, or None if now_us is before the counters' clock."""
+    global _velocity_store
+    user_tx = get_user_transactions(name)
+    uid = get_user_registry().id_for(name, create=False)
+    store = get_all_transactions()
+    with _velocity_lock:
+        if _velocity_store is not store:
+            _velocity.clear()
+            _velocity_store = store
+        counters = _velocity.get(uid)
+        instrumentation.record_cache('velocity', counters is not None)
+        if counters is None:
+            counters = VelocityCounters()
+            if uid is not None:
+                _velocity[uid] = counters
+        if now_us < counters.latest_us:
+            return None
+        for t in user_tx[counters.tx_seen:]:
+            counters.add(t.timestamp, t.amount, now_us)
+        counters.tx_seen = len(user_tx)
+        return counters.snapshot(now_us)
+
+# --- Checkout Decisions ---
+# Checkouts are decided from the cached per-user features rather than at
+# random. The inputs are the applicant's credit-limit headroom, default flag,
+# income verification status and velocity. The champion model scores the
+# utilization the purchase would bring the applicant to. Every input is a
+# cache or index lookup, so a decision takes microseconds instead of a pass
+# over the ledgers, and each decision is timed against DECISION_BUDGET_MS.
+# Applicants who are not registered (guest checkouts) are scored as new users
+# with the default credit limit and no history. Velocity comes from the
+# sliding-window counters, so the ">10 purchases in 7 days" rule of the
+# validator is enforced inline: an applicant who already made
+# VELOCITY_LIMIT_7D purchases in the last 7 days is declined.
+#
+# With BNPL_PROVIDER_URL set, the bureau's soft credit check and (above the
+# KYC threshold) the KYC/AML check are also sent to the provider service, both
+# at once and before the local features are read, so their latency overlaps.
+# A bureau decline or failed KYC declines the checkout. If the bureau cannot
+# be reached the decision rests on the local model; if a required KYC check
+# cannot be completed the checkout is declined. decision_ms is the engine's
+# own time and provider_ms the time spent waiting for the providers.
+CHECKOUT_MIN_SCORE = float(os.environ.get('BNPL_CHECKOUT_MIN_SCORE', 60))
+KYC_THRESHOLD = 150.0
+DECISION_BUDGET_MS = float(os.environ.get('BNPL_DECISION_BUDGET_MS', 25))
+
+def decide_checkout(name, amount, consent, ctx=None):
+    """Approve or decline a BNPL checkout; return the decision, its inputs and the rules that declined it."""
+    start = time.perf_counter()
+    checks = None
+    if providers.client is not None:
+        payload = {'user': name, 'amount': amount}
+        checks = providers.client.check_all({'credit': payload, **({'kyc': payload} if amount > KYC_THRESHOLD else {})})
+    ctx = ctx or get_eval_context()
+    user = get_user(name)
+    credit_limit = user.get('credit_limit', DEFAULT_CREDIT_LIMIT) if user else DEFAULT_CREDIT_LIMIT
+    features = get_user_features(name)
+    velocity = get_velocity(name, ctx.as_of_us)
+    if velocity is None:
+        velocity = {w: (features.velocity(ctx.cutoff(days)), None) for w, days in (('7d', 7), ('30d', 30))}
+    outstanding = max(0.0, features.total_purchases - features.total_repaid)
+    in_default = features.oldest_unpaid is not None and features.oldest_unpaid <= ctx.cutoff(DEFAULT_OVERDUE_DAYS)
+    income_status = get_income_verification_status(name)
+    headroom = credit_limit - outstanding
+    projected = min(1.0, (outstanding + amount) / credit_limit) if credit_limit else 1.0
+    # The champion model, on the utilization after this purchase
+    score = round(100 - 50*projected - (30 if in_default else 0) - (10 if income_status != 'Verified' else 0), 2)
+    rules = (
+        ('consent_required', not consent),
+        ('underage', user is not None and check_compliance(name, ctx) == 'Underage'),
+        ('in_default', in_default),
+        ('exceeds_credit_limit', amount > headroom),
+        ('income_verification_required', amount > LARGE_PURCHASE and income_status != 'Verified'),
+        ('score_below_threshold', score < CHECKOUT_MIN_SCORE),
+        ('velocity_limit', velocity['7d'][0] >= VELOCITY_LIMIT_7D),
+    )
+    reasons = [rule for rule, failed in rules if failed]
+    provider_fields = {}
+    waited = 0.0
+    if checks is not None:
+        wait_start = time.perf_counter()
+        (bureau, bureau_error), (kyc, kyc_error) = (providers.outcome(checks[c]) if c in checks else (None, None)
+                                                    for c in ('credit', 'kyc'))
+        waited = time.perf_counter() - wait_start
+        if bureau is not None and not bureau.get('passed'):
+            reasons.append('bureau_declined')
+        if kyc is not None and not kyc.get('passed'):
+            reasons.append('kyc_failed')
+        elif kyc_error is not None:
+            reasons.append('kyc_unavailable')
+        provider_fields = {
+            'bureau_score': bureau.get('score') if bureau else None,
+            'kyc_passed': kyc.get('passed') if kyc else None,
+            'provider_errors': [e for e in (bureau_error, kyc_error) if e],
+            'provider_ms': round(waited * 1000, 3),
+        }
+    decision = {
+        'approved': not reasons,
+        'reasons': reasons,
+        'credit_check_passed': not set(reasons) & {'in_default', 'exceeds_credit_limit', 'score_below_threshold', 'bureau_declined'},
+        'kyc_required': amount > KYC_THRESHOLD,
+        'champion_score': score,
+        'utilization': round(min(1.0, outstanding / credit_limit) if credit_limit else 0.0, 4),
+        'headroom': round(headroom, 2),
+        'in_default': in_default,
+        'income_status': income_status,
+        **{f'velocity_{w}': count for w, (count, _) in velocity.items()},
+        **{f'amount_{w}': amount for w, (_, amount) in velocity.items() if amount is not None},
+        **provider_fields,
+    }
+    elapsed = time.perf_counter() - start - waited
+    decision['decision_ms'] = round(elapsed * 1000, 3)
+    instrumentation.observe('bnpl_checkout_decision_seconds', elapsed, instrumentation.DECISION_BUCKETS,
+                            decision='approved' if decision['approved'] else 'declined')
+    if decision['decision_ms'] > DECISION_BUDGET_MS:
+        instrumentation.inc('bnpl_checkout_decisions_over_budget_total')
+        app.logger.warning('Checkout decision for %s took %.1f ms (budget %.0f ms)', name, decision['decision_ms'], DECISION_BUDGET_MS)
+    return decision
+
+PROVIDER_AUDIT_FIELDS = ('bureau_score', 'kyc_passed', 'provider_errors', 'provider_ms')
+
+def decision_audit_fields(decision):
+    """Return the fields of a decision recorded in its audit entry."""
+    return {
+        'credit_check_passed': decision['credit_check_passed'],
+        'decision': 'approved' if decision['approved'] else 'declined',
+        'decline_reasons': decision['reasons'],
+        **{k: decision[k] for k in ('champion_score', 'utilization', 'headroom', 'in_default', 'income_status',
+                                    'velocity_7d', 'velocity_30d', 'decision_ms')},
+        **{k: decision[k] for k in PROVIDER_AUDIT_FIELDS if k in decision},
+    }
+
+# --- User History Pages ---
+# The user detail page and /api/user/<name>/history list a user's purchases
+# and repayments newest first, one page at a time. Each user's rows of a
+# store are kept as (timestamp, position) keys in ascending order, where
+# position is the row's place in the user's index list. A page is a bisect
+# to its cursor plus a slice, so its cost does not grow with the length of
+# the account. Appended rows are merged into the order on the next read, and
+# a store that is replaced drops every order.
+HISTORY_PAGE_SIZE = 25
+HISTORY_MAX_PAGE = 200
+HISTORY_KINDS = {'transactions': TRANSACTIONS_FILE, 'repayments': REPAYMENTS_FILE}
+
+class HistoryOrder:
+    """A user's rows of one store as (timestamp, position) keys in ascending order."""
+    __slots__ = ('keys', 'seen')
+
+    def __init__(self):
+        self.keys = []
+        self.seen = 0
+
+    def advance(self, rows):
+        """Merge the rows appended since the last call into the order."""
+        keys = self.keys
+        for pos in range(self.seen, len(rows)):
+            key = (rows[pos].timestamp, pos)
+            if not keys or key > keys[-1]:
+                keys.append(key)
+            else:
+                # Back-dated rows (imports, edits) are rare, so an insort is cheaper than keeping a tree
+                insort(keys, key)
+        self.seen = len(rows)
+
+    def page(self, before, limit):
+        """Return the keys of up to limit rows older than the cursor key (newest first) and whether older rows remain."""
+        end = bisect_left(self.keys, before) if before is not None else len(self.keys)
+        start = max(0, end - limit)
+        return self.keys[start:end][::-1], start > 0
+
+# (filename, uid) -> HistoryOrder
+_history = {}
+# filename -> store the orders of that file were built from
+_history_stores = {}
+_history_lock = threading.Lock()
+
+def format_history_cursor(key):
+    return f"{key[0]}:{key[1]}"
+
+def parse_history_cursor(cursor):
+    """Parse a cursor returned as next_cursor; raise ValueError if it is malformed."""
+    timestamp, pos = cursor.split(':')
+    return int(timestamp), int(pos)
+
+def get_history_page(name, kind, before=None, limit=HISTORY_PAGE_SIZE):
+    """Return (rows, next cursor or None) for one page of a user's transactions or repayments, newest first."""
+    filename = HISTORY_KINDS[kind]
+    records = _load_store(filename, 'timestamp', _APPEND_STORES[filename][1])
+    rows = _records_for_user(filename, records, name)
+    uid = get_user_registry().id_for(name, create=False)
+    with _history_lock:
+        if _history_stores.get(filename) is not records:
+            for key in [k for k in _history if k[0] == filename]:
+                del _history[key]
+            _history_stores[filename] = records
+        order = _history.get((filename, uid))
+        instrumentation.record_cache('history', order is not None)
+        if order is None:
+            order = HistoryOrder()
+            if uid is not None:
+                _history[(filename, uid)] = order
+        order.advance(rows)
+        keys, more = order.page(before, limit)
+    page = [{'amount': rows[pos].amount, 'timestamp': format_timestamp(ts)} for ts, pos in keys]
+    return page, format_history_cursor(keys[-1]) if more and keys else None
+
+# --- Read API Responses ---
+# Bodies of the read-only JSON endpoints, shared by the Flask routes and the
+# ASGI read API in asgi_api.py so both serve identical payloads.
+def user_summary(name, ctx):
+    """Return the risk summary served by /api/user/<name>, or None if the user does not exist."""
+    if not get_user(name):
+        return None
+    return {
+        'name': name,
+        'risk_scores': calculate_risk_scores(name, ctx),
+        'utilization': calculate_utilization(name),
+        'transaction_velocity_7d': calculate_transaction_velocity(name, 7, ctx),
+        'transaction_velocity_30d': calculate_transaction_velocity(name, 30, ctx),
+        'default_status': is_user_in_default(name, ctx),
+        'compliance': check_compliance(name, ctx),
+        'purchases_since_verification': get_compliance_state(name).purchases_since_verification,
+    }
+
+def user_history(name, kind, before=None, limit=HISTORY_PAGE_SIZE):
+    """Return the page served by /api/user/<name>/history, or None if the user does not exist."""
+    if not get_user(name):
+        return None
+    rows, next_cursor = get_history_page(name, kind, before, limit)
+    return {'name': name, 'kind': kind, 'rows': rows, 'next_cursor': next_cursor}
+
+def parse_history_page_args(args):
+    """Parse the ?kind=, ?before= and ?limit= arguments of /api/user/<name>/history; raise ValueError if invalid."""
+    kind = args.get('kind', 'transactions')
+    if kind not in HISTORY_KINDS:
+        raise ValueError(f"kind must be one of {', '.join(HISTORY_KINDS)}")
+    before = args.get('before')
+    try:
+        before = parse_history_cursor(before) if before else None
+    except ValueError:
+        raise ValueError('Invalid before cursor')
+    try:
+        limit = int(args.get('limit', HISTORY_PAGE_SIZE))
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    return kind, before, max(1, min(limit, HISTORY_MAX_PAGE))
+
+def _with_history(filename, record_type, records, user=None, since=None, include_archived=False):
+    """Prepend a user's (or everyone's) archived rows when requested, and keep only rows at or after 'since'."""
+    if include_archived:
+        registry = get_user_registry()
+        archived = [record_type.from_dict(r, registry) for r in read_archive(filename, since)]
+        if user:
+            uid = registry.id_for(user, create=False)
+            archived = [r for r in archived if r.user_id == uid]
+        records = archived + list(records)
+    if since is not None:
+        records = [r for r in records if r.timestamp >= since]
+    return records
+
+def transactions_for_output(user=None, provider=None, product=None, region=None, since=None, include_archived=False):
+    """Return the transactions served by /api/transactions, optionally for one user, filtered and with archived history."""
+    txs = get_user_transactions(user) if user else get_all_transactions()
+    txs = _with_history(TRANSACTIONS_FILE, Transaction, txs, user, since, include_archived)
+    registry = get_user_registry()
+    filtered = []
+    for t in txs:
+        # Simulate provider/product/region for demo
+        if provider and provider not in ['Klarna', 'Affirm', 'Afterpay']:
+            continue
+        if product and product not in [p['name'] for p in PRODUCTS]:
+            continue
+        if region and region not in ['US', 'EU', 'CA', 'UAE']:
+            continue
+        filtered.append(record_for_output(t, registry))
+    return filtered
+
+def repayments_for_output(user=None, since=None, include_archived=False):
+    """Return the repayments served by /api/repayments, optionally for one user and with archived history."""
+    rps = get_user_repayments(user) if user else get_all_repayments()
+    rps = _with_history(REPAYMENTS_FILE, Repayment, rps, user, since, include_archived)
+    registry = get_user_registry()
+    return [record_for_output(r, registry) for r in rps]
+
+def audit_log_for_output(since=None, include_archived=False):
+    """Return the audit entries served by /api/audit-log, optionally with archived entries."""
+    log = load_audit_log()
+    if include_archived:
+        log = read_archive(AUDIT_LOG_FILE, since) + log
+    if since is not None:
+        log = [e for e in log if 'timestamp' in e and parse_timestamp(e['timestamp']) >= since]
+    return log
+
+def merchant_analytics():
+    """Return the sales totals served by /api/merchant/analytics."""
+    total_sales, order_count = get_sales_totals()
+    aov = (total_sales / order_count) if order_count else 0
+    return {'total_sales': total_sales, 'order_count': order_count, 'aov': aov}
+
+# --- Startup Warmup and Readiness ---
+# After a deploy the first requests would otherwise pay for ingesting every
+# data file. warm_up() loads the stores in parallel, builds the per-user
+# indexes and precomputes the feature and aggregate caches, logging the time
+# spent in each phase. /healthz reports liveness and /readyz returns 503 until
+# warmup has finished, so a load balancer only routes traffic to a warm
+# process. The first readiness probe starts warmup if nothing else has (e.g.
+# under a WSGI server); BNPL_WARMUP=1 starts it as soon as the module loads.
+WARMUP_WORKERS = 4
+warmup_state = {'status': 'cold', 'phases': {}}
+_warmup_lock = threading.Lock()
+
+def _warmup_phase(name, fn):
+    """Run one warmup phase, recording and logging its wall time."""
+    start = time.perf_counter()
+    fn()
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    warmup_state['phases'][name] = round(elapsed_ms, 1)
+    app.logger.info('Warmup phase %s took %.1f ms', name, elapsed_ms)
+
+def _warm_stores():
+    """Ingest every data file, one worker thread per file."""
+    loaders = [get_all_transactions, get_all_repayments, get_all_income_verifications, load_audit_log, event_log.refresh]
+    with ThreadPoolExecutor(max_workers=WARMUP_WORKERS, thread_name_prefix='bnpl-warmup') as pool:
+        for future in [pool.submit(loader) for loader in loaders]:
+            future.result()
+
+def _warm_indexes():
+    """Build the per-user id indexes of the ledger stores."""
+    _user_index(TRANSACTIONS_FILE, get_all_transactions())
+    _user_index(REPAYMENTS_FILE, get_all_repayments())
+    _user_index(INCOME_VERIFICATIONS_FILE, get_all_income_verifications())
+
+def _warm_features():
+    """Precompute the feature cache for every registered user."""
+    for user in get_all_users():
+        get_user_features(user['name'])
+
+def warm_up():
+    """Preload and index all data stores and precompute the score and aggregate caches."""
+    start = time.perf_counter()
+    try:
+        # Ledger rows reference user ids, so the registry is built before the stores load in parallel
+        _warmup_phase('users', get_user_registry)
+        _warmup_phase('stores', _warm_stores)
+        _warmup_phase('indexes', _warm_indexes)
+        _warmup_phase('features', _warm_features)
+        _warmup_phase('aggregates', get_sales_totals)
+    except Exception:
+        warmup_state['status'] = 'failed'
+        app.logger.exception('Warmup failed')
+        return
+    warmup_state['status'] = 'ready'
+    app.logger.info('Warmup finished in %.1f ms', (time.perf_counter() - start) * 1000)
+
+def start_warmup():
+    """Start warmup in a background thread unless it has already been started."""
+    with _warmup_lock:
+        if warmup_state['status'] not in ('cold', 'failed'):
+            return
+        warmup_state['status'] = 'warming'
+        warmup_state['phases'] = {}
+    threading.Thread(target=warm_up, name='bnpl-warmup', daemon=True).start()
+
+@app.route('/healthz')
+def healthz():
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    start_warmup()
+    ready = warmup_state['status'] == 'ready'
+    return jsonify(warmup_state), (200 if ready else 503)
+
+# --- Request Instrumentation ---
+# Every request records its latency and data-file I/O into the in-process
+# metrics exposed at /metrics. Sending an X-Profile header additionally runs
+# the request under cProfile and dumps the stats into BNPL_PROFILE_DIR; this
+# is only honored when that directory is configured.
+PROFILE_DIR = os.environ.get('BNPL_PROFILE_DIR')
+
+@app.before_request
+def _start_request_instrumentation():
+    g.request_start = time.perf_counter()
+    instrumentation.begin_request()
+    if PROFILE_DIR and request.headers.get('X-Profile'):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def _finish_request_instrumentation(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        endpoint = request.endpoint or 'unmatched'
+        path = os.path.join(PROFILE_DIR, f"{endpoint}-{datetime.now().strftime('%Y%m%dT%H%M%S%f')}.prof")
+        profiler.dump_stats(path)
+        response.headers['X-Profile-Dump'] = path
+    start = g.pop('request_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        instrumentation.end_request(route, response.status_code, time.perf_counter() - start)
+    return response
+
+@app.route('/metrics')
+def metrics():
+    return Response(instrumentation.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+# --- Conditional GET ---
+# Polled read endpoints and the CSV exports answer with a strong ETag and a
+# Last-Modified header derived from the generations of the stores they read.
+# A store's generation is the change marker of its file (the mtime and size
+# store_is_current compares) plus the rows appended to it under the
+# write-ahead log since the last checkpoint. It costs a stat, is the same in
+# every worker and survives restarts. A request whose If-None-Match (or,
+# without one, If-Modified-Since) still matches is answered 304 before the
+# view loads or serializes anything.
+#
+# Route -> (data files its response is built from, in-memory state it serves,
+# whether it needs the API key). Routes honoring ?include_archived=1 also
+# read the archive manifest then.
+CONDITIONAL_ROUTES = {
+    '/api/products': ((), 'products', False),
+    '/api/providers': ((), 'providers', True),
+    '/api/users': ((USERS_FILE,), None, True),
+    '/api/merchant/analytics': ((TRANSACTIONS_FILE, ARCHIVE_MANIFEST_FILE), None, False),
+    '/api/audit-log': ((AUDIT_LOG_FILE,), None, False),
+    '/api/audit-log.csv': ((AUDIT_LOG_FILE,), None, True),
+    '/api/transactions': ((USERS_FILE, TRANSACTIONS_FILE), None, True),
+    '/api/transactions.csv': ((USERS_FILE, TRANSACTIONS_FILE), None, True),
+    '/api/repayments': ((USERS_FILE, REPAYMENTS_FILE), None, True),
+    '/api/repayments.csv': ((USERS_FILE, REPAYMENTS_FILE), None, True),
+    '/api/user/<name>/history': ((USERS_FILE, TRANSACTIONS_FILE, REPAYMENTS_FILE), None, False),
+}
+# In-memory state -> when it last changed, for Last-Modified
+_state_modified = {'products': time.time(), 'providers': time.time()}
+
+def store_generation(filename):
+    """Return a marker that changes whenever a data store changes, read with a stat and without loading the store."""
+    return _file_version(filename), len(_wal_pending.get(filename, ()))
+
+def memory_state(name):
+    """Return (value, last change as epoch seconds) of in-memory state served by a read endpoint."""
+    value = tuple(sorted(enabled_providers)) if name == 'providers' else None
+    return value, _state_modified[name]
+
+def read_validators(route, args):
+    """Return (strong ETag, Last-Modified epoch seconds or None) for a conditional route and its query arguments."""
+    files, state, _ = CONDITIONAL_ROUTES[route]
+    if args.get('include_archived') in ('1', 'true'):
+        files += (ARCHIVE_MANIFEST_FILE,)
+    generations = [store_generation(f) for f in files]
+    value, modified = memory_state(state) if state else (None, None)
+    etag = hashlib.blake2b(repr((route, sorted(args.items()), generations, value)).encode(), digest_size=16).hexdigest()
+    times = [version[0] / 1e9 for version, _ in generations if version is not None]
+    # Pending appends are only in the write-ahead log until the next checkpoint
+    if any(pending for _, pending in generations) and os.path.exists(EVENTS_FILE):
+        times.append(os.stat(EVENTS_FILE).st_mtime)
+    if modified is not None:
+        times.append(modified)
+    return f'"{etag}"', max(times) if times else None
+
+def is_not_modified(if_none_match, if_modified_since, etag, last_modified):
+    """Return True if a request's validators show the client already has the current response."""
+    if if_none_match:
+        tags = parse_etags(if_none_match)
+        return any(tags.contains(variant.strip('"')) for variant in serialization.etag_variants(etag))
+    if if_modified_since and last_modified is not None:
+        since = parse_date(if_modified_since)
+        return since is not None and int(last_modified) <= since.timestamp()
+    return False
+
+def validator_headers(etag, last_modified):
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+    return headers
+
+def conditional_get(view):
+    """Serve a route listed in CONDITIONAL_ROUTES with ETag and Last-Modified, answering 304 while the client's copy is current."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        # The key is checked first so that a 304 is never served to an unauthenticated client
+        if CONDITIONAL_ROUTES[request.url_rule.rule][2]:
+            require_api_key()
+        etag, last_modified = read_validators(request.url_rule.rule, request.args.to_dict())
+        if is_not_modified(request.headers.get('If-None-Match'), request.headers.get('If-Modified-Since'), etag, last_modified):
+            return Response(status=304, headers=validator_headers(etag, last_modified))
+        response = make_response(view(*args, **kwargs))
+        if response.status_code == 200:
+            fmt = 'msgpack' if response.mimetype == serialization.MSGPACK_MIMETYPE else None
+            response.headers.update(validator_headers(serialization.etag_variant(etag, fmt), last_modified))
+        return response
+    return wrapper
+
+# --- Response Encoding ---
+# The large listings are sent as MessagePack to clients that prefer it, and
+# API responses over BNPL_COMPRESS_MIN_BYTES are gzip- or brotli-compressed
+# for clients that accept it (see serialization.py). JSON itself goes through
+# FastJSONProvider, so every jsonify uses the fast encoder.
+def api_response(payload):
+    """Return a payload as JSON, or as MessagePack when the client prefers it and msgpack is installed."""
+    if serialization.prefers_msgpack(request.headers.get('Accept')):
+        response = Response(serialization.dumps_msgpack(payload), mimetype=serialization.MSGPACK_MIMETYPE)
+    else:
+        response = jsonify(payload)
+    response.vary.add('Accept')
+    return response
+
+@app.after_request
+def _compress_response(response):
+    if response.status_code != 200 or response.direct_passthrough or response.is_streamed \
+            or 'Content-Encoding' in response.headers or response.mimetype not in serialization.COMPRESSIBLE_TYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = serialization.choose_encoding(request.headers.get('Accept-Encoding'))
+    body = response.get_data()
+    if encoding is None or not serialization.should_compress(response.mimetype, len(body)):
+        return response
+    start = time.perf_counter()
+    response.set_data(serialization.compress(body, encoding))
+    instrumentation.observe('bnpl_response_compress_seconds', time.perf_counter() - start, encoding=encoding)
+    instrumentation.inc('bnpl_response_bytes_saved_total', len(body) - response.content_length, encoding=encoding)
+    response.headers['Content-Encoding'] = encoding
+    etag = response.headers.get('ETag')
+    if etag:
+        response.headers['ETag'] = serialization.etag_variant(etag, encoding)
+    return response
 
 # --- API Endpoints ---
 @app.route('/api/user/<name>')
 def api_user(name):
-    user = get_user(name)
-    if not user:
+    summary = user_summary(name, get_eval_context())
+    if summary is None:
         return jsonify({'error': 'User not found'}), 404
-    risk_scores = calculate_risk_scores(name)
-    utilization = calculate_utilization(name)
-    velocity_7 = calculate_transaction_velocity(name, 7)
-    velocity_30 = calculate_transaction_velocity(name, 30)
-    default_status = is_user_in_default(name)
-    compliance = check_compliance(name)
-    return jsonify({
-        'name': name,
-        'risk_scores': risk_scores,
-        'utilization': utilization,
-        'transaction_velocity_7d': velocity_7,
-        'transaction_velocity_30d': velocity_30,
-        'default_status': default_status,
-        'compliance': compliance
-    })
+    return jsonify(summary)
+
+@app.route('/api/user/<name>/history')
+@conditional_get
+def api_user_history(name):
+    try:
+        kind, before, limit = parse_history_page_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    page = user_history(name, kind, before, limit)
+    if page is None:
+        return jsonify({'error': 'User not found'}), 404
+    return api_response(page)
 
 @app.route('/')
 def home():
@@ -230,9 +2349,7 @@ def register():
         if age < MIN_AGE:
             flash('User must be at least 18 years old.')
             return redirect(url_for('register'))
-        users = get_all_users()
-        users.append({'name': name, 'dob': dob, 'registered': datetime.now().isoformat(), 'credit_limit': DEFAULT_CREDIT_LIMIT})
-        save_all_users(users)
+        append_user({'name': name, 'dob': dob, 'registered': to_epoch_us(datetime.now()), 'credit_limit': DEFAULT_CREDIT_LIMIT})
         flash('Registration successful!')
         return redirect(url_for('home'))
     return render_template('register.html')
@@ -242,9 +2359,12 @@ def purchase():
     if request.method == 'POST':
         user = request.form['user']
         amount = float(request.form['amount'])
-        transactions = get_all_transactions()
-        transactions.append({'user': user, 'amount': amount, 'timestamp': datetime.now().isoformat()})
-        save_all_transactions(transactions)
+        now = to_epoch_us(datetime.now())
+        rejected, _ = write_guard.check('purchase', user, amount, now, now)
+        if rejected:
+            flash(WRITE_REJECTION_MESSAGES[rejected[0]])
+            return redirect(url_for('purchase'))
+        append_transaction(user, amount, now)
         flash('Purchase successful!')
         return redirect(url_for('home'))
     return render_template('purchase.html', users=[u['name'] for u in get_all_users()])
@@ -254,9 +2374,12 @@ def repay():
     if request.method == 'POST':
         user = request.form['user']
         amount = float(request.form['amount'])
-        repayments = get_all_repayments()
-        repayments.append({'user': user, 'amount': amount, 'timestamp': datetime.now().isoformat()})
-        save_all_repayments(repayments)
+        now = to_epoch_us(datetime.now())
+        rejected, _ = write_guard.check('repayment', user, amount, now, now)
+        if rejected:
+            flash(WRITE_REJECTION_MESSAGES[rejected[0]])
+            return redirect(url_for('repay'))
+        append_repayment(user, amount, now)
         flash('Repayment successful!')
         return redirect(url_for('home'))
     return render_template('repay.html', users=[u['name'] for u in get_all_users()])
@@ -266,9 +2389,7 @@ def income_verification():
     if request.method == 'POST':
         user = request.form['user']
         status = request.form['status']
-        ivs = get_all_income_verifications()
-        ivs.append({'user': user, 'status': status, 'timestamp': datetime.now().isoformat()})
-        save_all_income_verifications(ivs)
+        append_income_verification(user, status, to_epoch_us(datetime.now()))
         flash('Income verification updated!')
         return redirect(url_for('home'))
     return render_template('income_verification.html', users=[u['name'] for u in get_all_users()])
@@ -277,12 +2398,13 @@ def income_verification():
 def dashboard():
     user_infos = []
     users = get_all_users()
+    ctx = get_eval_context()
     for user in users:
         name = user['name']
-        risk_scores = calculate_risk_scores(name)
+        risk_scores = calculate_risk_scores(name, ctx)
         utilization = calculate_utilization(name)
-        default_status = is_user_in_default(name)
-        compliance = check_compliance(name)
+        default_status = is_user_in_default(name, ctx)
+        compliance = check_compliance(name, ctx)
         user_infos.append({
             'name': name,
             'risk_scores': risk_scores,
@@ -294,28 +2416,24 @@ def dashboard():
 
 @app.route('/dashboard/user/<name>')
 def dashboard_user(name):
-    user = get_user(name)
-    if not user:
+    summary = user_summary(name, get_eval_context())
+    if summary is None:
         flash('User not found')
         return redirect(url_for('dashboard'))
-    risk_scores = calculate_risk_scores(name)
-    utilization = calculate_utilization(name)
-    velocity_7 = calculate_transaction_velocity(name, 7)
-    velocity_30 = calculate_transaction_velocity(name, 30)
-    default_status = is_user_in_default(name)
-    compliance = check_compliance(name)
-    txs = get_user_transactions(name)
-    rps = get_user_repayments(name)
+    # Only the newest page of each history is rendered; older pages are fetched by the page as needed
+    history = {}
+    for kind in HISTORY_KINDS:
+        rows, next_cursor = get_history_page(name, kind)
+        history[kind] = {'rows': rows, 'next_cursor': next_cursor}
     return render_template('user_detail.html',
         name=name,
-        risk_scores=risk_scores,
-        utilization=utilization,
-        velocity_7=velocity_7,
-        velocity_30=velocity_30,
-        default_status=default_status,
-        compliance=compliance,
-        transactions=txs,
-        repayments=rps
+        risk_scores=summary['risk_scores'],
+        utilization=summary['utilization'],
+        velocity_7=summary['transaction_velocity_7d'],
+        velocity_30=summary['transaction_velocity_30d'],
+        default_status=summary['default_status'],
+        compliance=summary['compliance'],
+        history=history
     )
 
 PRODUCTS = [
@@ -338,14 +2456,16 @@ promotions = [
     {'title': 'Free Shipping for BNPL Orders', 'desc': 'Encourage larger carts with free shipping.'}
 ]
 
-def simulate_soft_credit_check(user_name):
-    # For demo, randomly approve 90% of users
-    import random
-    return random.random() < 0.9
+CHECKOUT_DECLINE_MESSAGES = {
+    'underage': 'You must be at least 18 to use BNPL.',
+    'income_verification_required': 'Income verification is required for purchases over $500.',
+    'kyc_failed': 'Identity verification (KYC) failed.',
+    'kyc_unavailable': 'Identity verification (KYC) is unavailable. Please try again shortly.',
+    'velocity_limit': 'Too many BNPL purchases in the last 7 days. Please try again later.',
+}
 
 @app.route('/checkout', methods=['GET', 'POST'])
 def checkout():
-    import random
     regions = ['US', 'EU', 'CA', 'UAE']
     selected_region = request.form.get('region', 'US')
     selected_product = PRODUCTS[0]
@@ -364,30 +2484,32 @@ def checkout():
         selected_product = next((p for p in PRODUCTS if p['id'] == product_id), PRODUCTS[0])
         enabled = [p for p in BNPL_PROVIDERS if p['name'] in enabled_providers]
         selected_provider = next((p for p in enabled if p['name'] == provider_name), enabled[0] if enabled else BNPL_PROVIDERS[0])
-        # Simulate KYC/AML for high-value
-        kyc_required = selected_product['price'] > 150
-        # Simulate soft credit check
-        credit_check_passed = simulate_soft_credit_check(user_name)
-        if not credit_check_passed:
-            error = 'Soft credit check failed. Please try another provider or payment method.'
-        elif 'consent' not in request.form:
+        decision = decide_checkout(user_name, selected_product['price'], 'consent' in request.form)
+        now = to_epoch_us(datetime.now())
+        _, anomalies = write_guard.check('checkout', user_name, selected_product['price'], now, now, record=True)
+        kyc_required = decision['kyc_required']
+        credit_check_passed = decision['credit_check_passed']
+        if 'consent_required' in decision['reasons']:
             error = 'Consent is required.'
+        elif not credit_check_passed:
+            error = 'Soft credit check failed. Please try another provider or payment method.'
+        elif not decision['approved']:
+            error = CHECKOUT_DECLINE_MESSAGES[decision['reasons'][0]]
         else:
             activated = True
             flash(f"BNPL activated with {selected_provider['name']}: 4 payments of ${selected_product['price']/4:.2f}" + (f" (APR: {selected_provider['apr']}%, Fee: ${selected_provider['fee']})" if selected_provider['apr'] or selected_provider['fee'] else ""))
         # Log audit
-        audit_log = load_audit_log()
-        audit_log.append({
+        append_audit_entry({
             'user': user_name,
             'region': selected_region,
             'product': selected_product['name'],
             'provider': selected_provider['name'],
             'consent': 'consent' in request.form,
             'kyc_required': kyc_required,
-            'credit_check_passed': credit_check_passed,
+            **decision_audit_fields(decision),
+            **({'anomalies': anomalies} if anomalies else {}),
             'timestamp': datetime.now().isoformat()
         })
-        save_audit_log(audit_log)
     enabled = [p for p in BNPL_PROVIDERS if p['name'] in enabled_providers]
     return render_template('checkout.html',
         products=PRODUCTS,
@@ -403,20 +2525,19 @@ def checkout():
     )
 
 @app.route('/api/products')
+@conditional_get
 def api_products():
     return jsonify(PRODUCTS)
 
 @app.route('/api/merchant/analytics')
+@conditional_get
 def api_merchant_analytics():
-    transactions = get_all_transactions()
-    total_sales = sum(t['amount'] for t in transactions)
-    order_count = len(transactions)
-    aov = (total_sales / order_count) if order_count else 0
-    return jsonify({'total_sales': total_sales, 'order_count': order_count, 'aov': aov})
+    return jsonify(merchant_analytics())
 
 @app.route('/api/audit-log')
+@conditional_get
 def api_audit_log():
-    return jsonify(load_audit_log())
+    return api_response(audit_log_for_output(*_history_args()))
 
 @app.route('/api-docs')
 def api_docs():
@@ -432,16 +2553,10 @@ def merchant_dashboard():
     sales_by_week = defaultdict(float)
     sales_by_month = defaultdict(float)
     for t in transactions:
-        if hasattr(t['timestamp'], 'date'):
-            day = t['timestamp'].date()
-            week = t['timestamp'].isocalendar()[1]
-            month = t['timestamp'].strftime('%Y-%m')
-        else:
-            from datetime import datetime
-            dt = datetime.fromisoformat(t['timestamp'])
-            day = dt.date()
-            week = dt.isocalendar()[1]
-            month = dt.strftime('%Y-%m')
+        dt = from_epoch_us(t['timestamp'])
+        day = dt.date()
+        week = dt.isocalendar()[1]
+        month = dt.strftime('%Y-%m')
         sales_by_day[day] += t['amount']
         sales_by_week[week] += t['amount']
         sales_by_month[month] += t['amount']
@@ -459,7 +2574,7 @@ def merchant_dashboard():
         product = random.choice(product_names)
         product_sales[product] += 1
     # Customer segmentation (repeat vs new)
-    user_tx_count = Counter([t['user'] for t in transactions])
+    user_tx_count = Counter(t.user_id for t in transactions)
     repeat_customers = sum(1 for c in user_tx_count.values() if c > 1)
     new_customers = sum(1 for c in user_tx_count.values() if c == 1)
     # Default/loss rates (simulated)
@@ -477,6 +2592,7 @@ def merchant_dashboard():
                 enabled_providers.remove(prov)
             else:
                 enabled_providers.add(prov)
+            _state_modified['providers'] = time.time()
         if 'add_promo' in request.form:
             title = request.form['promo_title']
             desc = request.form['promo_desc']
@@ -522,83 +2638,136 @@ def require_api_key():
 from flask import Response
 import io
 
+def _history_args():
+    """Parse the ?since= and ?include_archived= arguments of the listing and export endpoints."""
+    since = request.args.get('since')
+    try:
+        since = to_epoch_us(datetime.fromisoformat(since)) if since else None
+    except ValueError:
+        abort(400, 'Invalid since timestamp')
+    return since, request.args.get('include_archived') in ('1', 'true')
+
 @app.route('/api/transactions')
+@conditional_get
 def api_transactions():
     require_api_key()
-    txs = get_all_transactions()
-    user = request.args.get('user')
-    provider = request.args.get('provider')
-    product = request.args.get('product')
-    region = request.args.get('region')
-    filtered = []
-    for t in txs:
-        if user and t['user'] != user:
-            continue
-        # Simulate provider/product/region for demo
-        if provider and provider not in ['Klarna', 'Affirm', 'Afterpay']:
-            continue
-        if product and product not in [p['name'] for p in PRODUCTS]:
-            continue
-        if region and region not in ['US', 'EU', 'CA', 'UAE']:
-            continue
-        filtered.append(t)
-    return jsonify(filtered)
+    return api_response(transactions_for_output(request.args.get('user'), request.args.get('provider'),
+                                           request.args.get('product'), request.args.get('region'), *_history_args()))
 
 @app.route('/api/transactions.csv')
+@conditional_get
 def api_transactions_csv():
     require_api_key()
-    txs = get_all_transactions()
+    since, include_archived = _history_args()
+    txs = _with_history(TRANSACTIONS_FILE, Transaction, get_all_transactions(), since=since, include_archived=include_archived)
     output = io.StringIO()
-    writer = csv.DictWriter(output, fieldnames=txs[0].keys())
+    writer = csv.DictWriter(output, fieldnames=Transaction.FIELDS)
     writer.writeheader()
-    writer.writerows(txs)
+    registry = get_user_registry()
+    writer.writerows(record_for_output(t, registry) for t in txs)
     return Response(output.getvalue(), mimetype='text/csv', headers={'Content-Disposition': 'attachment;filename=transactions.csv'})
 
 @app.route('/api/repayments')
+@conditional_get
 def api_repayments():
     require_api_key()
-    rps = get_all_repayments()
-    user = request.args.get('user')
-    filtered = [r for r in rps if not user or r['user'] == user]
-    return jsonify(filtered)
+    return api_response(repayments_for_output(request.args.get('user'), *_history_args()))
 
 @app.route('/api/repayments.csv')
+@conditional_get
 def api_repayments_csv():
     require_api_key()
-    rps = get_all_repayments()
+    since, include_archived = _history_args()
+    rps = _with_history(REPAYMENTS_FILE, Repayment, get_all_repayments(), since=since, include_archived=include_archived)
     output = io.StringIO()
-    writer = csv.DictWriter(output, fieldnames=rps[0].keys())
+    writer = csv.DictWriter(output, fieldnames=Repayment.FIELDS)
     writer.writeheader()
-    writer.writerows(rps)
+    registry = get_user_registry()
+    writer.writerows(record_for_output(r, registry) for r in rps)
     return Response(output.getvalue(), mimetype='text/csv', headers={'Content-Disposition': 'attachment;filename=repayments.csv'})
 
 @app.route('/api/audit-log.csv')
+@conditional_get
 def api_audit_log_csv():
     require_api_key()
-    log = load_audit_log()
+    log = audit_log_for_output(*_history_args())
     output = io.StringIO()
-    writer = csv.DictWriter(output, fieldnames=log[0].keys())
+    # Entries gain fields over time (e.g. checkout decisions), so the header is the union of all keys
+    writer = csv.DictWriter(output, fieldnames=list(dict.fromkeys(k for entry in log for k in entry)))
     writer.writeheader()
-    writer.writerows(log)
+    writer.writerows({k: '; '.join(v) if isinstance(v, list) else v for k, v in entry.items()} for entry in log)
     return Response(output.getvalue(), mimetype='text/csv', headers={'Content-Disposition': 'attachment;filename=audit_log.csv'})
 
+# Long-poll requests wait at most this long; SSE streams send a heartbeat at this interval
+EVENTS_MAX_WAIT = 30.0
+
+def _event_cursor(value):
+    """Parse an 'after' sequence number, answering 400 if it is not a non-negative integer."""
+    try:
+        after = int(value or 0)
+    except ValueError:
+        abort(400, 'Invalid after sequence number')
+    if after < 0:
+        abort(400, 'Invalid after sequence number')
+    return after
+
+@app.route('/api/events')
+def api_events():
+    """Events after ?after=<seq>; with ?wait=<seconds>, hold the request until one arrives (long-poll)."""
+    require_api_key()
+    after = _event_cursor(request.args.get('after'))
+    limit = min(request.args.get('limit', EVENTS_MAX_BATCH, type=int), EVENTS_MAX_BATCH)
+    wait = min(request.args.get('wait', 0, type=float), EVENTS_MAX_WAIT)
+    if wait > 0:
+        event_log.wait(after, wait)
+    events = event_log.read(after, max(limit, 0))
+    return jsonify({'events': events, 'last_seq': events[-1]['seq'] if events else after, 'head_seq': event_log.head})
+
+@app.route('/api/events/stream')
+def api_events_stream():
+    """Server-sent events stream of the feed, resuming after ?after=<seq> or the Last-Event-ID header."""
+    require_api_key()
+    after = _event_cursor(request.headers.get('Last-Event-ID') or request.args.get('after'))
+
+    def stream(after):
+        yield 'retry: 2000\n\n'
+        while True:
+            event_log.wait(after, EVENTS_MAX_WAIT)
+            events = event_log.read(after)
+            if not events:
+                yield ': keep-alive\n\n'
+                continue
+            for event in events:
+                yield f"id: {event['seq']}\nevent: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+            after = events[-1]['seq']
+
+    return Response(stream(after), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/users')
+@conditional_get
 def api_users():
     require_api_key()
-    return jsonify(get_all_users())
+    return api_response([record_for_output(u) for u in get_all_users()])
 
 @app.route('/api/providers')
+@conditional_get
 def api_providers():
     require_api_key()
-    return jsonify(list(enabled_providers))
+    return jsonify(sorted(enabled_providers))
 
 @app.route('/api/kyc-check', methods=['POST'])
 def api_kyc_check():
     require_api_key()
     data = request.json
+    amount = data.get('amount', 0)
+    if providers.client is not None:
+        try:
+            answer = providers.client.call('kyc', {'user': data.get('user', ''), 'amount': amount})
+        except providers.ProviderError as e:
+            return jsonify({'error': str(e)}), 503
+        return jsonify({'kyc_passed': bool(answer.get('passed'))})
     # Simulate KYC/AML: pass if amount <= 150, else random
     import random
-    amount = data.get('amount', 0)
     if amount <= 150:
         return jsonify({'kyc_passed': True})
     return jsonify({'kyc_passed': random.random() > 0.1})
@@ -612,26 +2781,43 @@ def api_checkout():
     provider = data.get('provider')
     region = data.get('region', 'US')
     consent = data.get('consent', False)
-    amount = data.get('amount', 0)
-    # Simulate credit check
-    import random
-    credit_check_passed = random.random() < 0.9
-    kyc_required = amount > 150
-    approved = consent and credit_check_passed and (not kyc_required or random.random() > 0.1)
+    amount = data.get('amount')
+    if not isinstance(user, str) or not isinstance(amount, (int, float)) or isinstance(amount, bool) or amount <= 0:
+        return jsonify({'error': 'user and a positive numeric amount are required'}), 400
+    now = to_epoch_us(datetime.now())
+    rejected, anomalies = write_guard.check('checkout', user, float(amount), now, now, record=True)
+    if rejected:
+        return jsonify({'error': WRITE_REJECTION_MESSAGES[rejected[0]], 'reasons': rejected}), 400
+    decision = decide_checkout(user, float(amount), bool(consent))
     # Log audit
-    audit_log = load_audit_log()
-    audit_log.append({
+    append_audit_entry({
         'user': user,
         'region': region,
         'product': product,
         'provider': provider,
         'consent': consent,
-        'kyc_required': kyc_required,
-        'credit_check_passed': credit_check_passed,
+        'kyc_required': decision['kyc_required'],
+        **decision_audit_fields(decision),
+        **({'anomalies': anomalies} if anomalies else {}),
         'timestamp': datetime.now().isoformat()
     })
-    save_audit_log(audit_log)
-    return jsonify({'approved': approved, 'credit_check_passed': credit_check_passed, 'kyc_required': kyc_required})
+    return jsonify({'approved': decision['approved'], 'credit_check_passed': decision['credit_check_passed'],
+                    'kyc_required': decision['kyc_required'], 'reasons': decision['reasons'],
+                    'champion_score': decision['champion_score'], 'decision_ms': decision['decision_ms'],
+                    **{k: decision[k] for k in PROVIDER_AUDIT_FIELDS if k in decision}})
+
+@app.route('/api/ingest', methods=['POST'])
+def api_ingest():
+    require_api_key()
+    fmt = request.args.get('format') or ('csv' if 'csv' in (request.content_type or '') else 'jsonl')
+    if fmt not in ('csv', 'jsonl'):
+        return jsonify({'error': 'format must be csv or jsonl'}), 400
+    try:
+        rows = parse_ingest_batch(request.get_data(as_text=True), fmt)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    summary = ingest_batch(rows, dry_run=request.args.get('dry_run') in ('1', 'true'))
+    return jsonify(summary), (400 if 'errors' in summary else 200)
 
 @app.route('/api/virtual-card', methods=['POST'])
 def api_virtual_card():
@@ -668,5 +2854,12 @@ def api_subscription():
     interval = data.get('interval', 'monthly')
     return jsonify({'status': 'created', 'user': user, 'product': product, 'amount': amount, 'interval': interval})
 
+if WAL_ENABLED:
+    start_wal()
+
+if os.environ.get('BNPL_WARMUP') == '1':
+    start_warmup()
+
 if __name__ == '__main__':
+    start_warmup()
     app.run(debug=True) 
\ No newline at end of file
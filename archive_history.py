@@ -0,0 +1,47 @@
+# Cold Archival of Old Ledger History and Audit Log Retention
+# Moves settled purchase and repayment history older than a horizon, and audit
+# entries older than a hot period, out of the data files into compressed
+# monthly partitions under data/archive/, and deletes archived audit months
+# past the retention period. The app keeps serving archived history through
+# ?include_archived=1 and keeps every user's risk scores unchanged.
+#
+# Usage:
+#   python archive_history.py --horizon-days 365 --dry-run
+#   python archive_history.py --horizon-days 365 --audit-hot-days 90 --audit-retain-days 2555
+#
+# Run it from the project root. It rewrites the data files, so run it while
+# the app is stopped, or with BNPL_SHARED_STORE=1 set for both so the writes
+# are serialized with the app's.
+
+import argparse
+import json
+import os
+from datetime import datetime
+
+from app import ARCHIVE_MIN_HORIZON_DAYS, archive_history
+
+def _days(value):
+    days = int(value)
+    if days < 0:
+        raise argparse.ArgumentTypeError('must be a non-negative number of days')
+    return days
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Archive settled ledger history and apply the audit-log retention policy")
+    parser.add_argument('--horizon-days', type=_days, default=int(os.environ.get('BNPL_ARCHIVE_HORIZON_DAYS', 365)),
+                        help=f'Archive settled ledger months older than this (minimum {ARCHIVE_MIN_HORIZON_DAYS})')
+    parser.add_argument('--audit-hot-days', type=_days, default=os.environ.get('BNPL_AUDIT_HOT_DAYS'),
+                        help='Archive audit entries older than this (default: keep all audit entries hot)')
+    parser.add_argument('--audit-retain-days', type=_days, default=os.environ.get('BNPL_AUDIT_RETAIN_DAYS'),
+                        help='Delete archived audit months older than this (default: keep forever)')
+    parser.add_argument('--as-of', type=datetime.fromisoformat, default=None,
+                        help='Reference time for the horizons (ISO format; default: now)')
+    parser.add_argument('--dry-run', action='store_true', help='Report what would be archived without writing')
+    args = parser.parse_args()
+
+    try:
+        summary = archive_history(args.horizon_days, args.audit_hot_days, args.audit_retain_days,
+                                  now=args.as_of, dry_run=args.dry_run)
+    except ValueError as e:
+        parser.error(str(e))
+    print(json.dumps(summary, indent=2))
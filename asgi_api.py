@@ -0,0 +1,261 @@
+# ASGI Read API for the BNPL App
+# Serves the read-heavy JSON endpoints from an asyncio event loop so that many
+# concurrent readers do not each tie up a worker thread:
+#
+#   GET /api/user/<name>          (honors ?as_of=)
+#   GET /api/user/<name>/history  (?kind= ?before= ?limit=)
+#   GET /api/transactions         (X-API-KEY; ?user= ?provider= ?product= ?region= ?since= ?include_archived=)
+#   GET /api/repayments           (X-API-KEY; ?user= ?since= ?include_archived=)
+#   GET /api/audit-log            (?since= ?include_archived=)
+#   GET /api/merchant/analytics
+#   GET /api/products
+#
+# Responses are built by the same functions as the Flask routes and read the
+# same in-memory stores and per-user indexes, so payloads are identical. While
+# a store is current, a request is answered inline on the event loop (a stat
+# plus dictionary lookups). When a data file has changed on disk, the request
+# is moved to a worker thread so the re-ingest never blocks the loop; the
+# per-file store locks make sure the file is still only parsed once. Requests
+# that read archived partitions always run in a worker thread.
+#
+# The polled endpoints answer with the same ETag and Last-Modified as the Flask
+# routes (see CONDITIONAL_ROUTES in app.py), and with 304 when the client's
+# copy is current, without running the handler.
+#
+# Response bodies are encoded as by the Flask app (serialization.py): the
+# listings as MessagePack for clients that prefer it, and large responses
+# compressed for clients that accept gzip or br.
+#
+# Every other path and method (the HTML pages, mutations, CSV exports) is
+# handed to the Flask app when asgiref is installed, and answers 404 otherwise.
+#
+# Usage:
+#   pip install uvicorn asgiref
+#   uvicorn asgi_api:application --port 8000
+#   python asgi_api.py --port 8000
+
+import argparse
+import asyncio
+import time
+from datetime import datetime
+from urllib.parse import parse_qs
+
+import app as bnpl
+import instrumentation
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    WsgiToAsgi = None
+
+LEDGER_READ_FILES = (bnpl.USERS_FILE, bnpl.TRANSACTIONS_FILE, bnpl.REPAYMENTS_FILE, bnpl.INCOME_VERIFICATIONS_FILE,
+                     bnpl.ARCHIVE_MANIFEST_FILE)
+
+class HTTPError(Exception):
+    """An error response with a status code and message."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+def require_api_key(headers):
+    if headers.get('x-api-key') != bnpl.API_KEY:
+        raise HTTPError(401, 'Invalid or missing API key')
+
+def eval_context(args):
+    """Build the evaluation context for a request from its ?as_of= argument."""
+    as_of = args.get('as_of')
+    try:
+        return bnpl.EvalContext(datetime.fromisoformat(as_of) if as_of else None)
+    except ValueError:
+        raise HTTPError(400, 'Invalid as_of timestamp')
+
+def history_args(args):
+    """Parse the ?since= and ?include_archived= arguments of the listing endpoints."""
+    since = args.get('since')
+    try:
+        since = bnpl.to_epoch_us(datetime.fromisoformat(since)) if since else None
+    except ValueError:
+        raise HTTPError(400, 'Invalid since timestamp')
+    return since, reads_archive(args)
+
+def reads_archive(args):
+    return args.get('include_archived') in ('1', 'true')
+
+# --- Handlers ---
+# Each handler is synchronous and returns (status, payload); the dispatcher
+# decides whether it can run on the event loop or needs a worker thread.
+def user_handler(name, args, headers):
+    summary = bnpl.user_summary(name, eval_context(args))
+    if summary is None:
+        return 404, {'error': 'User not found'}
+    return 200, summary
+
+def user_history_handler(name, args, headers):
+    try:
+        page_args = bnpl.parse_history_page_args(args)
+    except ValueError as e:
+        raise HTTPError(400, str(e))
+    page = bnpl.user_history(name, *page_args)
+    if page is None:
+        return 404, {'error': 'User not found'}
+    return 200, page
+
+def transactions_handler(args, headers):
+    require_api_key(headers)
+    return 200, bnpl.transactions_for_output(args.get('user'), args.get('provider'), args.get('product'), args.get('region'),
+                                             *history_args(args))
+
+def repayments_handler(args, headers):
+    require_api_key(headers)
+    return 200, bnpl.repayments_for_output(args.get('user'), *history_args(args))
+
+def audit_log_handler(args, headers):
+    return 200, bnpl.audit_log_for_output(*history_args(args))
+
+def merchant_analytics_handler(args, headers):
+    return 200, bnpl.merchant_analytics()
+
+def products_handler(args, headers):
+    return 200, bnpl.PRODUCTS
+
+# path -> (route label, handler, data files it reads)
+ROUTES = {
+    '/api/transactions': ('/api/transactions', transactions_handler, (bnpl.USERS_FILE, bnpl.TRANSACTIONS_FILE)),
+    '/api/repayments': ('/api/repayments', repayments_handler, (bnpl.USERS_FILE, bnpl.REPAYMENTS_FILE)),
+    '/api/audit-log': ('/api/audit-log', audit_log_handler, (bnpl.AUDIT_LOG_FILE,)),
+    '/api/merchant/analytics': ('/api/merchant/analytics', merchant_analytics_handler,
+                                (bnpl.USERS_FILE, bnpl.TRANSACTIONS_FILE, bnpl.ARCHIVE_MANIFEST_FILE)),
+    '/api/products': ('/api/products', products_handler, ()),
+}
+USER_PREFIX = '/api/user/'
+# Listings that are also served as MessagePack, as with api_response() in app.py
+MSGPACK_ROUTES = {'/api/transactions', '/api/repayments', '/api/audit-log', '/api/user/<name>/history'}
+
+def match_route(path):
+    """Return (route label, handler taking (args, headers), data files) for a read API path, or None."""
+    route = ROUTES.get(path)
+    if route is not None:
+        return route
+    if path.startswith(USER_PREFIX) and len(path) > len(USER_PREFIX):
+        name = path[len(USER_PREFIX):]
+        if '/' not in name:
+            return ('/api/user/<name>', lambda args, headers: user_handler(name, args, headers), LEDGER_READ_FILES)
+        name, _, rest = name.partition('/')
+        if name and rest == 'history':
+            return ('/api/user/<name>/history', lambda args, headers: user_history_handler(name, args, headers),
+                    (bnpl.USERS_FILE, bnpl.TRANSACTIONS_FILE, bnpl.REPAYMENTS_FILE))
+    return None
+
+async def run_handler(handler, files, args, headers):
+    """Run a handler inline if every store it reads is current, otherwise in a worker thread."""
+    try:
+        if not reads_archive(args) and all(bnpl.store_is_current(f) for f in files):
+            return handler(args, headers)
+        return await asyncio.to_thread(handler, args, headers)
+    except HTTPError as e:
+        return e.status, {'error': e.message}
+
+# --- ASGI Plumbing ---
+def encode_json(payload):
+    """Serialize a payload exactly as Flask's jsonify does in production."""
+    return bnpl.serialization.dumps_json(payload)
+
+async def send_json(send, status, payload, extra_headers=None):
+    body = encode_json(payload) if status != 304 else b''
+    headers = [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())] if status != 304 else []
+    headers += [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in (extra_headers or {}).items()]
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def send_payload(send, label, payload, request_headers, validators):
+    """Send a 200 response as the Flask routes would: MessagePack if preferred on the listings, compressed if large."""
+    serialization = bnpl.serialization
+    headers = dict(validators or {})
+    vary = ['Accept-Encoding']
+    if label in MSGPACK_ROUTES:
+        vary.insert(0, 'Accept')
+    if label in MSGPACK_ROUTES and serialization.prefers_msgpack(request_headers.get('accept')):
+        body, mimetype = serialization.dumps_msgpack(payload), serialization.MSGPACK_MIMETYPE
+        if 'ETag' in headers:
+            headers['ETag'] = serialization.etag_variant(headers['ETag'], 'msgpack')
+    else:
+        body, mimetype = encode_json(payload), 'application/json'
+    encoding = serialization.choose_encoding(request_headers.get('accept-encoding'))
+    if encoding is not None and serialization.should_compress(mimetype, len(body)):
+        body = await asyncio.to_thread(serialization.compress, body, encoding)
+        headers['Content-Encoding'] = encoding
+        if 'ETag' in headers:
+            headers['ETag'] = serialization.etag_variant(headers['ETag'], encoding)
+    headers['Vary'] = ', '.join(vary)
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', mimetype.encode()), (b'content-length', str(len(body)).encode())]
+                   + [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers.items()],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+def check_conditional(label, args, headers):
+    """Return (status or None, validator headers) for a conditional route; a status means answer it without running the handler."""
+    if label not in bnpl.CONDITIONAL_ROUTES:
+        return None, None
+    if bnpl.CONDITIONAL_ROUTES[label][2]:
+        require_api_key(headers)
+    etag, last_modified = bnpl.read_validators(label, args)
+    validators = bnpl.validator_headers(etag, last_modified)
+    if bnpl.is_not_modified(headers.get('if-none-match'), headers.get('if-modified-since'), etag, last_modified):
+        return 304, validators
+    return None, validators
+
+async def lifespan(receive, send):
+    """Start the store warmup at server startup."""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            bnpl.start_warmup()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+_flask_asgi = WsgiToAsgi(bnpl.app) if WsgiToAsgi is not None else None
+
+async def application(scope, receive, send):
+    """ASGI entry point: serve the read API natively and delegate everything else to Flask."""
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    route = match_route(scope['path']) if scope['type'] == 'http' and scope['method'] == 'GET' else None
+    if route is None:
+        if _flask_asgi is not None:
+            return await _flask_asgi(scope, receive, send)
+        if scope['type'] == 'http':
+            await send_json(send, 404, {'error': 'Not found'})
+        return
+    label, handler, files = route
+    start = time.perf_counter()
+    query = parse_qs(scope.get('query_string', b'').decode('utf-8', 'replace'))
+    args = {k: v[0] for k, v in query.items()}
+    headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope.get('headers', [])}
+    try:
+        status, validators = check_conditional(label, args, headers)
+    except HTTPError as e:
+        status, validators, payload = e.status, None, {'error': e.message}
+    else:
+        payload = None
+    if status is None:
+        status, payload = await run_handler(handler, files, args, headers)
+    if status == 200:
+        await send_payload(send, label, payload, headers, validators)
+    else:
+        await send_json(send, status, payload, validators if status == 304 else None)
+    instrumentation.end_request(label, status, time.perf_counter() - start)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve the BNPL read API over ASGI with uvicorn")
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to bind')
+    parser.add_argument('--port', type=int, default=8000, help='Port to listen on')
+    args = parser.parse_args()
+    import uvicorn
+    uvicorn.run(application, host=args.host, port=args.port)
@@ -0,0 +1,62 @@
+# Data File Format Benchmark
+# Compares a transactions file stored as plain JSON with the compressed block
+# format of blockfile.py: size on disk, time to load the whole file, and time
+# to read one user's records (a full JSON parse and filter, versus decoding
+# only the blocks the block index lists for that user).
+#
+# Usage: python benchmarks/data_format.py [--records 200000] [--users 5000]
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import blockfile  # noqa: E402
+from app import format_timestamp  # noqa: E402
+
+START_US = 1_685_000_000_000_000  # 2023-05-25
+
+def make_rows(n_records, n_users):
+    """Generate stored-format transaction rows, oldest first, keyed by user id."""
+    rng = random.Random(42)
+    stamps = sorted(START_US + rng.randrange(0, 400 * 86_400_000_000) for _ in range(n_records))
+    return [{'user_id': rng.randrange(n_users), 'amount': round(rng.uniform(5, 900), 2), 'timestamp': format_timestamp(ts)}
+            for ts in stamps]
+
+def best_of(fn, repeat=5):
+    """Return the fastest of several timed runs, in milliseconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+def json_user_rows(path, user_id):
+    return [r for r in blockfile.load(path) if r.get('user_id') == user_id]
+
+parser = argparse.ArgumentParser(description="Size and decode time of the JSON and block data formats")
+parser.add_argument('--records', type=int, default=200_000, help='Number of transactions to write')
+parser.add_argument('--users', type=int, default=5_000, help='Number of distinct users')
+args = parser.parse_args()
+
+rows = make_rows(args.records, args.users)
+work = tempfile.mkdtemp()
+json_path = os.path.join(work, 'transactions.json')
+block_path = os.path.join(work, 'transactions.blk')
+with open(json_path, 'wb') as f:
+    f.write(json.dumps(rows).encode('utf-8'))
+with open(block_path, 'wb') as f:
+    f.write(blockfile.encode(rows))
+assert blockfile.load(block_path) == rows
+
+user_id = rows[len(rows) // 2]['user_id']
+print(f"{args.records} transactions across {args.users} users")
+print(f"  {'format':<8}{'bytes':>14}{'full load ms':>15}{'one user ms':>14}")
+for label, path, one_user in [('json', json_path, json_user_rows), ('block', block_path, blockfile.read_user_rows)]:
+    print(f"  {label:<8}{os.path.getsize(path):>14,}{best_of(lambda: blockfile.load(path)):>15.1f}"
+          f"{best_of(lambda: one_user(path, user_id)):>14.1f}")
@@ -0,0 +1,76 @@
+# Provider Call Latency Benchmark
+# Starts provider_stub.py in-process with a long-tailed latency distribution
+# and measures the time a checkout spends on its credit and KYC checks:
+#
+#   sequential  one check after the other, a new connection per call, no hedging
+#   fan-out     both checks at once over pooled connections
+#   hedged      fan-out, plus a second attempt when one is slower than --hedge-ms
+#
+# Usage: python benchmarks/provider_latency.py [--checkouts 400] [--slow-rate 0.05] [--slow-ms 300]
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import provider_stub  # noqa: E402
+import providers  # noqa: E402
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+def sequential(url, payload, timeout):
+    for path in providers.CHECKS.values():
+        requests.post(url + path, json=payload, timeout=timeout).raise_for_status()
+
+def fan_out(client, payload):
+    for future in client.check_all({'credit': payload, 'kyc': payload}).values():
+        future.result()
+
+def measure(run, checkouts):
+    """Run checkouts one at a time; return sorted latencies in ms and the failure count."""
+    latencies, failures = [], 0
+    for i in range(checkouts):
+        start = time.perf_counter()
+        try:
+            run({'user': f'User{i}', 'amount': 200})
+        except (requests.RequestException, providers.ProviderError):
+            failures += 1
+        latencies.append((time.perf_counter() - start) * 1000)
+    return sorted(latencies), failures
+
+parser = argparse.ArgumentParser(description="Checkout time spent on provider checks: sequential, fan-out and hedged")
+parser.add_argument('--checkouts', type=int, default=400)
+parser.add_argument('--latency-ms', type=float, default=20, help='Median provider response time')
+parser.add_argument('--slow-rate', type=float, default=0.05, help='Share of provider calls that are slow')
+parser.add_argument('--slow-ms', type=float, default=300, help='Response time of slow calls')
+parser.add_argument('--error-rate', type=float, default=0.0, help='Share of provider calls that fail')
+parser.add_argument('--hedge-ms', type=float, default=60, help='Hedge delay of the hedged client')
+parser.add_argument('--timeout-ms', type=float, default=1000, help='Per-call deadline')
+args = parser.parse_args()
+
+stub_config = provider_stub.parse_args(['--latency-ms', str(args.latency_ms), '--slow-rate', str(args.slow_rate),
+                                        '--slow-ms', str(args.slow_ms), '--error-rate', str(args.error_rate), '--seed', '7'])
+server = provider_stub.make_server(0, stub_config)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+url = f"http://127.0.0.1:{server.server_address[1]}"
+
+# Hedging is effectively off when the hedge delay is past the deadline
+plain = providers.ProviderClient(url, timeout_ms=args.timeout_ms, hedge_ms=args.timeout_ms, retries=0)
+hedged = providers.ProviderClient(url, timeout_ms=args.timeout_ms, hedge_ms=args.hedge_ms, retries=1)
+runs = [
+    ('sequential', lambda payload: sequential(url, payload, args.timeout_ms / 1000)),
+    ('fan-out', lambda payload: fan_out(plain, payload)),
+    ('hedged', lambda payload: fan_out(hedged, payload)),
+]
+print(f"{args.checkouts} checkouts; provider median {args.latency_ms} ms, {args.slow_rate:.0%} of calls take {args.slow_ms} ms")
+print(f"  {'client':<12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'failed':>8}")
+for label, run in runs:
+    latencies, failures = measure(run, args.checkouts)
+    print(f"  {label:<12}{percentile(latencies, 50):>10.1f}{percentile(latencies, 95):>10.1f}"
+          f"{percentile(latencies, 99):>10.1f}{failures:>8}")
+server.shutdown()
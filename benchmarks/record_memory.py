@@ -0,0 +1,83 @@
+# In-memory Record Size Benchmark
+# Measures the bytes held per transaction record for the representations the
+# app has used: rows as loaded from JSON (ISO string timestamps), dict rows
+# with epoch-microsecond timestamps, the compact __slots__ records keyed
+# by integer user id (the user registry is counted with them), and a worker's
+# view of the shared memory-mapped snapshot, whose pages live in the page
+# cache shared by every worker rather than in the worker's own heap.
+#
+# Usage: python benchmarks/record_memory.py [--records 200000] [--users 5000]
+
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from app import Transaction, UserRegistry, format_timestamp, parse_timestamp  # noqa: E402
+from shared_store import LedgerView, Snapshot, write_snapshot  # noqa: E402
+
+START_US = 1_685_000_000_000_000  # 2023-05-25
+
+def make_rows(n_records, n_users):
+    """Generate stored-format transaction rows, as json.load would return them."""
+    rng = random.Random(42)
+    rows = [
+        {'user': f"User{rng.randrange(n_users)}", 'amount': round(rng.uniform(5, 900), 2),
+         'timestamp': format_timestamp(START_US + rng.randrange(0, 400 * 86_400_000_000))}
+        for _ in range(n_records)
+    ]
+    # Round-trip through JSON so strings are not shared the way a generator would share them
+    return json.dumps(rows)
+
+def measure(build, payload):
+    """Return the bytes still allocated after building records from the JSON payload."""
+    gc.collect()
+    tracemalloc.start()
+    records = build(payload)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    return current
+
+def as_iso_dicts(payload):
+    return json.loads(payload)
+
+def as_epoch_dicts(payload):
+    rows = json.loads(payload)
+    for r in rows:
+        r['timestamp'] = parse_timestamp(r['timestamp'])
+    return rows
+
+def as_slots_records(payload):
+    registry = UserRegistry([], 0)
+    return registry, [Transaction.from_dict(r, registry) for r in json.loads(payload)]
+
+def as_shared_view(payload):
+    rows = [(r['user'], r['amount'], parse_timestamp(r['timestamp'])) for r in json.loads(payload)]
+    path = os.path.join(tempfile.mkdtemp(), 'transactions.snap')
+    write_snapshot(path, rows)
+    del rows
+    # Only what a worker allocates to map the snapshot is measured
+    gc.collect()
+    tracemalloc.clear_traces()
+    registry = UserRegistry([], 0)
+    return registry, LedgerView(Snapshot(path), [], Transaction, registry.id_for)
+
+parser = argparse.ArgumentParser(description="Bytes per in-memory transaction record")
+parser.add_argument('--records', type=int, default=200_000, help='Number of transactions to build')
+parser.add_argument('--users', type=int, default=5_000, help='Number of distinct user names')
+args = parser.parse_args()
+
+payload = make_rows(args.records, args.users)
+print(f"{args.records} transactions across {args.users} users")
+baseline = None
+for label, build in [('dict, ISO timestamp', as_iso_dicts), ('dict, epoch timestamp', as_epoch_dicts), ('Transaction (__slots__)', as_slots_records),
+                     ('shared snapshot view', as_shared_view)]:
+    per_record = measure(build, payload) / args.records
+    baseline = baseline or per_record
+    print(f"  {label:<26} {per_record:8.1f} bytes/record  ({per_record / baseline:5.1%} of baseline)")
@@ -0,0 +1,60 @@
+# API Response Serialization Benchmark
+# Encodes a transactions listing the way /api/transactions returns it and
+# compares Flask's stdlib JSON encoder with the encoders of serialization.py
+# (orjson, MessagePack), plus the size and time of gzip and brotli on top.
+# Encoders and codecs that are not installed are skipped.
+#
+# Usage: python benchmarks/serialization.py [--records 100000]
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import serialization  # noqa: E402
+from app import from_epoch_us  # noqa: E402
+
+START_US = 1_685_000_000_000_000  # 2023-05-25
+
+def make_payload(n_records):
+    """Generate a transactions listing as record_for_output returns it."""
+    rng = random.Random(42)
+    return [{'user': f'User{rng.randrange(5000)}', 'amount': round(rng.uniform(5, 900), 2),
+             'timestamp': from_epoch_us(START_US + rng.randrange(0, 400 * 86_400_000_000))} for _ in range(n_records)]
+
+def best_of(fn, repeat=3):
+    """Return the fastest of several timed runs in milliseconds, and the last result."""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+parser = argparse.ArgumentParser(description="Time and size of API response encodings")
+parser.add_argument('--records', type=int, default=100_000)
+args = parser.parse_args()
+
+payload = make_payload(args.records)
+encoders = [('stdlib json', lambda: (json.dumps(payload, default=serialization._default, sort_keys=True,
+                                                separators=(',', ':')) + '\n').encode('ascii'))]
+if serialization.orjson is not None:
+    encoders.append(('orjson', lambda: serialization.orjson.dumps(payload, default=serialization._default,
+                                                                 option=serialization._ORJSON_OPTIONS)))
+if serialization.msgpack is not None:
+    encoders.append(('msgpack', lambda: serialization.dumps_msgpack(payload)))
+
+print(f"{args.records} transactions; backend in use: {serialization.JSON_BACKEND}")
+print(f"  {'encoding':<22}{'ms':>10}{'bytes':>14}")
+bodies = {}
+for label, encode in encoders:
+    ms, body = best_of(encode)
+    bodies[label] = body
+    print(f"  {label:<22}{ms:>10.1f}{len(body):>14,}")
+for label, body in bodies.items():
+    for encoding in serialization.ENCODINGS:
+        ms, compressed = best_of(lambda: serialization.compress(body, encoding))
+        print(f"  {label + ' + ' + encoding:<22}{ms:>10.1f}{len(compressed):>14,}")
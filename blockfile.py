@@ -0,0 +1,275 @@
+# Compressed Block Format for the BNPL Data Files
+# An optional compact alternative to the plain JSON data files. A file holds
+# a list of records split into blocks of BLOCK_ROWS rows. Each block stores
+# its rows column by column (so repeated keys are written once per block) and
+# is compressed on its own with zlib, or zstd when the zstandard package is
+# installed and selected. An index at the end of the file records where each
+# block starts and which blocks hold each user's rows, so one user's records
+# can be read by decompressing only those blocks.
+#
+#   header  magic, version, codec, row count, index offset and length
+#   blocks  compressed JSON: key shapes, the shape of each row, one array per column
+#   index   compressed JSON: block offsets and sizes, user key -> block numbers,
+#           and an optional 'meta' value (e.g. a report summary)
+#
+# load() reads either format, so callers need not know which one a file uses.
+# BlockWriter streams records into a file one block at a time; iter_rows() and
+# read_blocks() read them back a block at a time.
+#
+# Usage:
+#   python blockfile.py --to block data/transactions.json data/repayments.json
+#   python blockfile.py --to json data/*.json
+#   python blockfile.py --info data/transactions.json
+
+import argparse
+import io
+import json
+import os
+import struct
+import tempfile
+import zlib
+from itertools import repeat
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b'BNPLBLK1'
+VERSION = 1
+HEADER = struct.Struct('<8sHBxIQQ')  # magic, version, codec, rows, index offset, index length
+BLOCK_ROWS = 1024
+# Fields that identify a record's user, in order of preference
+USER_FIELDS = ('user_id', 'user', 'name')
+
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+CODEC_NAMES = {'zlib': CODEC_ZLIB, 'zstd': CODEC_ZSTD}
+
+def _compress(codec, data):
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return zlib.compress(data, 6)
+
+def _decompress(codec, data):
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError('This data file is zstd-compressed; install the zstandard package to read it')
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+def default_codec():
+    """Return the codec named by BNPL_DATA_CODEC (zlib unless zstd is requested and available)."""
+    name = os.environ.get('BNPL_DATA_CODEC', 'zlib')
+    if name == 'zstd' and zstandard is None:
+        return CODEC_ZLIB
+    return CODEC_NAMES.get(name, CODEC_ZLIB)
+
+def user_key(row):
+    """Return the index key of a record's user, or None if it has no user field."""
+    for field in USER_FIELDS:
+        if field in row:
+            return _key_of(row[field])
+    return None
+
+def _key_of(value):
+    return f"i:{value}" if isinstance(value, int) else f"s:{value}"
+
+def is_block_data(data):
+    """Return True if raw file contents are in the block format."""
+    return data[:len(MAGIC)] == MAGIC
+
+# --- Encoding ---
+def _encode_block(rows, default):
+    shapes = []
+    shape_ids = {}
+    row_shapes = []
+    columns = {}
+    for row in rows:
+        keys = tuple(row)
+        shape = shape_ids.get(keys)
+        if shape is None:
+            shape = shape_ids[keys] = len(shapes)
+            shapes.append(keys)
+        row_shapes.append(shape)
+        for key, value in row.items():
+            columns.setdefault(key, []).append(value)
+    block = {'shapes': shapes, 'row_shapes': row_shapes, 'columns': columns}
+    return json.dumps(block, default=default, separators=(',', ':')).encode('utf-8')
+
+class BlockWriter:
+    """Writes records to an open binary file in the block format as they arrive, holding at most one block in memory.
+
+    With index_users=False no per-user postings are kept, so memory stays
+    bounded by the block size however many users are written. close() can
+    store a small JSON-serializable 'meta' value in the index.
+    """
+
+    def __init__(self, f, codec=None, block_rows=BLOCK_ROWS, default=None, index_users=True):
+        self.f = f
+        self.codec = codec or default_codec()
+        self.block_rows = block_rows
+        self.default = default
+        self.index_users = index_users
+        self.start = f.tell()
+        self.pending = []
+        self.blocks = []
+        self.postings = {}
+        self.rows = 0
+        f.write(bytes(HEADER.size))
+
+    def write(self, row):
+        self.pending.append(row)
+        if len(self.pending) >= self.block_rows:
+            self._flush()
+
+    def _flush(self):
+        if not self.pending:
+            return
+        payload = _compress(self.codec, _encode_block(self.pending, self.default))
+        number = len(self.blocks)
+        self.blocks.append([self.f.tell() - self.start, len(payload), len(self.pending)])
+        self.f.write(payload)
+        if self.index_users:
+            for key in {user_key(row) for row in self.pending}:
+                if key is not None:
+                    self.postings.setdefault(key, []).append(number)
+        self.rows += len(self.pending)
+        self.pending = []
+
+    def close(self, meta=None):
+        """Write the last block, the index and the header; the file itself is left open."""
+        self._flush()
+        index = {'blocks': self.blocks, 'postings': self.postings}
+        if meta is not None:
+            index['meta'] = meta
+        payload = _compress(self.codec, json.dumps(index, default=self.default, separators=(',', ':')).encode('utf-8'))
+        index_offset = self.f.tell() - self.start
+        self.f.write(payload)
+        end = self.f.tell()
+        self.f.seek(self.start)
+        self.f.write(HEADER.pack(MAGIC, VERSION, self.codec, self.rows, index_offset, len(payload)))
+        self.f.seek(end)
+
+def encode(rows, codec=None, block_rows=BLOCK_ROWS, default=None):
+    """Encode a list of records in the block format and return the file contents."""
+    out = io.BytesIO()
+    writer = BlockWriter(out, codec, block_rows, default)
+    for row in rows:
+        writer.write(row)
+    writer.close()
+    return out.getvalue()
+
+# --- Decoding ---
+def _decode_block(codec, payload, wanted=None):
+    """Decode one block into its records, or only the records of user key wanted."""
+    block = json.loads(_decompress(codec, payload))
+    shapes, row_shapes, columns = block['shapes'], block['row_shapes'], block['columns']
+    if len(shapes) == 1 and shapes[0]:
+        keys = shapes[0]
+        values = zip(*(columns[k] for k in keys))
+        field = next((f for f in USER_FIELDS if f in keys), None)
+        if wanted is not None and field is not None:
+            # Build only the matching rows: the user column is scanned, the others are only indexed
+            values = [tuple(columns[k][i] for k in keys) for i, v in enumerate(columns[field]) if _key_of(v) == wanted]
+        return list(map(dict, map(zip, repeat(keys), values)))
+    iterators = {key: iter(values) for key, values in columns.items()}
+    rows = [{key: next(iterators[key]) for key in shapes[shape]} for shape in row_shapes]
+    return rows if wanted is None else [row for row in rows if user_key(row) == wanted]
+
+def _header(data):
+    magic, version, codec, rows, index_offset, index_length = HEADER.unpack_from(data, 0)
+    if version != VERSION:
+        raise ValueError(f"Unsupported block format version {version}")
+    return codec, rows, index_offset, index_length
+
+def decode(data):
+    """Decode block-format file contents into the list of records."""
+    codec, _, index_offset, index_length = _header(data)
+    index = json.loads(_decompress(codec, data[index_offset:index_offset + index_length]))
+    rows = []
+    for offset, length, _ in index['blocks']:
+        rows.extend(_decode_block(codec, data[offset:offset + length]))
+    return rows
+
+def read_index(path):
+    """Return (codec, row count, index) of a block-format file without reading its blocks."""
+    with open(path, 'rb') as f:
+        codec, rows, index_offset, index_length = _header(f.read(HEADER.size))
+        f.seek(index_offset)
+        return codec, rows, json.loads(_decompress(codec, f.read(index_length)))
+
+def read_user_rows(path, key):
+    """Return the records of one user (a user id or name) from a block-format file, decoding only the blocks that hold them."""
+    wanted = _key_of(key)
+    codec, _, index = read_index(path)
+    rows = []
+    with open(path, 'rb') as f:
+        for number in index['postings'].get(wanted, []):
+            offset, length, _ = index['blocks'][number]
+            f.seek(offset)
+            rows.extend(_decode_block(codec, f.read(length), wanted))
+    return rows
+
+def read_blocks(path, numbers):
+    """Return the records of the given block numbers of a block-format file, in that order."""
+    codec, _, index = read_index(path)
+    rows = []
+    with open(path, 'rb') as f:
+        for number in numbers:
+            offset, length, _ = index['blocks'][number]
+            f.seek(offset)
+            rows.extend(_decode_block(codec, f.read(length)))
+    return rows
+
+def iter_rows(path):
+    """Yield the records of a block-format file one block at a time."""
+    codec, _, index = read_index(path)
+    with open(path, 'rb') as f:
+        for offset, length, _ in index['blocks']:
+            f.seek(offset)
+            yield from _decode_block(codec, f.read(length))
+
+def load(path):
+    """Load a data file in either the plain JSON or the block format."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    return decode(data) if is_block_data(data) else json.loads(data)
+
+def convert(path, to):
+    """Rewrite a data file in place in the 'json' or 'block' format."""
+    rows = load(path)
+    if to == 'block' and not isinstance(rows, list):
+        raise ValueError(f"{path} does not hold a list of records")
+    data = encode(rows) if to == 'block' else json.dumps(rows).encode('utf-8')
+    mode = os.stat(path).st_mode & 0o7777
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.tmp-')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+        os.fchmod(f.fileno(), mode)  # mkstemp files are owner-only; keep the converted file's mode
+    os.replace(tmp_path, path)
+    return len(rows), len(data)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert BNPL data files between JSON and the compressed block format")
+    parser.add_argument('files', nargs='+', help='Data files to convert or inspect')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--to', choices=('json', 'block'), help='Target format')
+    group.add_argument('--info', action='store_true', help='Print the format, codec, rows and blocks of each file')
+    args = parser.parse_args()
+
+    for path in args.files:
+        if args.info:
+            with open(path, 'rb') as f:
+                block = is_block_data(f.read(len(MAGIC)))
+            if block:
+                codec, rows, index = read_index(path)
+                codec_name = {v: k for k, v in CODEC_NAMES.items()}[codec]
+                print(f"{path}: block format, {codec_name}, {rows} rows in {len(index['blocks'])} blocks, {len(index['postings'])} users"
+                      + (f", meta {json.dumps(index['meta'])}" if 'meta' in index else ''))
+            else:
+                print(f"{path}: JSON, {len(load(path))} rows")
+        else:
+            before = os.path.getsize(path)
+            rows, after = convert(path, args.to)
+            print(f"{path}: {rows} rows, {before} -> {after} bytes")
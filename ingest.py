@@ -0,0 +1,62 @@
+# Bulk Import of Purchases and Repayments
+# Imports partner settlement files (JSON Lines or CSV with type, user, amount
+# and timestamp columns) as single batches. Rows already in the ledger are
+# skipped, so a file can be imported again safely, and a file with any invalid
+# row is rejected as a whole with the list of errors.
+#
+# Usage:
+#   python ingest.py settlements.jsonl --dry-run
+#   python ingest.py settlements.csv
+#   python ingest.py --url http://localhost:5000 settlements.csv
+#
+# Without --url it writes the data files directly, so run it from the project
+# root while the app is stopped, or with BNPL_SHARED_STORE=1 set for both.
+# With --url the batch is posted to POST /api/ingest of a running app.
+
+import argparse
+import json
+import sys
+
+API_KEY = 'demo-api-key-123'
+
+def file_format(path, fmt):
+    return fmt or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+
+def ingest_file(path, fmt, dry_run):
+    """Import one file directly into the data files and return the summary."""
+    from app import ingest_batch, parse_ingest_batch
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        rows = parse_ingest_batch(f.read(), fmt)
+    return ingest_batch(rows, dry_run=dry_run)
+
+def post_file(url, path, fmt, dry_run):
+    """Post one file to a running app's /api/ingest and return the summary."""
+    import requests
+    with open(path, 'rb') as f:
+        body = f.read()
+    r = requests.post(f"{url.rstrip('/')}/api/ingest", data=body,
+                      params={'format': fmt, 'dry_run': '1' if dry_run else '0'},
+                      headers={'X-API-KEY': API_KEY, 'Content-Type': 'text/csv' if fmt == 'csv' else 'application/x-ndjson'})
+    try:
+        return r.json()
+    except ValueError:
+        return {'error': f"HTTP {r.status_code}: {r.text[:200]}"}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import purchases and repayments from JSON Lines or CSV batches")
+    parser.add_argument('files', nargs='+', help='Batch files to import')
+    parser.add_argument('--format', choices=('jsonl', 'csv'), default=None, help='Batch format (default: from the file extension)')
+    parser.add_argument('--url', default=None, help='Post to a running app instead of writing the data files')
+    parser.add_argument('--dry-run', action='store_true', help='Validate and count duplicates without importing')
+    args = parser.parse_args()
+
+    failed = False
+    for path in args.files:
+        fmt = file_format(path, args.format)
+        try:
+            summary = post_file(args.url, path, fmt, args.dry_run) if args.url else ingest_file(path, fmt, args.dry_run)
+        except ValueError as e:
+            summary = {'error': str(e)}
+        failed = failed or 'error' in summary or 'errors' in summary
+        print(f"{path}: {json.dumps(summary, indent=2)}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,196 @@
+# Request-level Instrumentation for the BNPL Flask App
+# Collects per-route latency histograms, data-file I/O counts and bytes,
+# time spent in the hot business-logic helpers, and cache hit/miss counts,
+# and renders them in the Prometheus text exposition format.
+#
+# Everything is in-process and guarded by one lock. Set BNPL_METRICS=0 to turn
+# collection off; the decorators and recorders then return immediately.
+
+import os
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+
+ENABLED = os.environ.get('BNPL_METRICS', '1') != '0'
+
+# Latency buckets in seconds, matching the Prometheus client defaults
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Per-request I/O buckets: number of calls and bytes
+CALL_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)
+BYTE_BUCKETS = (0, 1024, 16384, 131072, 1048576, 8388608, 67108864)
+# Checkout decisions take microseconds, so their buckets start at 50 µs
+DECISION_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+_lock = threading.Lock()
+_local = threading.local()
+
+class Histogram:
+    """A cumulative-bucket histogram in the Prometheus style."""
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+# name -> {labels tuple: value}
+_counters = defaultdict(lambda: defaultdict(float))
+# name -> {labels tuple: Histogram}
+_histograms = defaultdict(dict)
+_help = {}
+
+def _labels(**labels):
+    return tuple(sorted(labels.items()))
+
+def describe(name, kind, text):
+    """Register the HELP text and TYPE of a metric."""
+    _help[name] = (kind, text)
+
+def inc(name, amount=1, **labels):
+    """Increment a counter."""
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name][_labels(**labels)] += amount
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    """Record one observation in a histogram."""
+    if not ENABLED:
+        return
+    key = _labels(**labels)
+    with _lock:
+        hist = _histograms[name].get(key)
+        if hist is None:
+            hist = _histograms[name][key] = Histogram(buckets)
+        hist.observe(value)
+
+# --- Per-request tallies ---
+def begin_request():
+    """Start per-request I/O tallies for the current thread."""
+    _local.io = defaultdict(int)
+
+def end_request(route, status, elapsed):
+    """Record the latency and I/O tallies of the request that just finished on this thread."""
+    io = getattr(_local, 'io', None)
+    _local.io = None
+    if not ENABLED:
+        return
+    observe('bnpl_request_duration_seconds', elapsed, route=route)
+    inc('bnpl_requests_total', route=route, status=str(status))
+    if io is not None:
+        for op in ('load_json', 'save_json'):
+            observe('bnpl_request_io_calls', io[op + '_calls'], buckets=CALL_BUCKETS, route=route, op=op)
+            observe('bnpl_request_io_bytes', io[op + '_bytes'], buckets=BYTE_BUCKETS, route=route, op=op)
+
+def record_io(op, nbytes, filename):
+    """Count one load_json/save_json call and the bytes it read or wrote."""
+    if not ENABLED:
+        return
+    inc('bnpl_io_calls_total', op=op, file=os.path.basename(filename))
+    inc('bnpl_io_bytes_total', nbytes, op=op, file=os.path.basename(filename))
+    io = getattr(_local, 'io', None)
+    if io is not None:
+        io[op + '_calls'] += 1
+        io[op + '_bytes'] += nbytes
+
+def record_cache(cache, hit):
+    """Count a cache lookup as a hit or a miss."""
+    if not ENABLED:
+        return
+    inc('bnpl_cache_lookups_total', cache=cache, result='hit' if hit else 'miss')
+
+def timed(helper):
+    """Decorator recording the wall time of a helper function in bnpl_helper_duration_seconds."""
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe('bnpl_helper_duration_seconds', time.perf_counter() - start, helper=helper)
+        return wrapper
+    return decorate
+
+# --- Exposition ---
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    body = ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs)
+    return '{' + body + '}'
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+def render_prometheus():
+    """Render all metrics in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    with _lock:
+        for name in sorted(_counters):
+            kind, text = _help.get(name, ('counter', name))
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(_counters[name].items()):
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for name in sorted(_histograms):
+            kind, text = _help.get(name, ('histogram', name))
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, hist in sorted(_histograms[name].items()):
+                cumulative = 0
+                for upper, count in zip(hist.buckets, hist.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', _format_value(float(upper)))])} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {hist.count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(hist.sum)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {hist.count}")
+        lookups = _counters.get('bnpl_cache_lookups_total', {})
+        caches = sorted({dict(labels)['cache'] for labels in lookups})
+        if caches:
+            lines.append("# HELP bnpl_cache_hit_ratio Fraction of cache lookups served from the cache")
+            lines.append("# TYPE bnpl_cache_hit_ratio gauge")
+            for cache in caches:
+                hits = lookups.get(_labels(cache=cache, result='hit'), 0)
+                misses = lookups.get(_labels(cache=cache, result='miss'), 0)
+                ratio = hits / (hits + misses) if hits + misses else 0.0
+                lines.append(f'bnpl_cache_hit_ratio{{cache="{cache}"}} {ratio:.6f}')
+    return '\n'.join(lines) + '\n'
+
+def reset():
+    """Clear all collected metrics."""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+describe('bnpl_requests_total', 'counter', 'Requests handled, by route and status code')
+describe('bnpl_request_duration_seconds', 'histogram', 'Request latency in seconds, by route')
+describe('bnpl_request_io_calls', 'histogram', 'load_json/save_json calls per request, by route')
+describe('bnpl_request_io_bytes', 'histogram', 'Bytes read or written by load_json/save_json per request, by route')
+describe('bnpl_io_calls_total', 'counter', 'load_json/save_json calls, by data file')
+describe('bnpl_io_bytes_total', 'counter', 'Bytes read or written by load_json/save_json, by data file')
+describe('bnpl_helper_duration_seconds', 'histogram', 'Time spent in business-logic helpers, by helper')
+describe('bnpl_cache_lookups_total', 'counter', 'Cache lookups, by cache and hit/miss')
+describe('bnpl_checkout_decision_seconds', 'histogram', 'Checkout decision latency in seconds, by outcome')
+describe('bnpl_checkout_decisions_over_budget_total', 'counter', 'Checkout decisions slower than BNPL_DECISION_BUDGET_MS')
+describe('bnpl_provider_calls_total', 'counter', 'Credit bureau and KYC provider calls, by provider and outcome')
+describe('bnpl_provider_call_seconds', 'histogram', 'Provider call latency in seconds, including hedges and retries, by provider')
+describe('bnpl_provider_hedges_total', 'counter', 'Hedged second attempts sent to a slow provider, by provider')
+describe('bnpl_provider_breaker_opened_total', 'counter', 'Times a provider circuit breaker opened, by provider')
+describe('bnpl_write_rejections_total', 'counter', 'Purchases, repayments and checkouts rejected by the write guard, by kind and reason')
+describe('bnpl_write_anomalies_total', 'counter', 'Writes accepted but flagged by the write guard, by kind and anomaly')
+describe('bnpl_response_compress_seconds', 'histogram', 'Time spent compressing API responses, by encoding')
+describe('bnpl_response_bytes_saved_total', 'counter', 'Response bytes saved by compression, by encoding')
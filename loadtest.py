@@ -0,0 +1,301 @@
+# Load Test Harness for the BNPL Flask API
+# Drives a weighted mix of purchases, repayments, API checkouts, user lookups,
+# dashboard renders and CSV exports against a running app at a target rate,
+# from many concurrent clients with keep-alive sessions. Reports throughput,
+# error rate and latency percentiles per operation, then verifies that no
+# appended purchase, repayment or audit entry was lost and that the ledger
+# totals moved by exactly the amounts that were accepted.
+#
+# Usage:
+#   python app.py &
+#   python loadtest.py --qps 50 --duration 30 --clients 16
+#   python loadtest.py --mix purchase=5,repay=3,user=10,dashboard=1 --max-p99-ms 500 --min-qps 40
+#
+# Checkout responses carry the server-side decision time, reported separately
+# as decision latency. Exits with status 1 when a --min-qps/--max-error-rate/
+# --max-p99-ms/--max-decision-p99-ms gate or the integrity check fails, so it
+# can gate a release.
+
+import argparse
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+API_KEY = 'demo-api-key-123'
+HEADERS = {'X-API-KEY': API_KEY}
+
+DEFAULT_MIX = 'purchase=20,repay=10,checkout=10,user=40,dashboard=5,transactions_csv=5,repayments_csv=5,audit_csv=5'
+
+# --- Shared run state ---
+class RunState:
+    """Latencies, errors and ledger deltas accumulated by all client threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.purchases = 0
+        self.purchase_total = 0.0
+        self.repayments = 0
+        self.repayment_total = 0.0
+        self.audit_entries = 0
+        self.decision_ms = []
+
+    def record(self, op, elapsed, ok):
+        with self.lock:
+            self.latencies[op].append(elapsed)
+            if not ok:
+                self.errors[op] += 1
+
+# --- Operations ---
+# Each operation issues one request and returns True on success. Mutations
+# record what they appended only once the server has acknowledged them.
+def op_purchase(session, base, users, rng, state):
+    user = rng.choice(users)
+    amount = round(rng.uniform(1, 50), 2)
+    r = session.post(f'{base}/purchase', data={'user': user, 'amount': amount}, allow_redirects=False)
+    ok = r.status_code == 302
+    if ok:
+        with state.lock:
+            state.purchases += 1
+            state.purchase_total += amount
+    return ok
+
+def op_repay(session, base, users, rng, state):
+    user = rng.choice(users)
+    amount = round(rng.uniform(1, 20), 2)
+    r = session.post(f'{base}/repay', data={'user': user, 'amount': amount}, allow_redirects=False)
+    ok = r.status_code == 302
+    if ok:
+        with state.lock:
+            state.repayments += 1
+            state.repayment_total += amount
+    return ok
+
+def op_checkout(session, base, users, rng, state):
+    payload = {'user': rng.choice(users), 'product': 'Wireless Headphones', 'provider': 'Klarna',
+               'region': 'US', 'consent': True, 'amount': rng.choice([60, 100, 180])}
+    r = session.post(f'{base}/api/checkout', json=payload, headers=HEADERS)
+    ok = r.status_code == 200
+    if ok:
+        with state.lock:
+            state.audit_entries += 1
+            state.decision_ms.append(r.json().get('decision_ms', 0.0))
+    return ok
+
+def op_user(session, base, users, rng, state):
+    return session.get(f'{base}/api/user/{rng.choice(users)}').status_code == 200
+
+def op_dashboard(session, base, users, rng, state):
+    return session.get(f'{base}/dashboard').status_code == 200
+
+def op_transactions_csv(session, base, users, rng, state):
+    return session.get(f'{base}/api/transactions.csv', headers=HEADERS).status_code == 200
+
+def op_repayments_csv(session, base, users, rng, state):
+    return session.get(f'{base}/api/repayments.csv', headers=HEADERS).status_code == 200
+
+def op_audit_csv(session, base, users, rng, state):
+    return session.get(f'{base}/api/audit-log.csv', headers=HEADERS).status_code == 200
+
+OPERATIONS = {
+    'purchase': op_purchase,
+    'repay': op_repay,
+    'checkout': op_checkout,
+    'user': op_user,
+    'dashboard': op_dashboard,
+    'transactions_csv': op_transactions_csv,
+    'repayments_csv': op_repayments_csv,
+    'audit_csv': op_audit_csv,
+}
+
+def parse_mix(text):
+    """Parse 'op=weight,...' into a list of (operation, weight)."""
+    mix = []
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation '{name}'; choose from {', '.join(OPERATIONS)}")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+# --- Ledger snapshot for the integrity check ---
+def ledger_snapshot(base):
+    """Return counts and totals of transactions, repayments and audit entries."""
+    txs = requests.get(f'{base}/api/transactions', headers=HEADERS).json()
+    rps = requests.get(f'{base}/api/repayments', headers=HEADERS).json()
+    audit = requests.get(f'{base}/api/audit-log', headers=HEADERS).json()
+    return {
+        'transactions': len(txs),
+        'transaction_total': sum(t['amount'] for t in txs),
+        'repayments': len(rps),
+        'repayment_total': sum(r['amount'] for r in rps),
+        'audit_entries': len(audit),
+    }
+
+def check_integrity(before, after, state):
+    """Compare ledger deltas with what the server acknowledged; return a list of failures."""
+    failures = []
+    expected = {
+        'transactions': state.purchases,
+        'repayments': state.repayments,
+        'audit_entries': state.audit_entries,
+    }
+    for key, count in expected.items():
+        delta = after[key] - before[key]
+        if delta != count:
+            failures.append(f"{key}: {count} acknowledged appends but the store grew by {delta}")
+    for key, total in (('transaction_total', state.purchase_total), ('repayment_total', state.repayment_total)):
+        delta = after[key] - before[key]
+        if abs(delta - total) > 0.005 * max(1, state.purchases + state.repayments):
+            failures.append(f"{key}: acknowledged {total:.2f} but the ledger total moved by {delta:.2f}")
+    return failures
+
+# --- Driver ---
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+def register_load_users(base, count):
+    """Register dedicated users for the run and return their names."""
+    stamp = int(time.time())
+    names = [f"LoadTest_{stamp}_{i}" for i in range(count)]
+    for name in names:
+        requests.post(f'{base}/register', data={'name': name, 'dob': '1990-01-01'}, allow_redirects=False)
+    return names
+
+def client(base, users, mix, schedule, state, seed):
+    """One client thread: take the next send slot from the shared schedule and issue a request."""
+    rng = random.Random(seed)
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    session = requests.Session()
+    while True:
+        slot = schedule()
+        if slot is None:
+            return
+        delay = slot - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        op = rng.choices(names, weights)[0]
+        start = time.perf_counter()
+        try:
+            ok = OPERATIONS[op](session, base, users, rng, state)
+        except requests.RequestException:
+            ok = False
+        state.record(op, time.perf_counter() - start, ok)
+
+def run(args):
+    base = args.base_url.rstrip('/')
+    users = register_load_users(base, args.users)
+    before = ledger_snapshot(base)
+    state = RunState()
+
+    # Open-loop schedule: request i is due at start + i / qps regardless of how
+    # long earlier requests took, so a slow server shows up as latency.
+    total = int(args.qps * args.duration)
+    counter = iter(range(total))
+    counter_lock = threading.Lock()
+    start = time.perf_counter() + 0.1
+
+    def schedule():
+        with counter_lock:
+            i = next(counter, None)
+        return None if i is None else start + i / args.qps
+
+    threads = [threading.Thread(target=client, args=(base, users, args.mix, schedule, state, args.seed + n), daemon=True)
+               for n in range(args.clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    after = ledger_snapshot(base)
+
+    requests_done = sum(len(v) for v in state.latencies.values())
+    errors = sum(state.errors.values())
+    all_latencies = sorted(x for v in state.latencies.values() for x in v)
+    report = {
+        'target_qps': args.qps,
+        'achieved_qps': round(requests_done / elapsed, 2) if elapsed > 0 else 0.0,
+        'requests': requests_done,
+        'errors': errors,
+        'error_rate': round(errors / requests_done, 4) if requests_done else 0.0,
+        'latency_ms': {f'p{p}': round(percentile(all_latencies, p) * 1000, 2) for p in (50, 90, 95, 99)},
+        'decision_ms': {f'p{p}': round(percentile(sorted(state.decision_ms), p), 3) for p in (50, 99)},
+        'operations': {},
+        'integrity': {'before': before, 'after': after, 'failures': check_integrity(before, after, state)},
+    }
+    for op, values in sorted(state.latencies.items()):
+        values.sort()
+        report['operations'][op] = {
+            'requests': len(values),
+            'errors': state.errors[op],
+            'p50_ms': round(percentile(values, 50) * 1000, 2),
+            'p99_ms': round(percentile(values, 99) * 1000, 2),
+            'max_ms': round(values[-1] * 1000, 2),
+        }
+    return report
+
+def print_report(report):
+    print("\n=== LOAD TEST REPORT ===")
+    print(f"Throughput: {report['achieved_qps']} req/s (target {report['target_qps']})")
+    print(f"Requests: {report['requests']}, errors: {report['errors']} ({report['error_rate']:.2%})")
+    print("Latency: " + ', '.join(f"{k} {v} ms" for k, v in report['latency_ms'].items()))
+    print("Checkout decision: " + ', '.join(f"{k} {v} ms" for k, v in report['decision_ms'].items()))
+    print(f"\n{'operation':<18}{'requests':>10}{'errors':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for op, o in report['operations'].items():
+        print(f"{op:<18}{o['requests']:>10}{o['errors']:>8}{o['p50_ms']:>10}{o['p99_ms']:>10}{o['max_ms']:>10}")
+    failures = report['integrity']['failures']
+    print("\nIntegrity: " + ('OK' if not failures else 'FAILED'))
+    for f in failures:
+        print(f"  {f}")
+
+def gate_failures(report, args):
+    """Return the release gates the run did not meet."""
+    failures = list(report['integrity']['failures'])
+    if args.min_qps is not None and report['achieved_qps'] < args.min_qps:
+        failures.append(f"throughput {report['achieved_qps']} < {args.min_qps} req/s")
+    if args.max_error_rate is not None and report['error_rate'] > args.max_error_rate:
+        failures.append(f"error rate {report['error_rate']:.2%} > {args.max_error_rate:.2%}")
+    if args.max_p99_ms is not None and report['latency_ms']['p99'] > args.max_p99_ms:
+        failures.append(f"p99 {report['latency_ms']['p99']} ms > {args.max_p99_ms} ms")
+    if args.max_decision_p99_ms is not None and report['decision_ms']['p99'] > args.max_decision_p99_ms:
+        failures.append(f"checkout decision p99 {report['decision_ms']['p99']} ms > {args.max_decision_p99_ms} ms")
+    return failures
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Mixed-workload load test for the BNPL API")
+    parser.add_argument('--base-url', default='http://localhost:5000', help='Base URL of the running app')
+    parser.add_argument('--qps', type=float, default=20.0, help='Target request rate across all clients')
+    parser.add_argument('--duration', type=float, default=10.0, help='Run length in seconds')
+    parser.add_argument('--clients', type=int, default=8, help='Number of concurrent client threads')
+    parser.add_argument('--users', type=int, default=10, help='Number of load-test users to register')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f'Weighted operation mix (default: {DEFAULT_MIX})')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for the workload')
+    parser.add_argument('--report', default=None, help='Also write the report as JSON to this file')
+    parser.add_argument('--min-qps', type=float, default=None, help='Fail if achieved throughput is below this')
+    parser.add_argument('--max-error-rate', type=float, default=None, help='Fail if the error rate (0-1) is above this')
+    parser.add_argument('--max-p99-ms', type=float, default=None, help='Fail if overall p99 latency is above this')
+    parser.add_argument('--max-decision-p99-ms', type=float, default=None, help='Fail if the p99 checkout decision time is above this')
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    failures = gate_failures(report, args)
+    if failures:
+        print("\nRelease gate FAILED:")
+        for f in failures:
+            print(f"  {f}")
+        raise SystemExit(1)
@@ -0,0 +1,100 @@
+# Local Stub of the Credit Bureau and KYC Services
+# Serves POST /credit-check and POST /kyc-check with the answers a real
+# provider would give, after a simulated delay. The delay follows a
+# log-normal distribution around --latency-ms. A --slow-rate share of calls
+# takes --slow-ms instead, for a long tail. A --error-rate share answers
+# HTTP 503, and a --hang-rate share never answers within the client's timeout.
+# Answers are derived from the user name, so the same applicant always gets
+# the same result.
+#
+#   /credit-check  {"user", "amount"} -> {"passed", "score"}   (score 300-850, passed at 580+)
+#   /kyc-check     {"user", "amount"} -> {"passed"}            (about 3% of users fail)
+#
+# Usage:
+#   python provider_stub.py --port 5050
+#   python provider_stub.py --port 5050 --latency-ms 40 --slow-rate 0.02 --slow-ms 800 --error-rate 0.01
+
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HANG_SECONDS = 30
+PASSING_SCORE = 580
+
+def credit_answer(user):
+    score = 300 + zlib.crc32(user.encode('utf-8')) % 551
+    return {'passed': score >= PASSING_SCORE, 'score': score}
+
+def kyc_answer(user):
+    return {'passed': zlib.crc32(b'kyc:' + user.encode('utf-8')) % 100 >= 3}
+
+ANSWERS = {'/credit-check': credit_answer, '/kyc-check': kyc_answer}
+
+class StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections alive, so clients can pool them
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; without this, delayed ACKs stall each kept-alive reply
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        answer = ANSWERS.get(self.path)
+        if answer is None:
+            return self._reply(404, {'error': 'not found'})
+        config = self.server.config
+        with self.server.rng_lock:
+            roll = self.server.rng.random()
+            delay = (config.slow_ms if self.server.rng.random() < config.slow_rate
+                     else self.server.rng.lognormvariate(0, config.sigma) * config.latency_ms) / 1000
+        if roll < config.hang_rate:
+            time.sleep(HANG_SECONDS)
+        time.sleep(delay)
+        if roll < config.hang_rate + config.error_rate:
+            return self._reply(503, {'error': 'provider unavailable'})
+        self._reply(200, answer(str(payload.get('user', ''))))
+
+def make_server(port, config, host='127.0.0.1'):
+    """Create (but do not start) a stub server; config holds the latency and failure settings."""
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.config = config
+    server.rng = random.Random(config.seed)
+    server.rng_lock = threading.Lock()
+    return server
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local stub of the credit bureau and KYC provider services")
+    parser.add_argument('--port', type=int, default=5050)
+    parser.add_argument('--latency-ms', type=float, default=30, help='Median response time')
+    parser.add_argument('--sigma', type=float, default=0.5, help='Spread of the log-normal response time')
+    parser.add_argument('--slow-rate', type=float, default=0.0, help='Share of calls that take --slow-ms')
+    parser.add_argument('--slow-ms', type=float, default=1000, help='Response time of slow calls')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of calls answered with HTTP 503')
+    parser.add_argument('--hang-rate', type=float, default=0.0, help='Share of calls that never answer in time')
+    parser.add_argument('--seed', type=int, default=None, help='Seed the latency and failure draws')
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    args = parse_args()
+    server = make_server(args.port, args)
+    print(f"Provider stub on http://127.0.0.1:{args.port} (median {args.latency_ms} ms, slow {args.slow_rate:.0%}, "
+          f"errors {args.error_rate:.0%}, hangs {args.hang_rate:.0%})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,179 @@
+# Credit Bureau and KYC Provider Client
+# Calls the external soft credit check and KYC/AML check for a checkout. Both
+# checks are sent at the same time, so a checkout waits for the slower of the
+# two instead of their sum. Each provider is reached through a pooled
+# keep-alive session, and every call is bounded by BNPL_PROVIDER_TIMEOUT_MS:
+#
+#   hedging   if an attempt has not answered after BNPL_PROVIDER_HEDGE_MS, a
+#             second one is sent and the first answer wins. This cuts the
+#             tail caused by one slow connection or server.
+#   retries   a failed attempt (connection error, timeout, 5xx) is retried
+#             while the deadline allows, up to BNPL_PROVIDER_RETRIES extra
+#             attempts per call. Hedges count against the same allowance.
+#   breaker   after BNPL_PROVIDER_BREAKER_FAILURES calls in a row have failed,
+#             a provider is not called for BNPL_PROVIDER_BREAKER_RESET_S
+#             seconds. Then one trial call decides whether it is closed again.
+#
+# provider_stub.py serves both checks locally with configurable latency and
+# failure rates, so this behavior can be exercised offline.
+#
+# Usage:
+#   python provider_stub.py --port 5050 &
+#   BNPL_PROVIDER_URL=http://localhost:5050 python app.py
+
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import instrumentation
+
+# Only needed with a provider service configured (BNPL_PROVIDER_URL)
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except ImportError:
+    requests = None
+
+PROVIDER_URL = os.environ.get('BNPL_PROVIDER_URL')
+TIMEOUT_MS = float(os.environ.get('BNPL_PROVIDER_TIMEOUT_MS', 400))
+HEDGE_MS = float(os.environ.get('BNPL_PROVIDER_HEDGE_MS', 75))
+RETRIES = int(os.environ.get('BNPL_PROVIDER_RETRIES', 1))
+POOL_SIZE = int(os.environ.get('BNPL_PROVIDER_POOL', 16))
+BREAKER_FAILURES = int(os.environ.get('BNPL_PROVIDER_BREAKER_FAILURES', 5))
+BREAKER_RESET_S = float(os.environ.get('BNPL_PROVIDER_BREAKER_RESET_S', 10))
+
+# Check name -> path on the provider service
+CHECKS = {'credit': '/credit-check', 'kyc': '/kyc-check'}
+
+class ProviderError(Exception):
+    """A provider check failed, timed out or was not attempted because its breaker is open."""
+
+class CircuitBreaker:
+    """Stops calling a provider after repeated failures and lets one trial call through after a pause."""
+
+    def __init__(self, failures=BREAKER_FAILURES, reset_after=BREAKER_RESET_S):
+        self.failures = failures
+        self.reset_after = reset_after
+        self.consecutive = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half_open' if time.monotonic() - self.opened_at >= self.reset_after else 'open'
+
+    def allow(self):
+        """Return True if a call may be made now."""
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self.trial:
+                self.trial = True
+                return True
+            return False
+
+    def record(self, success):
+        """Record the outcome of a call; return True if this failure opened the breaker."""
+        with self.lock:
+            self.trial = False
+            if success:
+                self.consecutive = 0
+                self.opened_at = None
+                return False
+            self.consecutive += 1
+            if self.opened_at is not None or self.consecutive >= self.failures:
+                reopened = self.opened_at is None
+                self.opened_at = time.monotonic()
+                return reopened
+            return False
+
+class ProviderClient:
+    """Runs the credit and KYC checks against a provider service, concurrently and with hedged retries."""
+
+    def __init__(self, base_url, timeout_ms=TIMEOUT_MS, hedge_ms=HEDGE_MS, retries=RETRIES, pool_size=POOL_SIZE):
+        if requests is None:
+            raise RuntimeError("Provider checks need the requests package: pip install requests")
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout_ms / 1000
+        self.hedge_after = hedge_ms / 1000
+        self.retries = retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(CHECKS), pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.breakers = {check: CircuitBreaker() for check in CHECKS}
+        # Attempts and whole calls run in separate pools, so a call waiting on its attempts never starves them
+        self._attempts = ThreadPoolExecutor(max_workers=pool_size * 2, thread_name_prefix='bnpl-provider')
+        self._calls = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='bnpl-provider-call')
+
+    def _attempt(self, check, payload, timeout):
+        response = self.session.post(self.base_url + CHECKS[check], json=payload, timeout=timeout)
+        if response.status_code >= 500:
+            raise ProviderError(f"{check} check returned HTTP {response.status_code}")
+        response.raise_for_status()
+        return response.json()
+
+    def call(self, check, payload):
+        """Run one check within the deadline, hedging and retrying, and return the provider's JSON answer."""
+        breaker = self.breakers[check]
+        if not breaker.allow():
+            instrumentation.inc('bnpl_provider_calls_total', provider=check, outcome='breaker_open')
+            raise ProviderError(f"{check} provider unavailable (circuit open)")
+        start = time.monotonic()
+        deadline = start + self.timeout
+        pending = {self._attempts.submit(self._attempt, check, payload, self.timeout)}
+        attempts = 1
+        hedge_at = start + self.hedge_after
+        error = None
+        while pending:
+            now = time.monotonic()
+            until = min(deadline, hedge_at) if attempts <= self.retries else deadline
+            done, pending = wait(pending, timeout=max(0.0, until - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except (requests.RequestException, ProviderError, ValueError) as e:
+                    error = e
+                    continue
+                breaker.record(True)
+                instrumentation.inc('bnpl_provider_calls_total', provider=check, outcome='ok')
+                instrumentation.observe('bnpl_provider_call_seconds', time.monotonic() - start, provider=check)
+                return result
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            # Retry after a failure with nothing else in flight, or hedge a slow attempt
+            if attempts <= self.retries and (not pending or now >= hedge_at):
+                if pending:
+                    instrumentation.inc('bnpl_provider_hedges_total', provider=check)
+                pending.add(self._attempts.submit(self._attempt, check, payload, deadline - now))
+                attempts += 1
+                hedge_at = now + self.hedge_after
+        outcome = 'timeout' if pending or error is None else 'error'
+        if breaker.record(False):
+            instrumentation.inc('bnpl_provider_breaker_opened_total', provider=check)
+        instrumentation.inc('bnpl_provider_calls_total', provider=check, outcome=outcome)
+        instrumentation.observe('bnpl_provider_call_seconds', time.monotonic() - start, provider=check)
+        raise ProviderError(f"{check} check {'timed out' if outcome == 'timeout' else f'failed: {error}'}")
+
+    def check_all(self, checks):
+        """Start several checks at once; checks maps a check name to its payload. Return futures by check name."""
+        return {check: self._calls.submit(self.call, check, payload) for check, payload in checks.items()}
+
+def outcome(future):
+    """Return (answer, None) for a finished check, or (None, error message) if it failed."""
+    try:
+        return future.result(), None
+    except ProviderError as e:
+        return None, str(e)
+
+def breaker_states(client):
+    """Return each provider's circuit breaker state."""
+    return {check: breaker.state for check, breaker in client.breakers.items()}
+
+client = ProviderClient(PROVIDER_URL) if PROVIDER_URL else None
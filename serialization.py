@@ -0,0 +1,120 @@
+# Response Serialization and Compression
+# Large API listings spend most of their time in the stdlib JSON encoder.
+# This module encodes responses with orjson when it is installed, and with
+# the stdlib encoder otherwise (or when BNPL_JSON_BACKEND=stdlib). Both
+# produce Flask's JSON: sorted keys, compact separators and datetimes as
+# HTTP dates. Only the escaping of non-ASCII text differs: orjson writes
+# UTF-8 where the stdlib writes \u escapes.
+#
+#   msgpack   clients sending Accept: application/msgpack get the same payload
+#             as MessagePack when the msgpack package is installed, with
+#             datetimes as the same HTTP date strings
+#   gzip, br  responses of COMPRESSIBLE_TYPES larger than
+#             BNPL_COMPRESS_MIN_BYTES are compressed for clients that accept
+#             it; br needs the brotli package and is preferred when accepted
+#
+# A representation's ETag is the data ETag plus a suffix per format and
+# encoding (e.g. "abc-msgpack-gzip"), so a cached copy in any representation
+# is still recognized as current.
+
+import gzip
+import json
+import os
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import http_date, parse_accept_header
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+JSON_BACKEND = os.environ.get('BNPL_JSON_BACKEND', 'orjson' if orjson is not None else 'stdlib')
+if JSON_BACKEND == 'orjson' and orjson is None:
+    JSON_BACKEND = 'stdlib'
+COMPRESS_MIN_BYTES = int(os.environ.get('BNPL_COMPRESS_MIN_BYTES', 2048))
+GZIP_LEVEL = int(os.environ.get('BNPL_GZIP_LEVEL', 5))
+BROTLI_QUALITY = int(os.environ.get('BNPL_BROTLI_QUALITY', 4))
+
+MSGPACK_MIMETYPE = 'application/msgpack'
+COMPRESSIBLE_TYPES = {'application/json', MSGPACK_MIMETYPE, 'text/csv'}
+# Preferred encoding first
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+_DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+def _default(o):
+    """Encode the non-JSON types API payloads contain, as Flask's JSON provider does."""
+    if isinstance(o, datetime) and o.tzinfo is None:
+        # Same string as werkzeug's http_date for a naive datetime, in half the time
+        return (f"{_DAYS[o.weekday()]}, {o.day:02d} {_MONTHS[o.month - 1]} {o.year:04d} "
+                f"{o.hour:02d}:{o.minute:02d}:{o.second:02d} GMT")
+    if isinstance(o, date):
+        return http_date(o)
+    if isinstance(o, (Decimal, uuid.UUID)):
+        return str(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+if JSON_BACKEND == 'orjson':
+    # Datetimes are passed to _default so they keep Flask's HTTP date format instead of orjson's ISO one
+    _ORJSON_OPTIONS = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+                       | orjson.OPT_APPEND_NEWLINE)
+
+    def dumps_json(obj):
+        """Serialize a payload as a compact JSON response body (bytes, newline-terminated)."""
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+else:
+    def dumps_json(obj):
+        """Serialize a payload as a compact JSON response body (bytes, newline-terminated)."""
+        return (json.dumps(obj, default=_default, sort_keys=True, separators=(',', ':')) + '\n').encode('ascii')
+
+def dumps_msgpack(obj):
+    """Serialize a payload as MessagePack; requires the msgpack package."""
+    return msgpack.packb(obj, default=_default, datetime=False)
+
+def prefers_msgpack(accept):
+    """Return True if an Accept header prefers MessagePack over JSON and msgpack is installed."""
+    if msgpack is None or not accept:
+        return False
+    return parse_accept_header(accept, MIMEAccept).best_match(('application/json', MSGPACK_MIMETYPE)) == MSGPACK_MIMETYPE
+
+def choose_encoding(accept_encoding):
+    """Return the preferred content encoding an Accept-Encoding header allows, or None."""
+    if not accept_encoding:
+        return None
+    accepted = parse_accept_header(accept_encoding)
+    for encoding in ENCODINGS:
+        if accepted[encoding]:
+            return encoding
+    return None
+
+def should_compress(mimetype, size):
+    return mimetype in COMPRESSIBLE_TYPES and size >= COMPRESS_MIN_BYTES
+
+def compress(body, encoding):
+    """Compress a response body with 'br' or 'gzip'."""
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    # mtime=0 keeps the output identical for identical bodies
+    return gzip.compress(body, GZIP_LEVEL, mtime=0)
+
+def etag_variant(etag, *suffixes):
+    """Return the ETag of a representation of the data an ETag identifies."""
+    suffixes = [s for s in suffixes if s]
+    return f'{etag[:-1]}-{"-".join(suffixes)}"' if suffixes else etag
+
+def etag_variants(etag):
+    """Return the ETags of every representation of the data an ETag identifies."""
+    return [etag_variant(etag, fmt, encoding) for fmt in (None, 'msgpack') for encoding in (None,) + ENCODINGS]
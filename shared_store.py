@@ -0,0 +1,393 @@
+# Shared Columnar Read Model for Multi-worker Deployments
+# Under gunicorn every worker would otherwise parse the transaction and
+# repayment files into its own list of records, multiplying memory by the
+# worker count. With BNPL_SHARED_STORE=1 each ledger is kept in a shared
+# directory (data/.shared by default) as three files that every worker maps:
+#
+#   <ledger>.<n>.snap  immutable columnar snapshot: timestamp, amount and user
+#                      key columns, plus row numbers grouped by user
+#   <ledger>.<n>.tail  fixed-width rows appended since snapshot n was written
+#   <ledger>.ctl       control block: generation, current snapshot, committed
+#                      tail length and the JSON file version it mirrors
+#
+# Readers take no lock: the control block is updated with a seqlock, so a
+# worker learns whether anything changed with one read of shared memory and
+# then decodes only the new tail rows. Writers serialize on a file lock that
+# spans processes. The JSON data files stay the source of truth; when one is
+# changed behind the app's back, the next reader rebuilds the snapshot from it.
+
+import array
+import fcntl
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+ENABLED = os.environ.get('BNPL_SHARED_STORE') == '1'
+# Fold the tail into a new snapshot once it grows past this many bytes
+COMPACT_TAIL_BYTES = int(os.environ.get('BNPL_SHARED_COMPACT_BYTES', 1 << 20))
+
+MAGIC = b'BNPLCOL1'
+SNAPSHOT_HEADER = struct.Struct('<8sQQQ')  # magic, rows, user keys, key table bytes
+CONTROL = struct.Struct('<QQQqq')          # sequence, snapshot id, tail bytes, source mtime_ns, source size
+CONTROL_SIZE = 64
+SEQUENCE = struct.Struct('<Q')
+TAIL_ROW = struct.Struct('<qdq')           # timestamp, amount, user id (or -(name bytes + 1))
+SEQLOCK_SPINS = 1000
+
+def _source_version(filename):
+    """Return (mtime_ns, size) of a JSON data file, or (-1, -1) if it is missing."""
+    try:
+        st = os.stat(filename)
+    except FileNotFoundError:
+        return (-1, -1)
+    return (st.st_mtime_ns, st.st_size)
+
+# --- Cross-process Write Lock ---
+class FileLock:
+    """A re-entrant lock held across threads (RLock) and processes (flock on a lock file)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self):
+        self._rlock.acquire()
+        if self._depth == 0:
+            try:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            except BaseException:
+                self._rlock.release()
+                raise
+            self._fd = fd
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._rlock.release()
+
+_write_locks = {}
+_write_locks_guard = threading.Lock()
+
+def write_lock(directory):
+    """Return the writer lock shared by every process using a shared-store directory."""
+    with _write_locks_guard:
+        lock = _write_locks.get(directory)
+        if lock is None:
+            os.makedirs(directory, exist_ok=True)
+            lock = _write_locks[directory] = FileLock(os.path.join(directory, 'write.lock'))
+        return lock
+
+# --- Snapshot Files ---
+def write_snapshot(path, rows):
+    """Write (user key, amount, epoch-us timestamp) rows as a columnar snapshot file, atomically."""
+    keys = []
+    key_refs = {}
+    timestamps = array.array('q')
+    amounts = array.array('d')
+    refs = array.array('i')
+    for key, amount, timestamp in rows:
+        ref = key_refs.get(key)
+        if ref is None:
+            ref = key_refs[key] = len(keys)
+            keys.append(key)
+        timestamps.append(timestamp)
+        amounts.append(amount)
+        refs.append(ref)
+    # Row numbers grouped by user key, in ledger order within each user
+    counts = [0] * (len(keys) + 1)
+    for ref in refs:
+        counts[ref + 1] += 1
+    offsets = array.array('i', counts)
+    for i in range(1, len(offsets)):
+        offsets[i] += offsets[i - 1]
+    order = array.array('i', bytes(4 * len(refs)))
+    fill = list(offsets[:-1])
+    for row, ref in enumerate(refs):
+        order[fill[ref]] = row
+        fill[ref] += 1
+    key_table = json.dumps(keys).encode('utf-8')
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_HEADER.pack(MAGIC, len(refs), len(keys), len(key_table)))
+        for column in (timestamps, amounts, refs, order, offsets):
+            column.tofile(f)
+        f.write(key_table)
+    os.replace(tmp_path, path)
+
+class Snapshot:
+    """A mapped snapshot file; its columns are zero-copy views of the shared pages."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, rows, n_keys, key_bytes = SNAPSHOT_HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a ledger snapshot")
+        view = memoryview(self._map)
+        offset = SNAPSHOT_HEADER.size
+
+        def column(code, length):
+            nonlocal offset
+            size = length * array.array(code).itemsize
+            col = view[offset:offset + size].cast(code)
+            offset += size
+            return col
+
+        self.rows = rows
+        self.timestamps = column('q', rows)
+        self.amounts = column('d', rows)
+        self.refs = column('i', rows)
+        self.order = column('i', rows)
+        self.offsets = column('i', n_keys + 1)
+        self.keys = json.loads(bytes(view[offset:offset + key_bytes]))
+
+    def rows_for(self, ref):
+        """Return the row numbers of one user key, in ledger order."""
+        return self.order[self.offsets[ref]:self.offsets[ref + 1]]
+
+    def __iter__(self):
+        """Yield (user key, amount, timestamp) for every row."""
+        keys, refs, amounts, timestamps = self.keys, self.refs, self.amounts, self.timestamps
+        for i in range(self.rows):
+            yield keys[refs[i]], amounts[i], timestamps[i]
+
+def encode_tail_row(key, amount, timestamp):
+    """Encode one appended row; registered users by id, other names inline."""
+    if isinstance(key, int):
+        return TAIL_ROW.pack(timestamp, amount, key)
+    name = key.encode('utf-8')
+    return TAIL_ROW.pack(timestamp, amount, -(len(name) + 1)) + name
+
+def decode_tail_rows(data):
+    """Decode a run of appended rows into (user key, amount, timestamp) tuples."""
+    rows = []
+    offset = 0
+    while offset < len(data):
+        timestamp, amount, key = TAIL_ROW.unpack_from(data, offset)
+        offset += TAIL_ROW.size
+        if key < 0:
+            length = -key - 1
+            key = data[offset:offset + length].decode('utf-8')
+            offset += length
+        rows.append((key, amount, timestamp))
+    return rows
+
+# --- Shared Ledger ---
+class SharedLedger:
+    """One ledger's snapshot, tail and control block, as mapped by this process."""
+
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.base = os.path.join(directory, name)
+        self._lock = threading.Lock()
+        self._control = None
+        self._sequence = None
+        self._snapshot_id = 0
+        self._snapshot = None
+        self._tail = []
+        self._tail_read = 0
+
+    def _snapshot_path(self, snapshot_id):
+        return f"{self.base}.{snapshot_id}.snap"
+
+    def _tail_path(self, snapshot_id):
+        return f"{self.base}.{snapshot_id}.tail"
+
+    def _control_map(self):
+        if self._control is None:
+            os.makedirs(self.directory, exist_ok=True)
+            fd = os.open(self.base + '.ctl', os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size < CONTROL_SIZE:
+                    os.ftruncate(fd, CONTROL_SIZE)
+                self._control = mmap.mmap(fd, CONTROL_SIZE, access=mmap.ACCESS_READ)
+            finally:
+                os.close(fd)
+        return self._control
+
+    def read_control(self):
+        """Return a consistent (sequence, snapshot id, tail bytes, source version) or None if a writer died mid-update."""
+        control = self._control_map()
+        for _ in range(SEQLOCK_SPINS):
+            before = SEQUENCE.unpack_from(control, 0)[0]
+            if before & 1:
+                time.sleep(0)
+                continue
+            _, snapshot_id, tail_bytes, mtime_ns, size = CONTROL.unpack_from(control, 0)
+            if SEQUENCE.unpack_from(control, 0)[0] == before:
+                return before, snapshot_id, tail_bytes, (mtime_ns, size)
+        return None
+
+    def _write_control(self, snapshot_id, tail_bytes, source_version):
+        """Publish new control fields; the caller holds the write lock."""
+        sequence = SEQUENCE.unpack_from(self._control_map(), 0)[0]
+        odd = sequence + 1 if sequence % 2 == 0 else sequence
+        fd = os.open(self.base + '.ctl', os.O_RDWR)
+        try:
+            os.pwrite(fd, SEQUENCE.pack(odd), 0)
+            os.pwrite(fd, CONTROL.pack(odd, snapshot_id, tail_bytes, *source_version)[SEQUENCE.size:], SEQUENCE.size)
+            os.pwrite(fd, SEQUENCE.pack(odd + 1), 0)
+        finally:
+            os.close(fd)
+
+    def _valid(self, control, source):
+        return control is not None and control[1] > 0 and control[3] == _source_version(source)
+
+    def peek(self, source):
+        """Return the current generation if the shared copy mirrors the source file, else None."""
+        control = self.read_control()
+        return control[0] if self._valid(control, source) else None
+
+    def read(self, source, load_rows):
+        """Return (generation, snapshot, tail rows) for the current state, rebuilding from the source file if it changed.
+
+        load_rows() must return the source file's rows as (user key, amount, timestamp) tuples.
+        """
+        control = self.read_control()
+        while True:
+            if not self._valid(control, source):
+                with write_lock(self.directory):
+                    control = self.read_control()
+                    if not self._valid(control, source):
+                        self.rebuild(load_rows(), source)
+                        control = self.read_control()
+            try:
+                return self._sync(control)
+            except FileNotFoundError:
+                # A writer compacted after the control block was read and unlinked the files it names
+                fresh = self.read_control()
+                if fresh == control:
+                    # Nothing was published since, so the files were removed from outside: rebuild them
+                    with write_lock(self.directory):
+                        self.rebuild(load_rows(), source)
+                    fresh = self.read_control()
+                control = fresh
+
+    def _sync(self, control):
+        """Map a newer snapshot and decode new tail rows; return the mapped state."""
+        sequence, snapshot_id, tail_bytes, _ = control
+        with self._lock:
+            if self._sequence is None or sequence > self._sequence:
+                if snapshot_id != self._snapshot_id:
+                    self._snapshot = Snapshot(self._snapshot_path(snapshot_id))
+                    self._snapshot_id = snapshot_id
+                    self._tail = []
+                    self._tail_read = 0
+                if tail_bytes > self._tail_read:
+                    with open(self._tail_path(snapshot_id), 'rb') as f:
+                        data = os.pread(f.fileno(), tail_bytes - self._tail_read, self._tail_read)
+                    # A new list, so views handed out earlier keep their rows
+                    self._tail = self._tail + decode_tail_rows(data)
+                    self._tail_read = tail_bytes
+                self._sequence = sequence
+            return self._sequence, self._snapshot, self._tail
+
+    def rebuild(self, rows, source):
+        """Write a new snapshot of all rows and start an empty tail; the caller holds the write lock."""
+        control = self.read_control()
+        old_id = control[1] if control is not None else 0
+        snapshot_id = old_id + 1
+        write_snapshot(self._snapshot_path(snapshot_id), rows)
+        open(self._tail_path(snapshot_id), 'wb').close()
+        self._write_control(snapshot_id, 0, _source_version(source))
+        # Workers that still map the old files keep their pages until they remap
+        for path in (self._snapshot_path(old_id), self._tail_path(old_id)):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def append(self, rows, source):
+        """Append (user key, amount, timestamp) rows after they were appended to the source file; the caller holds the write lock."""
+        control = self.read_control()
+        _, snapshot_id, tail_bytes, _ = control
+        data = b''.join(encode_tail_row(key, amount, timestamp) for key, amount, timestamp in rows)
+        with open(self._tail_path(snapshot_id), 'r+b') as f:
+            os.pwrite(f.fileno(), data, tail_bytes)
+        self._write_control(snapshot_id, tail_bytes + len(data), _source_version(source))
+        if tail_bytes + len(data) > COMPACT_TAIL_BYTES:
+            _, snapshot, tail = self._sync(self.read_control())
+            self.rebuild(list(snapshot) + tail, source)
+
+# --- Read-only Ledger View ---
+class UserRows:
+    """Per-user access to a LedgerView, indexable by user id like the app's in-memory user index."""
+
+    def __init__(self, view):
+        self._view = view
+        self._refs = {}
+        for ref, uid in enumerate(view.ref_uids):
+            self._refs.setdefault(uid, []).append(ref)
+        self._tail = {}
+        for record in view.tail:
+            self._tail.setdefault(record.user_id, []).append(record)
+        self._size = max(list(self._refs) + list(self._tail), default=-1) + 1
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, uid):
+        snapshot = self._view.snapshot
+        refs = self._refs.get(uid, ())
+        if len(refs) == 1:
+            rows = snapshot.rows_for(refs[0])
+        else:
+            rows = sorted(row for ref in refs for row in snapshot.rows_for(ref))
+        return [self._view.record_at(row) for row in rows] + self._tail.get(uid, [])
+
+class LedgerView:
+    """A read-only sequence of ledger records over a mapped snapshot plus the decoded tail.
+
+    Records are materialized on access, so a worker holds only the user-key
+    mapping and the (small) tail, not one object per row.
+    """
+
+    def __init__(self, snapshot, tail, record_type, uid_for_key):
+        self.snapshot = snapshot
+        self.record_type = record_type
+        self.ref_uids = [uid_for_key(key) for key in snapshot.keys]
+        self.tail = [record_type(uid_for_key(key), amount, timestamp) for key, amount, timestamp in tail]
+        self._by_user = None
+
+    @property
+    def by_user(self):
+        """Records grouped by user id, built on first use."""
+        if self._by_user is None:
+            self._by_user = UserRows(self)
+        return self._by_user
+
+    def record_at(self, row):
+        s = self.snapshot
+        return self.record_type(self.ref_uids[s.refs[row]], s.amounts[row], s.timestamps[row])
+
+    def __len__(self):
+        return self.snapshot.rows + len(self.tail)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('ledger index out of range')
+        if i < self.snapshot.rows:
+            return self.record_at(i)
+        return self.tail[i - self.snapshot.rows]
+
+    def __iter__(self):
+        s = self.snapshot
+        make, ref_uids, refs, amounts, timestamps = self.record_type, self.ref_uids, s.refs, s.amounts, s.timestamps
+        for i in range(s.rows):
+            yield make(ref_uids[refs[i]], amounts[i], timestamps[i])
+        yield from self.tail
@@ -74,4 +74,10 @@ print(f'Status: {r.status_code}, Content-Type: {r.headers.get("Content-Type")},
 # 13. Download audit log CSV
 r = requests.get(f'{BASE_URL}/api/audit-log.csv', headers=HEADERS)
 print(f'\n=== GET /api/audit-log.csv ===')
-print(f'Status: {r.status_code}, Content-Type: {r.headers.get("Content-Type")}, Bytes: {len(r.content)}') 
\ No newline at end of file
+print(f'Status: {r.status_code}, Content-Type: {r.headers.get("Content-Type")}, Bytes: {len(r.content)}') 
+
+# 14. Bulk ingest (re-sending the same batch is a no-op)
+batch = 'type,user,amount,timestamp\npurchase,User1,19.99,2024-03-01T12:00:00\nrepayment,User1,5.00,2024-03-02T12:00:00\n'
+for attempt in (1, 2):
+    r = requests.post(f'{BASE_URL}/api/ingest', headers=dict(HEADERS, **{'Content-Type': 'text/csv'}), data=batch)
+    print_result(f'POST /api/ingest (attempt {attempt})', r)
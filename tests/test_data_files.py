@@ -0,0 +1,48 @@
+import os
+
+import app
+
+def test_save_json_keeps_the_file_mode(tmp_path):
+    path = str(tmp_path / 'users.json')
+    with open(path, 'w') as f:
+        f.write('[]')
+    os.chmod(path, 0o640)
+    app.save_json(path, [{'id': 0}])
+    assert os.stat(path).st_mode & 0o7777 == 0o640
+    os.unlink(path)
+    app.save_json(path, [{'id': 0}])
+    assert os.stat(path).st_mode & 0o7777 == 0o666 & ~app._UMASK
+
+def rows(start, stop):
+    return [{'user': f'User{n}', 'amount': n + 0.5, 'timestamp': app.datetime(2024, 1, 1 + n)} for n in range(start, stop)]
+
+def test_appended_rows_match_save_json(tmp_path):
+    path = str(tmp_path / 'transactions.json')
+    app.save_json(path, [])
+    assert app.append_json_rows(path, rows(0, 1))
+    assert app.append_json_rows(path, rows(1, 3))
+    expected = str(tmp_path / 'expected.json')
+    app.save_json(expected, rows(0, 3))
+    with open(path, 'rb') as f, open(expected, 'rb') as g:
+        assert f.read() == g.read()
+
+def test_short_append_leaves_the_file_intact(tmp_path, monkeypatch):
+    path = str(tmp_path / 'transactions.json')
+    app.save_json(path, rows(0, 2))
+    with open(path, 'rb') as f:
+        before = f.read()
+    pwrite = os.pwrite
+
+    def short_write(fd, data, offset):
+        return pwrite(fd, data[:len(data) // 2] if len(data) > 1 else data, offset)
+
+    def enospc(fd, data, offset):
+        if len(data) > 1:
+            raise OSError(28, 'No space left on device')
+        return pwrite(fd, data, offset)
+    # A full disk: the new rows reach the file in part or not at all
+    for fake in (short_write, enospc):
+        monkeypatch.setattr(os, 'pwrite', fake)
+        assert not app.append_json_rows(path, rows(2, 4))
+        with open(path, 'rb') as f:
+            assert f.read() == before
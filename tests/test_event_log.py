@@ -0,0 +1,23 @@
+import app
+
+def test_read_after_batch_larger_than_cache(tmp_path, monkeypatch):
+    """An append_many of more events than the recent cache holds must not leave a gap in read()."""
+    monkeypatch.setattr(app, 'EVENT_CACHE_SIZE', 3)
+    log = app.EventLog(str(tmp_path / 'events.jsonl'))
+    log.append('purchase', {'n': 1})
+    log.append('purchase', {'n': 2})
+    log.append_many([('purchase', {'n': n}) for n in range(3, 8)])
+    assert [e['seq'] for e in log.read(2)] == [3, 4, 5, 6, 7]
+    assert [e['seq'] for e in log.read(0)] == [1, 2, 3, 4, 5, 6, 7]
+    assert [e['data']['n'] for e in log.read(5)] == [6, 7]
+
+def test_read_after_batch_appended_by_another_writer(tmp_path, monkeypatch):
+    """Events written by another process are indexed in one sync and read back in order."""
+    monkeypatch.setattr(app, 'EVENT_CACHE_SIZE', 3)
+    path = str(tmp_path / 'events.jsonl')
+    reader = app.EventLog(path)
+    app.EventLog(path).append('purchase', {'n': 1})
+    assert reader.refresh() == 1
+    app.EventLog(path).append_many([('repayment', {'n': n}) for n in range(2, 7)])
+    assert [e['seq'] for e in reader.read(1)] == [2, 3, 4, 5, 6]
+    assert [e['seq'] for e in reader.read(3, limit=2)] == [4, 5]
@@ -0,0 +1,28 @@
+import pytest
+from playwright.sync_api import APIRequestContext
+import time
+
+BASE_URL = "http://localhost:5000/"
+
+@pytest.fixture(scope="session")
+def api_request_context(playwright):
+    """Create a Playwright API request context for the running app."""
+    return playwright.request.new_context(base_url=BASE_URL)
+
+def test_healthz(api_request_context: APIRequestContext):
+    resp = api_request_context.get("/healthz")
+    assert resp.status == 200
+    assert resp.json()["status"] == "ok"
+
+def test_readyz_becomes_ready(api_request_context: APIRequestContext):
+    """Readiness is 503 while warming up and 200 with per-phase timings once warm."""
+    for _ in range(50):
+        resp = api_request_context.get("/readyz")
+        if resp.status == 200:
+            break
+        assert resp.status == 503
+        time.sleep(0.1)
+    body = resp.json()
+    assert body["status"] == "ready"
+    for phase in ["users", "stores", "indexes", "features", "aggregates"]:
+        assert phase in body["phases"]
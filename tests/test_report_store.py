@@ -0,0 +1,37 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'validation'))
+import report_store  # noqa: E402
+
+def add_run(store, results, label):
+    writer = store.writer(label=label)
+    for result in results:
+        writer.add(result)
+    return writer.close()
+
+def test_diff_sees_changes_of_a_duplicated_name(tmp_path):
+    """Two results under one name must not cancel out in the bucket hash."""
+    store = report_store.ReportStore(str(tmp_path))
+    twin = {'name': 'LowRiskUser', 'issues': ['Low risk score in champion: 10.0'], 'warnings': []}
+    add_run(store, [twin, dict(twin), {'name': 'User1', 'issues': [], 'warnings': ['Inactive user: no transactions in last 90 days']}], 'a')
+    add_run(store, [{'name': 'User1', 'issues': [], 'warnings': ['Inactive user: no transactions in last 90 days']}], 'b')
+    diff = store.diff('a', 'b')
+    assert diff['stats']['users_changed'] == 1
+    assert [(c['status'], c['user'], c['check']) for c in diff['changes']] == [('resolved', 'LowRiskUser', 'low_risk_score')] * 2
+
+def test_diff_of_identical_runs_reads_nothing(tmp_path):
+    store = report_store.ReportStore(str(tmp_path))
+    results = [{'name': f'User{i}', 'issues': [f'Over-repayment: repaid {i}, purchased 0'], 'warnings': []} for i in range(50)]
+    add_run(store, results, 'a')
+    add_run(store, results, 'b')
+    diff = store.diff('a', 'b')
+    assert diff['changes'] == []
+    assert diff['stats']['buckets_changed'] == 0
+    assert store.trend(['over_repayment'])[1][1] == {'over_repayment': 50}
+
+def test_store_files_are_not_owner_only(tmp_path):
+    store = report_store.ReportStore(str(tmp_path))
+    add_run(store, [{'name': 'User1', 'issues': [], 'warnings': []}], 'a')
+    for name in ('catalog.json', 'run-1.blk'):
+        assert os.stat(tmp_path / name).st_mode & 0o777 == report_store.FILE_MODE
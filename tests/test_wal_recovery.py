@@ -0,0 +1,82 @@
+import json
+from datetime import datetime
+
+import pytest
+
+import app
+
+USERS = [{'id': 0, 'name': 'User1', 'dob': '1990-01-01', 'registered': '2024-01-01T00:00:00', 'credit_limit': 1000},
+         {'id': 1, 'name': 'User2', 'dob': '1990-01-01', 'registered': '2024-01-01T00:00:00', 'credit_limit': 1000}]
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """A scratch data directory; the app's data paths are relative to the working directory."""
+    (tmp_path / 'data').mkdir()
+    for name, rows in [('users', USERS), ('transactions', []), ('repayments', []),
+                       ('income_verifications', []), ('audit_log', [])]:
+        (tmp_path / 'data' / f'{name}.json').write_text(json.dumps(rows))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(app, 'WAL_FSYNC', False)
+    yield tmp_path / 'data'
+    restart(monkeypatch, wal=False)
+
+def restart(monkeypatch, wal):
+    """Drop the process state a restart would lose and start with or without the WAL, recovering as start_wal() does."""
+    app._stores.clear()
+    app._indexes.clear()
+    app._wal_pending.clear()
+    app._registry = None
+    monkeypatch.setattr(app, 'event_log', app.EventLog(app.EVENTS_FILE))
+    monkeypatch.setattr(app, 'WAL_ENABLED', wal)
+    if wal:
+        app.recover()
+
+def purchase(amount):
+    app.append_transaction('User1', amount, app.to_epoch_us(datetime(2024, 2, 1)) + int(amount * 100))
+
+def stored(data_dir, name):
+    return [row['amount'] for row in json.loads((data_dir / f'{name}.json').read_text())]
+
+def test_torn_last_line_is_dropped(data_dir, monkeypatch):
+    restart(monkeypatch, wal=True)
+    purchase(1.0)
+    purchase(2.0)
+    # Crash before any checkpoint, halfway through writing the next event
+    with open(data_dir / 'events.jsonl', 'a') as f:
+        f.write('{"seq": 3, "type": "purch')
+    assert stored(data_dir, 'transactions') == []
+    restart(monkeypatch, wal=True)
+    assert stored(data_dir, 'transactions') == [1.0, 2.0]
+    assert (data_dir / 'events.jsonl').read_bytes().endswith(b'\n')
+
+def test_interrupted_checkpoint_applies_no_event_twice(data_dir, monkeypatch):
+    restart(monkeypatch, wal=True)
+    purchase(1.0)
+    app.append_repayment('User1', 0.5, app.to_epoch_us(datetime(2024, 2, 2)))
+
+    def crash():
+        raise RuntimeError('crashed after saving the data files')
+    # The data files are saved, but the checkpoint position is never advanced
+    monkeypatch.setattr(app.event_log, 'position', crash)
+    with pytest.raises(RuntimeError):
+        app.checkpoint()
+    assert stored(data_dir, 'transactions') == [1.0]
+    restart(monkeypatch, wal=True)
+    assert stored(data_dir, 'transactions') == [1.0]
+    assert stored(data_dir, 'repayments') == [0.5]
+
+def test_writes_made_without_the_wal_are_not_replayed(data_dir, monkeypatch):
+    restart(monkeypatch, wal=True)
+    purchase(1.0)
+    app.checkpoint()
+    restart(monkeypatch, wal=False)
+    purchase(2.0)
+    app.append_repayment('User1', 3.21, app.to_epoch_us(datetime(2024, 2, 2)))
+    assert stored(data_dir, 'transactions') == [1.0, 2.0]
+    restart(monkeypatch, wal=True)
+    assert stored(data_dir, 'transactions') == [1.0, 2.0]
+    assert stored(data_dir, 'repayments') == [3.21]
+    # The log is still replayed into files the run without the WAL left alone
+    purchase(4.0)
+    restart(monkeypatch, wal=True)
+    assert stored(data_dir, 'transactions') == [1.0, 2.0, 4.0]
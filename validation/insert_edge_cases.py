@@ -4,8 +4,12 @@
 
 import json
 import os
+import sys
 from datetime import datetime, timedelta
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import blockfile  # noqa: E402
+
 # --- File paths ---
 DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
 USERS_FILE = os.path.join(DATA_DIR, 'users.json')
@@ -16,14 +20,10 @@ INCOME_VERIFICATIONS_FILE = os.path.join(DATA_DIR, 'income_verifications.json')
 now = datetime.now()
 
 # --- Load data files ---
-with open(USERS_FILE) as f:
-    users = json.load(f)
-with open(TRANSACTIONS_FILE) as f:
-    transactions = json.load(f)
-with open(REPAYMENTS_FILE) as f:
-    repayments = json.load(f)
-with open(INCOME_VERIFICATIONS_FILE) as f:
-    income_verifications = json.load(f)
+users = blockfile.load(USERS_FILE)
+transactions = blockfile.load(TRANSACTIONS_FILE)
+repayments = blockfile.load(REPAYMENTS_FILE)
+income_verifications = blockfile.load(INCOME_VERIFICATIONS_FILE)
 
 # --- Helper functions to add data ---
 def add_user(user):
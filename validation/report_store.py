@@ -0,0 +1,391 @@
+# Validation Report Store
+# Keeps every validation run in one directory so two runs can be diffed and
+# issue counts followed over time without re-reading old reports:
+#
+#   catalog.json  one entry per run: id, label, as-of time, source report,
+#                 summary and issue/warning counts per check. Trend queries
+#                 read only this file.
+#   run-N.blk     the run's issues and warnings in the block format of
+#                 blockfile.py, one row per (user, check, severity, message).
+#                 Rows are grouped into buckets by a hash of the user name and
+#                 sorted by user within each bucket. The index metadata holds
+#                 each bucket's first row and row count, and the XOR of the
+#                 hashes of its users' rows.
+#
+# A diff compares the bucket hashes of the two runs, decodes only the blocks
+# of buckets that differ, and skips the users whose rows are unchanged, so
+# its cost grows with the number of changed users rather than with the size
+# of the runs. Users without issues or warnings are not stored, so a
+# --flagged-only report and a full report of the same run store the same rows.
+#
+# Reports carry messages but not the name of the check that produced them;
+# CHECK_PREFIXES maps message prefixes back to the check names of
+# validate_risk_models.py and must be kept in line with its messages.
+#
+# Usage:
+#   python validation/report_store.py add validation/risk_validation_report.json --label baseline
+#   python validation/report_store.py runs
+#   python validation/report_store.py diff 1 2
+#   python validation/report_store.py trend --check velocity,inactive
+
+import argparse
+import bisect
+import csv
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+import zlib
+from collections import Counter
+from datetime import datetime
+from itertools import groupby
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import blockfile  # noqa: E402
+
+DEFAULT_STORE = os.path.join(os.path.dirname(__file__), 'runs')
+CATALOG_FILE = 'catalog.json'
+# Buckets are a power of two so runs of different sizes can be compared on the coarser bucketing
+BUCKET_USERS = 64
+MIN_BUCKETS = 64
+MAX_BUCKETS = 1 << 16
+# Rows are spooled to this many temporary files while a run is added, so memory holds one partition at a time
+SPOOL_PARTITIONS = 64
+SEVERITIES = ('issues', 'warnings')
+# mkstemp files are owner-only; run and catalog files get the mode open() would give them
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+FILE_MODE = 0o666 & ~_UMASK
+
+# First matching prefix wins
+CHECK_PREFIXES = (
+    ('Utilization out of bounds', 'utilization'),
+    ('Outstanding negative balance', 'outstanding'),
+    ('Risk score ', 'risk_scores'),
+    ('User in default but champion score high', 'default_score'),
+    ('Non-compliance', 'compliance'),
+    ('Over-repayment', 'over_repayment'),
+    ('Large purchase without income verification', 'large_purchase_verification'),
+    ('High transaction velocity', 'velocity'),
+    ('Inactive user', 'inactive'),
+    ('Non-positive credit limit', 'credit_limit'),
+    ('Suspicious repayment', 'suspicious_repayments'),
+    ('Multiple large purchases without income verification', 'multiple_large_purchases'),
+    ('Future-dated ', 'future_dated'),
+    ('High utilization', 'high_utilization'),
+    ('Low risk score in ', 'low_risk_score'),
+    ('Repayment before first purchase', 'repayment_before_purchase'),
+    ('Duplicate transactions', 'duplicate_transactions'),
+    ('High relative transaction', 'high_relative_transaction'),
+)
+
+def check_of(message):
+    """Return the name of the check that produced a report message, or 'other'."""
+    for prefix, check in CHECK_PREFIXES:
+        if message.startswith(prefix):
+            return check
+    return 'other'
+
+def bucket_of(name, buckets):
+    return zlib.crc32(name.encode('utf-8')) & (buckets - 1)
+
+def bucket_count(users):
+    """Return the number of buckets for a run with this many flagged users."""
+    buckets = MIN_BUCKETS
+    while buckets < MAX_BUCKETS and buckets * BUCKET_USERS < users:
+        buckets *= 2
+    return buckets
+
+def user_hash(name, rows):
+    """Return a 128-bit hash of one user's (check, severity, message) rows."""
+    h = hashlib.blake2b(name.encode('utf-8'), digest_size=16)
+    for row in sorted(rows):
+        h.update(json.dumps(row).encode('utf-8'))
+    return int.from_bytes(h.digest(), 'big')
+
+def fold(bucket_hashes, buckets):
+    """XOR a run's bucket hashes down to a coarser power-of-two bucketing."""
+    folded = [0] * buckets
+    for i, h in enumerate(bucket_hashes):
+        folded[i & (buckets - 1)] ^= int(h, 16)
+    return folded
+
+# --- Report Readers ---
+# Each reader yields the user results of one report file and returns its
+# summary (or None), for every format validate_risk_models.py writes.
+def read_json_report(path):
+    with open(path) as f:
+        report = json.load(f)
+    yield from report.get('results', [])
+    return report.get('summary')
+
+def read_jsonl_report(path):
+    summary = None
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if 'name' in item:
+                yield item
+            else:
+                summary = item.get('summary')
+    return summary
+
+def read_csv_report(path):
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            yield {'name': row['name'],
+                   'issues': row['issues'].split('; ') if row['issues'] else [],
+                   'warnings': row['warnings'].split('; ') if row['warnings'] else []}
+    return None
+
+def read_block_report(path):
+    yield from blockfile.iter_rows(path)
+    return blockfile.read_index(path)[2].get('meta', {}).get('summary')
+
+REPORT_READERS = {'.json': read_json_report, '.jsonl': read_jsonl_report, '.csv': read_csv_report, '.blk': read_block_report}
+
+# --- Store ---
+class RunWriter:
+    """Adds one run to a store from user results as they arrive."""
+
+    def __init__(self, store, source=None, label=None):
+        self.store = store
+        self.source = source
+        self.label = label
+        self.partitions = [tempfile.TemporaryFile('w+') for _ in range(SPOOL_PARTITIONS)]
+        self.users = 0
+        self.checks = {}
+
+    def add(self, result):
+        rows = [(check_of(m), severity, m) for severity in SEVERITIES for m in result.get(severity) or []]
+        if not rows:
+            return
+        name = result['name']
+        self.users += 1
+        for check in {row[0] for row in rows}:
+            self.checks.setdefault(check, {'issues': 0, 'warnings': 0, 'users': 0})['users'] += 1
+        for check, severity, _ in rows:
+            self.checks[check][severity] += 1
+        spool = self.partitions[bucket_of(name, SPOOL_PARTITIONS)]
+        spool.write(json.dumps([name, rows]) + '\n')
+
+    def close(self, summary=None):
+        """Write the run file, add the run to the catalog and return its catalog entry."""
+        catalog = self.store.catalog()
+        run_id = max((run['id'] for run in catalog), default=0) + 1
+        buckets = bucket_count(self.users)
+        bucket_rows = [[0, 0] for _ in range(buckets)]
+        bucket_hashes = [0] * buckets
+        path = self.store.run_path(run_id)
+        fd, tmp = tempfile.mkstemp(dir=self.store.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            os.fchmod(f.fileno(), FILE_MODE)
+            writer = blockfile.BlockWriter(f, index_users=False)
+            # buckets >= SPOOL_PARTITIONS, so each bucket lies within a single partition
+            for spool in self.partitions:
+                spool.seek(0)
+                users = sorted((bucket_of(name, buckets), name, rows) for name, rows in map(json.loads, spool))
+                # A name can have several results (users.json repeats some names); they are one
+                # user to a diff, so their rows are merged and hashed together
+                for (bucket, name), results in groupby(users, key=lambda u: u[:2]):
+                    rows = [tuple(row) for _, _, result_rows in results for row in result_rows]
+                    if not bucket_rows[bucket][1]:
+                        bucket_rows[bucket][0] = writer.rows + len(writer.pending)
+                    bucket_rows[bucket][1] += len(rows)
+                    bucket_hashes[bucket] ^= user_hash(name, rows)
+                    for check, severity, message in sorted(rows):
+                        writer.write({'name': name, 'check': check, 'severity': severity, 'message': message})
+                spool.close()
+            writer.close({'buckets': buckets, 'bucket_rows': bucket_rows,
+                          'bucket_hashes': [f'{h:032x}' for h in bucket_hashes]})
+        os.replace(tmp, path)
+        entry = {'id': run_id, 'label': self.label, 'as_of': (summary or {}).get('as_of'), 'source': self.source,
+                 'created': datetime.now().isoformat(timespec='seconds'), 'summary': summary,
+                 'users_flagged': self.users, 'checks': dict(sorted(self.checks.items()))}
+        self.store.save_catalog(catalog + [entry])
+        return entry
+
+class ReportStore:
+    def __init__(self, directory=DEFAULT_STORE):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def catalog(self):
+        path = os.path.join(self.directory, CATALOG_FILE)
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return json.load(f)
+
+    def save_catalog(self, catalog):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            os.fchmod(f.fileno(), FILE_MODE)
+            json.dump(catalog, f, indent=2)
+        os.replace(tmp, os.path.join(self.directory, CATALOG_FILE))
+
+    def run_path(self, run_id):
+        return os.path.join(self.directory, f'run-{run_id}.blk')
+
+    def writer(self, source=None, label=None):
+        return RunWriter(self, source, label)
+
+    def add_report(self, path, label=None):
+        """Add a validation report (.json, .jsonl, .csv or .blk) to the store and return its catalog entry."""
+        reader = REPORT_READERS.get(os.path.splitext(path)[1].lower())
+        if reader is None:
+            raise ValueError(f"Cannot tell the report format of {path}; use one of {', '.join(REPORT_READERS)}")
+        writer = self.writer(source=os.path.abspath(path), label=label)
+        results = reader(path)
+        while True:
+            try:
+                writer.add(next(results))
+            except StopIteration as done:
+                return writer.close(done.value)
+
+    def run(self, ref):
+        """Return the catalog entry of a run by id, by label, or by negative position (-1 is the latest)."""
+        catalog = self.catalog()
+        try:
+            number = int(ref)
+        except ValueError:
+            number = None
+        if number is not None and number < 0 and -number <= len(catalog):
+            return catalog[number]
+        for run in reversed(catalog):
+            if run['id'] == number or run['label'] == ref:
+                return run
+        raise KeyError(f"No run {ref} in {self.directory}")
+
+    def _bucket_users(self, run_id, index, coarse, buckets):
+        """Return {user: {(check, severity): messages}} for the users of the given coarse buckets of a run."""
+        meta = index['meta']
+        block_starts, total = [], 0
+        for _, _, rows in index['blocks']:
+            block_starts.append(total)
+            total += rows
+        numbers = set()
+        for c in coarse:
+            for bucket in range(c, meta['buckets'], buckets):
+                first, count = meta['bucket_rows'][bucket]
+                if count:
+                    numbers.update(range(bisect.bisect_right(block_starts, first) - 1,
+                                         bisect.bisect_right(block_starts, first + count - 1)))
+        wanted = set(coarse)
+        users = {}
+        for row in blockfile.read_blocks(self.run_path(run_id), sorted(numbers)):
+            if bucket_of(row['name'], buckets) in wanted:
+                users.setdefault(row['name'], {}).setdefault((row['check'], row['severity']), []).append(row['message'])
+        return users
+
+    def diff(self, a, b):
+        """Return the issues and warnings that are new, resolved or changed from run a to run b."""
+        started = time.perf_counter()
+        run_a, run_b = self.run(a), self.run(b)
+        index_a = blockfile.read_index(self.run_path(run_a['id']))[2]
+        index_b = blockfile.read_index(self.run_path(run_b['id']))[2]
+        buckets = min(index_a['meta']['buckets'], index_b['meta']['buckets'])
+        hashes_a = fold(index_a['meta']['bucket_hashes'], buckets)
+        hashes_b = fold(index_b['meta']['bucket_hashes'], buckets)
+        coarse = [c for c in range(buckets) if hashes_a[c] != hashes_b[c]]
+        old = self._bucket_users(run_a['id'], index_a, coarse, buckets)
+        new = self._bucket_users(run_b['id'], index_b, coarse, buckets)
+        changes = []
+        users_changed = 0
+        for name in sorted(old.keys() | new.keys()):
+            before, after = old.get(name, {}), new.get(name, {})
+            if before == after:
+                continue
+            users_changed += 1
+            for check, severity in sorted(before.keys() | after.keys()):
+                old_messages, new_messages = Counter(before.get((check, severity), [])), Counter(after.get((check, severity), []))
+                removed = sorted((old_messages - new_messages).elements())
+                added = sorted((new_messages - old_messages).elements())
+                item = {'user': name, 'check': check, 'severity': severity}
+                if removed and added:
+                    changes.append(dict(item, status='changed', old=removed, new=added))
+                elif added:
+                    changes.extend(dict(item, status='new', old=[], new=[m]) for m in added)
+                elif removed:
+                    changes.extend(dict(item, status='resolved', old=[m], new=[]) for m in removed)
+        return {'from': run_a, 'to': run_b, 'changes': changes,
+                'stats': {'buckets': buckets, 'buckets_changed': len(coarse), 'users_compared': len(old.keys() | new.keys()),
+                          'users_changed': users_changed, 'ms': round((time.perf_counter() - started) * 1000, 2)}}
+
+    def trend(self, checks=None, severity='all'):
+        """Return [(run entry, {check: count})] for every run, from the catalog alone."""
+        catalog = self.catalog()
+        if not checks:
+            checks = sorted({check for run in catalog for check in run['checks']})
+        keys = SEVERITIES if severity == 'all' else (severity,)
+        return [(run, {check: sum(run['checks'].get(check, {}).get(k, 0) for k in keys) for check in checks})
+                for run in catalog]
+
+# --- CLI ---
+def describe(run):
+    return f"run {run['id']}" + (f" ({run['label']})" if run['label'] else '') + (f" as of {run['as_of']}" if run['as_of'] else '')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Store validation runs, diff them and follow issue counts over time")
+    parser.add_argument('--store', default=DEFAULT_STORE, help='Store directory (default: validation/runs)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    add = commands.add_parser('add', help='Add a validation report (.json, .jsonl, .csv or .blk)')
+    add.add_argument('report')
+    add.add_argument('--label', default=None)
+    commands.add_parser('runs', help='List the stored runs')
+    diff = commands.add_parser('diff', help='Show new, resolved and changed issues between two runs')
+    diff.add_argument('old', help='Run id, label, or -1 for the latest run, -2 for the one before')
+    diff.add_argument('new')
+    diff.add_argument('--json', action='store_true')
+    trend = commands.add_parser('trend', help='Issue and warning counts per check for every run')
+    trend.add_argument('--check', default=None, help='Comma-separated checks (default: every check seen)')
+    trend.add_argument('--severity', choices=('all',) + SEVERITIES, default='all')
+    trend.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+    store = ReportStore(args.store)
+    try:
+        run_command(store, args)
+    except (KeyError, ValueError) as e:
+        parser.error(e.args[0])
+
+def run_command(store, args):
+    if args.command == 'add':
+        run = store.add_report(args.report, args.label)
+        print(f"Added {describe(run)}: {run['users_flagged']} flagged users, "
+              f"{sum(c['issues'] for c in run['checks'].values())} issues, "
+              f"{sum(c['warnings'] for c in run['checks'].values())} warnings")
+    elif args.command == 'runs':
+        for run in store.catalog():
+            print(f"{run['id']:>4}  {run['created']}  {run['label'] or '-':<16}{run['as_of'] or '-':<28}"
+                  f"{run['users_flagged']:>6} flagged  {run['source'] or '-'}")
+    elif args.command == 'diff':
+        result = store.diff(args.old, args.new)
+        if args.json:
+            print(json.dumps(result, indent=2))
+            return
+        stats = result['stats']
+        print(f"{describe(result['from'])} -> {describe(result['to'])}: {stats['users_changed']} users changed, "
+              f"{stats['buckets_changed']} of {stats['buckets']} buckets read, {stats['ms']} ms")
+        width = max((len(change['user']) for change in result['changes']), default=0) + 2
+        for change in result['changes']:
+            text = ' -> '.join('; '.join(m) for m in (change['old'], change['new']) if m)
+            print(f"  {change['status'].upper():<10}{change['user']:<{width}}{change['check']:<28}{change['severity'][:-1]:<9}{text}")
+    elif args.command == 'trend':
+        checks = [c.strip() for c in args.check.split(',')] if args.check else None
+        rows = store.trend(checks, args.severity)
+        if args.json:
+            print(json.dumps([{'id': run['id'], 'label': run['label'], 'as_of': run['as_of'], 'counts': counts}
+                              for run, counts in rows], indent=2))
+            return
+        names = list(rows[0][1]) if rows else []
+        print(f"{'run':>4}  {'as of':<28}" + ''.join(f"{name:>{max(len(name), 6) + 2}}" for name in names))
+        for run, counts in rows:
+            print(f"{run['id']:>4}  {run['as_of'] or '-':<28}"
+                  + ''.join(f"{counts[name]:>{max(len(name), 6) + 2}}" for name in names))
+
+if __name__ == '__main__':
+    main()
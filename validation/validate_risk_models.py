@@ -3,28 +3,46 @@
 # performs advanced risk and compliance checks, and outputs a detailed report.
 
 import json
+import math
 import os
+import sys
 import argparse
+import csv
+import glob
+import gzip
+import shutil
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
 from datetime import datetime, timedelta
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import blockfile  # noqa: E402
+import report_store  # noqa: E402
+
 # --- File paths and constants ---
 DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
 USERS_FILE = os.path.join(DATA_DIR, 'users.json')
 TRANSACTIONS_FILE = os.path.join(DATA_DIR, 'transactions.json')
 REPAYMENTS_FILE = os.path.join(DATA_DIR, 'repayments.json')
 INCOME_VERIFICATIONS_FILE = os.path.join(DATA_DIR, 'income_verifications.json')
+# Monthly cold partitions written by archive_history.py, one directory per data file
+ARCHIVE_DIR = os.path.join(DATA_DIR, 'archive')
 
 DEFAULT_OVERDUE_DAYS = 60
 DEFAULT_CREDIT_LIMIT = 1000.0
 MIN_AGE = 18
+LARGE_PURCHASE = 500
+# Share of the credit limit above which a purchase is large relative to it
+RELATIVE_LARGE_SHARE = 0.9
 
 # --- Data Loaders ---
 def load_json(filename):
-    """Load JSON data from a file, return empty list if file does not exist."""
+    """Load JSON data (or a block-format file) from a file, return empty list if file does not exist."""
     if not os.path.exists(filename):
         return []
-    with open(filename, 'r') as f:
-        return json.load(f)
+    return blockfile.load(filename)
 
 def parse_datetime(dt):
     """Parse ISO format string to datetime object."""
@@ -32,31 +50,174 @@ def parse_datetime(dt):
         return datetime.fromisoformat(dt)
     return dt
 
+# --- Timestamp Helpers ---
+# Record timestamps are parsed once at load into integer epoch microseconds and
+# formatted back to ISO strings only when they appear in report messages.
+EPOCH = datetime(1970, 1, 1)
+US_PER_DAY = 86_400_000_000
+
+def to_epoch_us(dt):
+    """Convert a naive datetime (or ISO string) to integer microseconds since the Unix epoch."""
+    return (parse_datetime(dt) - EPOCH) // timedelta(microseconds=1)
+
+def format_timestamp(us):
+    """Format integer epoch microseconds as an ISO string."""
+    return (EPOCH + timedelta(microseconds=us)).isoformat()
+
+def load_archived(filename):
+    """Load the archived monthly partitions of a data file, oldest first."""
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    records = []
+    for path in sorted(glob.glob(os.path.join(ARCHIVE_DIR, stem, '*.json.gz'))):
+        with gzip.open(path, 'rt') as f:
+            records.extend(json.load(f))
+    return records
+
+def load_records(filename):
+    """Load a timestamped data file and its archived history, converting each record's timestamp to epoch microseconds."""
+    records = load_archived(filename) + load_json(filename)
+    for r in records:
+        r['timestamp'] = to_epoch_us(r['timestamp'])
+    return records
+
 # Load all data files
 users = load_json(USERS_FILE)
-transactions = load_json(TRANSACTIONS_FILE)
-repayments = load_json(REPAYMENTS_FILE)
-income_verifications = load_json(INCOME_VERIFICATIONS_FILE)
+transactions = load_records(TRANSACTIONS_FILE)
+repayments = load_records(REPAYMENTS_FILE)
+income_verifications = load_records(INCOME_VERIFICATIONS_FILE)
+
+# --- User Ids ---
+# Users are keyed by small integer ids: the 'id' stored on the user record, or
+# file order for legacy records without one, as assigned by the web app. Ledger
+# rows reference users by 'user_id' (or by name in legacy rows) and are grouped
+# once into per-user lists, so each check indexes its user's rows directly.
+user_ids = {}
+user_names = []
+
+def user_id_for(name):
+    """Return the id for a user name, allocating one for names without a user record."""
+    uid = user_ids.get(name)
+    if uid is None:
+        uid = len(user_names)
+        user_names.append(name)
+        user_ids[name] = uid
+    return uid
+
+def assign_user_ids(users):
+    """Build the name/id mapping, claiming stored ids before numbering legacy users."""
+    for u in sorted((u for u in users if isinstance(u.get('id'), int)), key=lambda u: u['id']):
+        user_names.extend([None] * (u['id'] + 1 - len(user_names)))
+        user_names[u['id']] = u['name']
+        user_ids.setdefault(u['name'], u['id'])
+    for u in users:
+        if not isinstance(u.get('id'), int):
+            u['id'] = len(user_names)
+            user_names.append(u['name'])
+            user_ids.setdefault(u['name'], u['id'])
+
+def group_by_user(records):
+    """Group records into lists indexed by user id."""
+    ids = [r['user_id'] if 'user_id' in r else user_id_for(r['user']) for r in records]
+    grouped = [[] for _ in user_names]
+    for uid, r in zip(ids, records):
+        grouped[uid].append(r)
+    return grouped
+
+assign_user_ids(users)
+transactions_by_user = group_by_user(transactions)
+repayments_by_user = group_by_user(repayments)
+income_verifications_by_user = group_by_user(income_verifications)
+
+# --- Evaluation Context ---
+# Every check is evaluated against one as-of instant, with the day-window
+# cutoffs precomputed as epoch microseconds. Time comparisons become integer
+# compares and a report is reproducible for a given --as-of value.
+EVAL_WINDOWS = (7, 30, 60, 90)
+
+class EvalContext:
+    """One as-of timestamp plus its epoch cutoffs for the 7/30/60/90 day windows."""
+    __slots__ = ('as_of', 'as_of_us', 'cutoffs')
+
+    def __init__(self, as_of=None):
+        self.as_of = as_of if as_of is not None else datetime.now()
+        self.as_of_us = to_epoch_us(self.as_of)
+        self.cutoffs = {days: self.as_of_us - days * US_PER_DAY for days in EVAL_WINDOWS}
+
+    def cutoff(self, days):
+        """Return the epoch cutoff for a window of 'days'; records newer than it fall inside the window."""
+        cutoff = self.cutoffs.get(days)
+        if cutoff is None:
+            cutoff = self.as_of_us - days * US_PER_DAY
+        return cutoff
+
+# Replaced with the --as-of context once the CLI arguments are parsed
+eval_ctx = EvalContext()
 
 # --- Helper Functions ---
+# Number of ledger records handed to checks; read by the --profile mode
+profile_counters = {'record_visits': 0}
+
+def user_records(grouped, name):
+    # Returns the grouped records for a user name, or an empty list for unknown names.
+    uid = user_ids.get(name)
+    records = grouped[uid] if uid is not None and uid < len(grouped) else []
+    profile_counters['record_visits'] += len(records)
+    return records
+
 def get_user_transactions(name):
-    # Returns all transactions for the given user by filtering the global transactions list.
+    # Returns all transactions for the given user from the per-user id index.
     # This is used to compute user-specific metrics like utilization, velocity, and large purchases.
-    return [t for t in transactions if t['user'] == name]
+    return user_records(transactions_by_user, name)
 
 def get_user_repayments(name):
-    # Returns all repayments for the given user by filtering the global repayments list.
+    # Returns all repayments for the given user from the per-user id index.
     # Used to compute outstanding balance and repayment-related checks.
-    return [r for r in repayments if r['user'] == name]
+    return user_records(repayments_by_user, name)
 
 def get_income_verification_status(name):
     # Returns the most recent income verification status for the user.
-    # Scans the income_verifications list in reverse to get the latest entry.
+    # The user's verifications are kept in file order, so the last entry is the latest.
     # Returns 'Not Verified' if no record is found.
-    for v in reversed(income_verifications):
-        if v['user'] == name:
-            return v['status']
-    return 'Not Verified'
+    ivs = user_records(income_verifications_by_user, name)
+    return ivs[-1]['status'] if ivs else 'Not Verified'
+
+# --- Compliance State ---
+# The inputs of check_compliance and the large-purchase checks are gathered
+# once per user, in a single pass over the user's transactions: the instant
+# the user comes of age, the latest verification status, and the purchases
+# that are large in absolute terms or relative to the credit limit. The
+# checks then read this state instead of each rescanning the transactions;
+# a verified user, or one without large purchases, costs a lookup.
+MAJORITY_US = MIN_AGE * 365 * US_PER_DAY
+compliance_states = {}
+
+class ComplianceState:
+    """Per-user inputs of the compliance checks."""
+    __slots__ = ('majority_us', 'income_status', 'large_amounts', 'relative_amounts', 'flagged_amounts')
+
+    def __init__(self, user):
+        credit_limit = user.get('credit_limit', DEFAULT_CREDIT_LIMIT)
+        self.majority_us = to_epoch_us(datetime.strptime(user['dob'], '%Y-%m-%d')) + MAJORITY_US
+        self.income_status = get_income_verification_status(user['name'])
+        # Amounts in file order: over $500, over 90% of the limit, and over either
+        self.large_amounts = []
+        self.relative_amounts = []
+        self.flagged_amounts = []
+        for t in get_user_transactions(user['name']):
+            large, relative = t['amount'] > LARGE_PURCHASE, t['amount'] > RELATIVE_LARGE_SHARE * credit_limit
+            if large:
+                self.large_amounts.append(t['amount'])
+            if relative:
+                self.relative_amounts.append(t['amount'])
+            if large or relative:
+                self.flagged_amounts.append(t['amount'])
+
+def compliance_state(user):
+    """Return the user's ComplianceState, building it on first use."""
+    state = compliance_states.get(user['name'])
+    if state is None:
+        state = compliance_states[user['name']] = ComplianceState(user)
+    return state
 
 # This function calculates the user's credit utilization and outstanding balance.
 # Utilization is defined as (total purchases - total repaid) / credit limit.
@@ -75,8 +236,8 @@ def calculate_utilization(user):
 # A user is in default if any purchase remains unpaid for 60+ days.
 # Repayments are applied in order to the oldest transactions first.
 def is_user_in_default(user):
-    user_tx = sorted(get_user_transactions(user['name']), key=lambda t: parse_datetime(t['timestamp']))
-    user_rp = sorted(get_user_repayments(user['name']), key=lambda r: parse_datetime(r['timestamp']))
+    user_tx = sorted(get_user_transactions(user['name']), key=lambda t: t['timestamp'])
+    user_rp = sorted(get_user_repayments(user['name']), key=lambda r: r['timestamp'])
     repayments_by_time = user_rp.copy()
     outstanding = 0.0
     for tx in user_tx:
@@ -91,7 +252,7 @@ def is_user_in_default(user):
                 rp['amount'] -= outstanding
                 outstanding = 0
         # If outstanding for this tx > 0 and 60+ days old, default
-        if outstanding > 0 and (datetime.now() - parse_datetime(tx['timestamp'])).days >= DEFAULT_OVERDUE_DAYS:
+        if outstanding > 0 and tx['timestamp'] <= eval_ctx.cutoff(DEFAULT_OVERDUE_DAYS):
             return True
     return False
 
@@ -103,7 +264,8 @@ def calculate_risk_scores(user):
     utilization, _ = calculate_utilization(user)
     overdue = is_user_in_default(user)
     income_status = get_income_verification_status(user['name'])
-    velocity = len([t for t in get_user_transactions(user['name']) if (datetime.now() - parse_datetime(t['timestamp'])).days < 30])
+    cutoff_30d = eval_ctx.cutoff(30)
+    velocity = sum(1 for t in get_user_transactions(user['name']) if t['timestamp'] > cutoff_30d)
     champion = 100 - 50*utilization - (30 if overdue else 0) - (10 if income_status != 'Verified' else 0)
     challenger = 100 - 40*utilization - (40 if overdue else 0) - (10 if income_status != 'Verified' else 0) - (10 if velocity > 5 else 0)
     return {'champion': round(champion, 2), 'challenger': round(challenger, 2)}
@@ -113,13 +275,11 @@ def calculate_risk_scores(user):
 # - Returns 'Income Not Verified for Large Purchase' if any purchase > $500 and not verified.
 # - Returns 'Compliant' otherwise.
 def check_compliance(user):
-    age = (datetime.now() - datetime.strptime(user['dob'], '%Y-%m-%d')).days // 365
-    if age < MIN_AGE:
+    state = compliance_state(user)
+    if eval_ctx.as_of_us < state.majority_us:
         return 'Underage'
-    if get_income_verification_status(user['name']) != 'Verified':
-        for t in get_user_transactions(user['name']):
-            if t['amount'] > 500:
-                return 'Income Not Verified for Large Purchase'
+    if state.income_status != 'Verified' and state.large_amounts:
+        return 'Income Not Verified for Large Purchase'
     return 'Compliant'
 
 # --- Custom Checks ---
@@ -128,7 +288,8 @@ def check_velocity(user, user_result):
     # Checks if the user has more than 10 transactions in the last 7 days.
     # High transaction velocity may indicate risky or fraudulent behavior.
     """Warn if user has >10 transactions in 7 days (high velocity)."""
-    txs_7d = [t for t in get_user_transactions(user['name']) if (datetime.now() - parse_datetime(t['timestamp'])).days < 7]
+    cutoff_7d = eval_ctx.cutoff(7)
+    txs_7d = [t for t in get_user_transactions(user['name']) if t['timestamp'] > cutoff_7d]
     if len(txs_7d) > 10:
         user_result['warnings'].append(f"High transaction velocity: {len(txs_7d)} in 7 days")
 
@@ -136,8 +297,8 @@ def check_inactive(user, user_result):
     # Checks if the user has no transactions in the last 90 days.
     # Inactive users may be at risk of churn or may not need further credit offers.
     """Warn if user has no transactions in last 90 days (inactive)."""
-    txs_90d = [t for t in get_user_transactions(user['name']) if (datetime.now() - parse_datetime(t['timestamp'])).days < 90]
-    if not txs_90d:
+    cutoff_90d = eval_ctx.cutoff(90)
+    if not any(t['timestamp'] > cutoff_90d for t in get_user_transactions(user['name'])):
         user_result['warnings'].append("Inactive user: no transactions in last 90 days")
 
 def check_credit_limit(user, user_result):
@@ -151,26 +312,26 @@ def check_suspicious_repayments(user, user_result):
     """Flag repayments with zero or negative amount."""
     for r in get_user_repayments(user['name']):
         if r['amount'] <= 0:
-            user_result['issues'].append(f"Suspicious repayment: {r['amount']} on {r['timestamp']}")
+            user_result['issues'].append(f"Suspicious repayment: {r['amount']} on {format_timestamp(r['timestamp'])}")
 
 def check_multiple_large_purchases(user, user_result):
     # Flags users who have made more than one large purchase (> $500) without income verification.
     # This is a compliance and risk concern.
     """Flag multiple large purchases without income verification."""
-    large_purchases = [t for t in get_user_transactions(user['name']) if t['amount'] > 500]
-    if len(large_purchases) > 1 and get_income_verification_status(user['name']) != 'Verified':
-        user_result['issues'].append(f"Multiple large purchases without income verification: {len(large_purchases)}")
+    state = compliance_state(user)
+    if len(state.large_amounts) > 1 and state.income_status != 'Verified':
+        user_result['issues'].append(f"Multiple large purchases without income verification: {len(state.large_amounts)}")
 
 def check_future_dated(user, user_result):
     # Flags any transaction or repayment that is dated in the future, which is likely a data error or fraud.
     """Flag future-dated transactions or repayments."""
-    now = datetime.now()
+    now_us = eval_ctx.as_of_us
     for t in get_user_transactions(user['name']):
-        if parse_datetime(t['timestamp']) > now:
-            user_result['issues'].append(f"Future-dated transaction: {t['timestamp']}")
+        if t['timestamp'] > now_us:
+            user_result['issues'].append(f"Future-dated transaction: {format_timestamp(t['timestamp'])}")
     for r in get_user_repayments(user['name']):
-        if parse_datetime(r['timestamp']) > now:
-            user_result['issues'].append(f"Future-dated repayment: {r['timestamp']}")
+        if r['timestamp'] > now_us:
+            user_result['issues'].append(f"Future-dated repayment: {format_timestamp(r['timestamp'])}")
 
 def check_high_utilization(user, user_result):
     # Warns if the user's credit utilization exceeds 80%.
@@ -193,14 +354,13 @@ def check_repayment_before_purchase(user, user_result):
     # Detects repayments made before the user's first purchase.
     # This is a data anomaly and may indicate a processing error.
     """Detect repayments made before first purchase."""
-    tx_times = [parse_datetime(t['timestamp']) for t in get_user_transactions(user['name'])]
+    tx_times = [t['timestamp'] for t in get_user_transactions(user['name'])]
     if not tx_times:
         return
     first_tx = min(tx_times)
     for r in get_user_repayments(user['name']):
-        r_time = parse_datetime(r['timestamp'])
-        if r_time < first_tx:
-            user_result['issues'].append(f"Repayment before first purchase: {r['timestamp']}")
+        if r['timestamp'] < first_tx:
+            user_result['issues'].append(f"Repayment before first purchase: {format_timestamp(r['timestamp'])}")
 
 def check_duplicate_transactions(user, user_result):
     # Identifies duplicate transactions (same amount and timestamp), which may be accidental or fraudulent.
@@ -214,32 +374,34 @@ def check_duplicate_transactions(user, user_result):
             seen[key] = [t]
     for key, txs in seen.items():
         if len(txs) > 1:
-            user_result['issues'].append(f"Duplicate transactions: amount {key[0]} at {key[1]} ({len(txs)} times)")
+            user_result['issues'].append(f"Duplicate transactions: amount {key[0]} at {format_timestamp(key[1])} ({len(txs)} times)")
 
 def check_high_relative_transaction(user, user_result):
     # Flags purchases that are greater than 90% of the user's credit limit without income verification.
     # Large relative purchases are risky if not verified.
     """Flag large purchases relative to credit limit without income verification."""
     credit_limit = user.get('credit_limit', DEFAULT_CREDIT_LIMIT)
-    income_status = get_income_verification_status(user['name'])
-    for t in get_user_transactions(user['name']):
-        if t['amount'] > 0.9 * credit_limit and income_status != 'Verified':
-            user_result['issues'].append(
-                f"High relative transaction ({t['amount']} > 90% of {credit_limit}) without income verification"
-            )
+    state = compliance_state(user)
+    if state.income_status == 'Verified':
+        return
+    for amount in state.relative_amounts:
+        user_result['issues'].append(
+            f"High relative transaction ({amount} > 90% of {credit_limit}) without income verification"
+        )
 
 def check_large_purchase_verification(user, user_result):
     # Checks for any purchase that is either > $500 or > 90% of credit limit without income verification.
     # This is a compliance and risk check for large, unverified purchases.
     """Check both absolute ($500) and relative (90% of limit) large purchases."""
-    credit_limit = user.get('credit_limit', DEFAULT_CREDIT_LIMIT)
-    income_status = get_income_verification_status(user['name'])
-    for t in get_user_transactions(user['name']):
-        if (t['amount'] > 500 or t['amount'] > 0.9 * credit_limit) and income_status != 'Verified':
-            user_result['issues'].append(f"Large purchase without income verification: {t['amount']}")
+    state = compliance_state(user)
+    if state.income_status == 'Verified':
+        return
+    for amount in state.flagged_amounts:
+        user_result['issues'].append(f"Large purchase without income verification: {amount}")
 
 # --- Main Validation Logic ---
 # ALL_CHECKS maps check names to their functions for modular CLI selection
+# report_store.CHECK_PREFIXES maps their messages back to these names; update it with any new message
 ALL_CHECKS = {
     'utilization': lambda u, r: r['issues'].append(f"Utilization out of bounds: {calculate_utilization(u)[0]:.2f}") if not (0 <= calculate_utilization(u)[0] <= 1.0) else None,
     'outstanding': lambda u, r: r['issues'].append(f"Outstanding negative balance: {calculate_utilization(u)[1]:.2f}") if calculate_utilization(u)[1] < 0 else None,
@@ -261,73 +423,259 @@ ALL_CHECKS = {
     'high_relative_transaction': check_high_relative_transaction,
 }
 
+# --- Profiling ---
+# With --profile, every check is timed per user and attributed to a bucket of
+# the user's history length (transactions + repayments). A check whose mean
+# time per user grows faster than linearly with history length (log-log slope
+# above SUPERLINEAR_EXPONENT across the populated buckets) is flagged.
+SUPERLINEAR_EXPONENT = 1.25
+MIN_BUCKETS_FOR_FIT = 3
+
+def history_bucket(n):
+    """Return the power-of-two bucket label for a history length: 0, 1, 2-3, 4-7, ..."""
+    if n < 2:
+        return str(n)
+    low = 1 << (n.bit_length() - 1)
+    return f"{low}-{2 * low - 1}"
+
+def growth_exponent(points):
+    """Least-squares slope of log(time) against log(history length) over (length, time) points."""
+    points = [(math.log(h), math.log(t)) for h, t in points if h > 0 and t > 0]
+    if len(points) < MIN_BUCKETS_FOR_FIT:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    var_x = sum((x - mean_x) ** 2 for x, _ in points)
+    if var_x == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x
+
+class CheckProfiler:
+    """Collects wall time, record visits and allocated bytes per check and per history-size bucket."""
+
+    def __init__(self):
+        self.stats = defaultdict(lambda: defaultdict(lambda: {'users': 0, 'wall_s': 0.0, 'record_visits': 0, 'alloc_bytes': 0, 'history': 0}))
+        tracemalloc.start()
+
+    def run(self, name, check, user, user_result, history):
+        """Run one check for one user and attribute its cost."""
+        visits_before = profile_counters['record_visits']
+        tracemalloc.reset_peak()
+        mem_before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        check(user, user_result)
+        elapsed = time.perf_counter() - start
+        bucket = self.stats[name][history_bucket(history)]
+        bucket['users'] += 1
+        bucket['wall_s'] += elapsed
+        bucket['record_visits'] += profile_counters['record_visits'] - visits_before
+        bucket['alloc_bytes'] += tracemalloc.get_traced_memory()[1] - mem_before
+        bucket['history'] += history
+
+    def report(self):
+        """Return the 'performance' section of the report."""
+        tracemalloc.stop()
+        checks = {}
+        for name, buckets in self.stats.items():
+            totals = {k: sum(b[k] for b in buckets.values()) for k in ('users', 'wall_s', 'record_visits', 'alloc_bytes')}
+            exponent = growth_exponent([(b['history'] / b['users'], b['wall_s'] / b['users']) for b in buckets.values()])
+            checks[name] = {
+                'calls': totals['users'],
+                'wall_ms': round(totals['wall_s'] * 1000, 3),
+                'record_visits': totals['record_visits'],
+                'alloc_bytes': totals['alloc_bytes'],
+                'growth_exponent': None if exponent is None else round(exponent, 3),
+                'super_linear': exponent is not None and exponent > SUPERLINEAR_EXPONENT,
+                'by_history_size': {
+                    label: {
+                        'users': b['users'],
+                        'wall_ms': round(b['wall_s'] * 1000, 3),
+                        'mean_us_per_user': round(b['wall_s'] / b['users'] * 1e6, 2),
+                        'record_visits': b['record_visits'],
+                        'alloc_bytes': b['alloc_bytes'],
+                    }
+                    for label, b in sorted(buckets.items(), key=lambda kv: int(kv[0].split('-')[0]))
+                },
+            }
+        return {
+            'checks': dict(sorted(checks.items(), key=lambda kv: -kv[1]['wall_ms'])),
+            'super_linear_checks': sorted(name for name, c in checks.items() if c['super_linear']),
+        }
+
+# --- Report Writers ---
+# Each user's result is written as soon as the user has been checked, so a
+# report never holds more than one block of results in memory:
+#
+#   json   the classic report, {"summary", "results", "performance"} with
+#          indent 2. Results are spooled to a temporary file and copied in
+#          after the summary, which is only known at the end.
+#   jsonl  one result per line, then a final {"summary", "performance"} line
+#   csv    name, issues, warnings, scores, compliance
+#   block  the compressed columnar format of blockfile.py, with the summary
+#          and performance stored as the index metadata. Read it back with
+#          blockfile.load(path) and blockfile.read_index(path).
+#
+# With --flagged-only only users with issues or warnings are written; the
+# summary still counts every user checked.
+REPORT_FORMATS = {'.json': 'json', '.jsonl': 'jsonl', '.csv': 'csv', '.blk': 'block'}
+CSV_FIELDS = ['name', 'issues', 'warnings', 'scores', 'compliance']
+
+class JsonReportWriter:
+    def __init__(self, path):
+        self.path = path
+        self.spool = tempfile.TemporaryFile('w+')
+        self.count = 0
+
+    def write(self, result):
+        item = json.dumps(result, indent=2, default=str).replace('\n', '\n    ')
+        self.spool.write((',\n    ' if self.count else '    ') + item)
+        self.count += 1
+
+    def close(self, summary, performance):
+        with open(self.path, 'w') as f:
+            summary_text = json.dumps(summary, indent=2, default=str).replace('\n', '\n  ')
+            f.write(f'{{\n  "summary": {summary_text},\n  "results": ')
+            if self.count:
+                f.write('[\n')
+                self.spool.seek(0)
+                shutil.copyfileobj(self.spool, f)
+                f.write('\n  ]')
+            else:
+                f.write('[]')
+            if performance:
+                f.write(',\n  "performance": ' + json.dumps(performance, indent=2, default=str).replace('\n', '\n  '))
+            f.write('\n}')
+        self.spool.close()
+
+class JsonLinesReportWriter:
+    def __init__(self, path):
+        self.f = open(path, 'w')
+
+    def write(self, result):
+        self.f.write(json.dumps(result, default=str, separators=(',', ':')) + '\n')
+
+    def close(self, summary, performance):
+        trailer = {'summary': summary}
+        if performance:
+            trailer['performance'] = performance
+        self.f.write(json.dumps(trailer, default=str, separators=(',', ':')) + '\n')
+        self.f.close()
+
+class CsvReportWriter:
+    def __init__(self, path):
+        self.f = open(path, 'w', newline='')
+        self.writer = csv.writer(self.f)
+        self.writer.writerow(CSV_FIELDS)
+
+    def write(self, result):
+        self.writer.writerow([result['name'], '; '.join(result['issues']), '; '.join(result['warnings']),
+                              json.dumps(result['scores']), result['compliance']])
+
+    def close(self, summary, performance):
+        self.f.close()
+
+class BlockReportWriter:
+    def __init__(self, path):
+        self.f = open(path, 'wb')
+        # Results are read in full, not per user, so no postings are kept and memory stays at one block
+        self.writer = blockfile.BlockWriter(self.f, default=str, index_users=False)
+
+    def write(self, result):
+        self.writer.write(result)
+
+    def close(self, summary, performance):
+        meta = {'summary': summary}
+        if performance:
+            meta['performance'] = performance
+        self.writer.close(meta)
+        self.f.close()
+
+REPORT_WRITERS = {'json': JsonReportWriter, 'jsonl': JsonLinesReportWriter, 'csv': CsvReportWriter, 'block': BlockReportWriter}
+
+def print_user_result(r):
+    print(f"\nUser: {r['name']}")
+    for i in r['issues']:
+        print(f"  ISSUE: {i}")
+    for w in r['warnings']:
+        print(f"  WARNING: {w}")
+    print(f"  Scores: {r['scores']}")
+    print(f"  Compliance: {r['compliance']}")
+
 # --- CLI Argument Parsing ---
 parser = argparse.ArgumentParser(description="Advanced BNPL Risk Model Validation")
 parser.add_argument('--checks', type=str, default=','.join(ALL_CHECKS.keys()), help='Comma-separated list of checks to run')
-parser.add_argument('--output', type=str, default='risk_validation_report.json', help='Output file name (json or csv)')
+parser.add_argument('--output', type=str, default='risk_validation_report.json', help='Output file name (.json, .jsonl, .csv or .blk)')
+parser.add_argument('--format', choices=sorted(REPORT_WRITERS), default=None, help='Report format (default: from the output file extension)')
+parser.add_argument('--flagged-only', action='store_true', help='Write only users with issues or warnings to the report')
 parser.add_argument('--summary-only', action='store_true', help='Print only summary to console')
 parser.add_argument('--user', type=str, default=None, help='Validate only a specific user (by name)')
+parser.add_argument('--as-of', type=datetime.fromisoformat, default=None, help='Evaluate all checks as of this ISO timestamp (default: now)')
+parser.add_argument('--profile', action='store_true', help='Record per-check time, record visits and allocations, and add a performance section to the report')
+parser.add_argument('--store', type=str, default=None, help='Also add the run to the report store in this directory (see report_store.py)')
 args = parser.parse_args()
+eval_ctx = EvalContext(args.as_of)
 
 selected_checks = [c.strip() for c in args.checks.split(',') if c.strip() in ALL_CHECKS]
 output_path = os.path.join(os.path.dirname(__file__), args.output)
+report_format = args.format or REPORT_FORMATS.get(os.path.splitext(args.output)[1].lower())
+if report_format is None:
+    parser.error(f"Cannot tell the report format of {args.output}; use one of {', '.join(REPORT_FORMATS)} or --format")
 
 # --- Run Validations ---
-results = []
+summary = {'total_users': 0, 'users_with_issues': 0, 'users_with_warnings': 0, 'issues': 0, 'warnings': 0,
+           'as_of': eval_ctx.as_of.isoformat()}
+report = REPORT_WRITERS[report_format](output_path)
+store_run = report_store.ReportStore(os.path.join(os.path.dirname(__file__), args.store)).writer(source=output_path) if args.store else None
 users_to_check = [u for u in users if (args.user is None or u['name'] == args.user)]
+profiler = CheckProfiler() if args.profile else None
+if not args.summary_only:
+    print("\n=== RISK MODEL VALIDATION REPORT ===")
 for user in users_to_check:
     user_result = {'name': user['name'], 'issues': [], 'warnings': [], 'scores': {}, 'compliance': None}
     # Run all selected checks
-    for check in selected_checks:
-        ALL_CHECKS[check](user, user_result)
+    if profiler:
+        history = len(get_user_transactions(user['name'])) + len(get_user_repayments(user['name']))
+        for check in selected_checks:
+            profiler.run(check, ALL_CHECKS[check], user, user_result, history)
+    else:
+        for check in selected_checks:
+            ALL_CHECKS[check](user, user_result)
     user_result['scores'] = calculate_risk_scores(user)
     user_result['compliance'] = check_compliance(user)
-    results.append(user_result)
+    flagged = bool(user_result['issues'] or user_result['warnings'])
+    summary['total_users'] += 1
+    summary['users_with_issues'] += bool(user_result['issues'])
+    summary['users_with_warnings'] += bool(user_result['warnings'])
+    summary['issues'] += len(user_result['issues'])
+    summary['warnings'] += len(user_result['warnings'])
+    if flagged or not args.flagged_only:
+        report.write(user_result)
+    if store_run:
+        store_run.add(user_result)
+    if flagged and not args.summary_only:
+        print_user_result(user_result)
 
 # --- Output Results ---
-summary = {
-    'total_users': len(users_to_check),
-    'users_with_issues': sum(1 for r in results if r['issues']),
-    'users_with_warnings': sum(1 for r in results if r['warnings']),
-    'issues': sum(len(r['issues']) for r in results),
-    'warnings': sum(len(r['warnings']) for r in results),
-}
-
-# Print results to console
+print("\n=== RISK MODEL VALIDATION SUMMARY ===")
+print(f"Total users: {summary['total_users']}")
+print(f"Users with issues: {summary['users_with_issues']}")
+print(f"Users with warnings: {summary['users_with_warnings']}")
+print(f"Total issues: {summary['issues']}")
+print(f"Total warnings: {summary['warnings']}")
 if not args.summary_only:
-    print("\n=== RISK MODEL VALIDATION REPORT ===")
-    print(f"Total users: {summary['total_users']}")
-    print(f"Users with issues: {summary['users_with_issues']}")
-    print(f"Users with warnings: {summary['users_with_warnings']}")
-    print(f"Total issues: {summary['issues']}")
-    print(f"Total warnings: {summary['warnings']}")
-    for r in results:
-        if r['issues'] or r['warnings']:
-            print(f"\nUser: {r['name']}")
-            for i in r['issues']:
-                print(f"  ISSUE: {i}")
-            for w in r['warnings']:
-                print(f"  WARNING: {w}")
-            print(f"  Scores: {r['scores']}")
-            print(f"  Compliance: {r['compliance']}")
-else:
-    print("\n=== RISK MODEL VALIDATION SUMMARY ===")
-    print(f"Total users: {summary['total_users']}")
-    print(f"Users with issues: {summary['users_with_issues']}")
-    print(f"Users with warnings: {summary['users_with_warnings']}")
-    print(f"Total issues: {summary['issues']}")
-    print(f"Total warnings: {summary['warnings']}")
-
-# Save results to file (JSON or CSV)
-if args.output.endswith('.json'):
-    with open(output_path, 'w') as f:
-        json.dump({'summary': summary, 'results': results}, f, indent=2, default=str)
-    print(f"\nDetailed report saved to {output_path}")
-elif args.output.endswith('.csv'):
-    import csv
-    with open(output_path, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(['name', 'issues', 'warnings', 'scores', 'compliance'])
-        for r in results:
-            writer.writerow([r['name'], '; '.join(r['issues']), '; '.join(r['warnings']), json.dumps(r['scores']), r['compliance']])
-    print(f"\nDetailed report saved to {output_path}") 
\ No newline at end of file
+    print(f"As of: {summary['as_of']}")
+
+# Print per-check cost attribution
+performance = profiler.report() if profiler else None
+if performance:
+    print("\n=== CHECK PERFORMANCE ===")
+    print(f"{'check':<28}{'wall ms':>10}{'visits':>10}{'alloc KB':>10}{'exponent':>10}")
+    for name, c in performance['checks'].items():
+        exponent = '-' if c['growth_exponent'] is None else f"{c['growth_exponent']:.2f}"
+        flag = '  SUPER-LINEAR' if c['super_linear'] else ''
+        print(f"{name:<28}{c['wall_ms']:>10.2f}{c['record_visits']:>10}{c['alloc_bytes'] / 1024:>10.1f}{exponent:>10}{flag}")
+
+report.close(summary, performance)
+print(f"\nDetailed report saved to {output_path}")
+if store_run:
+    print(f"Stored as run {store_run.close(summary)['id']} in {store_run.store.directory}")